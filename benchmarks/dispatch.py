@@ -0,0 +1,146 @@
+"""Measures the callback dispatch rate of ``_MulticastWrapper``.
+
+A tick stream is replayed through the wrapper of a ``TwsClient`` whose socket does nothing. The
+stream is either a recording, a CSV file of ``kind,req_id,field,value`` rows, or ticks derived
+from the bundled HSI/HHI bars spread over ``--subscriptions`` market data requests. The ids of the
+stream are mapped onto the subscriptions of the run, in the order of their first tick. With
+``--churn`` another thread keeps creating and cancelling requests while the ticks are dispatched.
+
+Usage::
+
+    $ python -m benchmarks.dispatch --subscriptions 300 --churn
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import threading
+import time
+from datetime import date
+
+import core.datatools
+from providers.ibtws import TwsClient, TickType
+from providers.registry import RequestRegistry
+
+
+class NullSocket(object):
+    """Stands in for EPosixClientSocket, ignoring every call."""
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class NullHandler(object):
+    """Counts the ticks dispatched to a request."""
+    def __init__(self):
+        self.count = 0
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        self.count += 1
+
+    def tickSize(self, request, field, size):
+        self.count += 1
+
+    def tickGeneric(self, request, tick_type, value):
+        self.count += 1
+
+    def tickString(self, request, tick_type, value):
+        self.count += 1
+
+
+def read_recording(path: str):
+    """Reads a recorded tick stream of ``kind,req_id,field,value`` rows."""
+    with open(path, newline='') as csv_file:
+        return [(kind, int(req_id), int(field), float(value))
+                for kind, req_id, field, value in csv.reader(csv_file)]
+
+
+def ticks_from_bars(subscriptions: int, start: date = date(2010, 1, 4),
+                    end: date = date(2010, 1, 29)):
+    """Derives a tick stream from the bundled bars, a price and a size tick per bar price."""
+    ticks = []
+    for symbol in ('HSI', 'HHI.HK'):
+        bars = core.datatools.load_bars('HKFE', 'IND', symbol, start, end)
+        for index, bar in enumerate(bars[['open', 'high', 'low', 'close', 'bar_count']].tolist()):
+            req_id = index % subscriptions + 1
+            for price in bar[:4]:
+                ticks.append(('price', req_id, TickType.Last, price))
+                ticks.append(('size', req_id, TickType.LastSize, bar[4]))
+    return ticks
+
+
+def replay(wrapper, ticks):
+    """Dispatches the ticks through the wrapper and returns the elapsed seconds."""
+    dispatch = {
+        'price': lambda req_id, field, value: wrapper.tickPrice(req_id, field, value, 0),
+        'size': lambda req_id, field, value: wrapper.tickSize(req_id, field, int(value)),
+        'generic': wrapper.tickGeneric,
+        'string': lambda req_id, field, value: wrapper.tickString(req_id, field, str(value))}
+    calls = [(dispatch[kind], req_id, field, value) for kind, req_id, field, value in ticks]
+    started = time.perf_counter()
+    for call, req_id, field, value in calls:
+        call(req_id, field, value)
+    return time.perf_counter() - started
+
+
+def run(ticks, subscriptions: int, churn: bool = False) -> dict:
+    """Replays ticks through a client holding the subscriptions and returns the measured rates.
+    The client has a registry of its own, its subscriptions are cancelled once replayed."""
+    client = TwsClient(client_id=0, socket_factory=NullSocket,
+                       registry=RequestRegistry(timer=False))
+    handlers = [NullHandler() for _ in range(subscriptions)]
+    requests = [client.reqMarketData(handler, None, "") for handler in handlers]
+    request_ids = {}
+    for _, req_id, _, _ in ticks:
+        if req_id not in request_ids:
+            request_ids[req_id] = requests[len(request_ids) % subscriptions].request_id
+    ticks = [(kind, request_ids[req_id], field, value) for kind, req_id, field, value in ticks]
+
+    stop = threading.Event()
+    churned = [0]
+
+    def churn_requests():
+        while not stop.is_set():
+            client.reqMarketData(NullHandler(), None, "").cancel()
+            churned[0] += 1
+
+    churner = threading.Thread(target=churn_requests) if churn else None
+    if churner is not None:
+        churner.start()
+    try:
+        elapsed = replay(client._wrapper, ticks)
+    finally:
+        stop.set()
+        if churner is not None:
+            churner.join()
+        for request in requests:
+            request.cancel()
+
+    return {'callbacks': len(ticks),
+            'dispatched': sum(handler.count for handler in handlers),
+            'seconds': elapsed,
+            'callbacks_per_second': len(ticks) / elapsed,
+            'churned_requests': churned[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recording', help='CSV file of kind,req_id,field,value rows.')
+    parser.add_argument('--subscriptions', type=int, default=300)
+    parser.add_argument('--churn', action='store_true',
+                        help='Create and cancel requests meanwhile.')
+    args = parser.parse_args()
+
+    ticks = read_recording(args.recording) if args.recording else \
+        ticks_from_bars(args.subscriptions)
+    result = run(ticks, args.subscriptions, args.churn)
+    print('%(callbacks)d callbacks in %(seconds).3f s - %(callbacks_per_second).0f callbacks/s '
+          '(%(churned_requests)d requests churned).' % result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Benchmarks of the data path on the bundled ``market-data/ib/hk`` sample.
+
+Measures the CSV parse throughput, the latency of range loads, the resampling speed and the
+``_MulticastWrapper`` dispatch rate. Every case is run ``--repeat`` times and the best run is
+kept, which is the least noisy estimate of the cost. Results are printed as JSON and, given a
+``--baseline``, compared with a stored run; the exit status is 1 when a case regressed by more
+than ``--tolerance``.
+
+Usage::
+
+    $ python -m benchmarks.suite --save benchmarks/baseline.json
+    $ python -m benchmarks.suite --baseline benchmarks/baseline.json --tolerance 0.25
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+import core.datatools
+from benchmarks import dispatch
+from core.resample import resample
+
+SAMPLE_START = date(2010, 1, 1)
+SAMPLE_END = date(2010, 9, 9)
+
+
+class Case(object):
+    """Represents a benchmark case.
+
+    Args:
+        name: unique name of the case, the key of its result.
+        unit: unit of the measured value, e.g. ``rows/s``.
+        setup: called once, returns the argument of ``run``.
+        run: the measured call, returns the amount of work done, e.g. the number of rows. Cases
+            with no amount are latencies measured in seconds, lower is better.
+    """
+    def __init__(self, name: str, unit: str, setup, run):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+
+    @property
+    def higher_is_better(self) -> bool:
+        return self.unit != 's'
+
+    def measure(self, repeat: int) -> float:
+        argument = self.setup()
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            amount = self.run(argument)
+            elapsed = time.perf_counter() - started
+            value = elapsed if amount is None else amount / elapsed
+            if best is None or (value > best if self.higher_is_better else value < best):
+                best = value
+        return best
+
+
+def _sample_files():
+    root = core.datatools.MARKET_DATA_DIR
+    return [os.path.join(root, name, 'HKFE-IND-HSI.csv') for name in sorted(os.listdir(root))]
+
+
+def _sample_bars():
+    return core.datatools.load_bars('HKFE', 'IND', 'HSI', SAMPLE_START, SAMPLE_END)
+
+
+def _sample_dates():
+    return core.datatools.format_ib_dates(_sample_bars()['date']).astype('S18')
+
+
+def _parse_dates(values):
+    return len(core.datatools.parse_ib_dates(values))
+
+
+def _read_csv(paths):
+    return sum(len(core.datatools.read_bar_csv(path)) for path in paths)
+
+
+def _load(start: date, end: date):
+    def load(_):
+        core.datatools.load_bars('HKFE', 'IND', 'HSI', start, end)
+    return load
+
+
+def _resample(bar_size: str):
+    def resample_bars(bars):
+        resample(bars, bar_size)
+        return len(bars)
+    return resample_bars
+
+
+def _dispatch(ticks):
+    return dispatch.run(ticks, DISPATCH_SUBSCRIPTIONS)['callbacks']
+
+
+DISPATCH_SUBSCRIPTIONS = 300
+
+CASES = [
+    Case('parse_dates', 'rows/s', _sample_dates, _parse_dates),
+    Case('read_csv', 'rows/s', _sample_files, _read_csv),
+    Case('load_day', 's', lambda: None, _load(date(2010, 3, 1), date(2010, 3, 1))),
+    Case('load_month', 's', lambda: None, _load(date(2010, 3, 1), date(2010, 3, 31))),
+    Case('load_all', 's', lambda: None, _load(SAMPLE_START, SAMPLE_END)),
+    Case('resample_1min', 'bars/s', _sample_bars, _resample("1 min")),
+    Case('resample_1hour', 'bars/s', _sample_bars, _resample("1 hour")),
+    Case('resample_1day', 'bars/s', _sample_bars, _resample("1 day")),
+    Case('dispatch', 'callbacks/s', lambda: dispatch.ticks_from_bars(DISPATCH_SUBSCRIPTIONS),
+         _dispatch),
+]
+"""The benchmark cases, in run order."""
+
+
+def run(cases=None, repeat: int = 5) -> dict:
+    """Runs the cases and returns the results as a JSON compatible dict."""
+    results = OrderedDict()
+    for case in cases or CASES:
+        results[case.name] = {'value': case.measure(repeat), 'unit': case.unit}
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Compares results with a baseline.
+
+    Returns:
+        list: ``(name, value, baseline value, relative change, regressed)`` of the cases present
+        in both, relative changes are positive for improvements.
+    """
+    rows = []
+    for name, result in results['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            continue
+        change = result['value'] / reference['value'] - 1
+        if result['unit'] == 's':
+            change = reference['value'] / result['value'] - 1
+        rows.append((name, result['value'], reference['value'], change, change < -tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case, the best is kept.')
+    parser.add_argument('--case', action='append', help='Runs the named cases only.')
+    parser.add_argument('--save', help='Writes the results to a JSON file.')
+    parser.add_argument('--baseline', help='JSON file of results to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative slowdown reported as a regression.')
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if args.case is None or case.name in args.case]
+    results = run(cases, args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.save, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+            json_file.write('\n')
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as json_file:
+        baseline = json.load(json_file)
+    regressed = False
+    for name, value, reference, change, is_regression in compare(results, baseline, args.tolerance):
+        regressed |= is_regression
+        print('%-16s %14.6g %14.6g %+7.1f%%%s' % (name, value, reference, 100 * change,
+                                                 '  REGRESSION' if is_regression else ''),
+              file=sys.stderr)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Alignment of the bars of several contracts on a shared time grid.
+
+``align`` puts the bars of each contract on one grid of timestamps, the union of their dates by
+default, and returns a column per contract for each field, e.g. for the HSI/HHI spread::
+
+    aligned = load_aligned(['HKFE-IND-HSI', 'HKFE-IND-HHI.HK'], date(2010, 1, 1),
+                           date(2010, 12, 31), columns=('close',))
+    hsi, hhi = aligned.values['close'].T
+    spread = np.where(aligned.mask.any(axis=1), np.nan, hsi - hhi)
+
+Each contract is matched to the grid with one ``searchsorted`` over its sorted dates, with no
+per-day merge. With ``Fill.AsOf`` a grid time takes the last bar at or before it, with
+``Fill.Exact`` only the bar of that time; ``mask`` flags the grid times without a complete bar
+of their own.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+from datetime import date
+from enum import Enum
+
+import numpy as np
+
+import core.datatools
+
+
+class Fill(Enum):
+    """Represents how grid times without a bar are filled."""
+    Exact = "exact"  # Left NaN.
+    AsOf = "as of"  # Filled from the last bar before, forward-filling the missing bars.
+
+
+AlignedBars = namedtuple('AlignedBars', ['dates', 'keys', 'values', 'mask'])
+"""Represents bars aligned on a grid. ``dates`` are the grid times, ``values`` maps each column to
+a float array of shape ``(len(dates), len(keys))`` and ``mask`` is True where a contract has no
+bar of its own at a time, or a bar with gaps."""
+
+
+def align(bars_by_key, columns=('open', 'high', 'low', 'close'), grid=None,
+          fill: Fill = Fill.AsOf, max_age: int = None) -> AlignedBars:
+    """Aligns bars sorted by date.
+
+    Args:
+        bars_by_key: ``(key, bars)`` pairs or a mapping of them, bars are ``BAR_DTYPE`` arrays
+            or mappings of their columns.
+        grid: the epoch seconds to align on, the sorted union of the dates of the bars if None.
+        fill: how times without a bar are filled.
+        max_age: the oldest bar in seconds an ``AsOf`` fill may use, e.g. 3600 not to carry the
+            close over night.
+    """
+    pairs = list(bars_by_key.items()) if hasattr(bars_by_key, 'items') else list(bars_by_key)
+    keys = [key for key, _ in pairs]
+    all_dates = [np.asarray(bars['date'], dtype=np.int64) for _, bars in pairs]
+    if grid is None:
+        grid = _union(all_dates)
+    grid = np.asarray(grid, dtype=np.int64)
+
+    values = {name: np.full((len(grid), len(keys)), np.nan) for name in columns}
+    mask = np.ones((len(grid), len(keys)), dtype=bool)
+    for index, ((_, bars), dates) in enumerate(zip(pairs, all_dates)):
+        # Position of the last bar at or before each grid time, -1 before the first bar.
+        positions = np.searchsorted(dates, grid, side='right') - 1
+        found = positions >= 0
+        exact = found.copy()
+        exact[found] = dates[positions[found]] == grid[found]
+        if _has_column(bars, 'has_gaps'):
+            complete = exact.copy()
+            complete[exact] = ~np.asarray(bars['has_gaps'], dtype=bool)[positions[exact]]
+        else:
+            complete = exact
+        mask[:, index] = ~complete
+
+        usable = exact if fill == Fill.Exact else found
+        if fill == Fill.AsOf and max_age is not None:
+            usable = usable.copy()
+            usable[found] &= grid[found] - dates[positions[found]] <= max_age
+        for name in columns:
+            values[name][usable, index] = np.asarray(bars[name], dtype=np.float64)[
+                positions[usable]]
+    return AlignedBars(grid, keys, values, mask)
+
+
+def load_aligned(keys, start: date, end: date, columns=('open', 'high', 'low', 'close'),
+                 fill: Fill = Fill.AsOf, max_age: int = None,
+                 root_dir: str = core.datatools.MARKET_DATA_DIR, cache=None) -> AlignedBars:
+    """Loads the bars of contracts between two dates (inclusive) and aligns them.
+
+    Args:
+        keys: the ``contract_key`` of each contract, e.g. ``HKFE-IND-HSI``.
+        cache: a ``core.cache.BarCache`` to read through, see ``load_bars``.
+    """
+    bars_by_key = []
+    for key in keys:
+        exchange, sec_type, symbol = key.split('-', 2)
+        bars_by_key.append((key, core.datatools.load_bars(
+            exchange, sec_type, symbol, start, end, columns=_load_columns(columns),
+            root_dir=root_dir, cache=cache)))
+    return align(bars_by_key, columns, fill=fill, max_age=max_age)
+
+
+def _union(all_dates) -> np.ndarray:
+    """Merges sorted dates into their sorted union, the stable sort merges the sorted runs in
+    linear time."""
+    if not all_dates:
+        return np.empty(0, dtype=np.int64)
+    dates = np.sort(np.concatenate(all_dates), kind='mergesort')
+    keep = np.ones(len(dates), dtype=bool)
+    keep[1:] = dates[1:] != dates[:-1]
+    return dates[keep]
+
+
+def _has_column(bars, name) -> bool:
+    names = getattr(getattr(bars, 'dtype', None), 'names', None)
+    return name in (bars if names is None else names)
+
+
+def _load_columns(columns):
+    return ('date',) + tuple(name for name in columns if name not in ('date', 'has_gaps')) + \
+        ('has_gaps',)
@@ -0,0 +1,186 @@
+"""Backtests strategies over stored bars.
+
+Orders are filled at the open of the bar after the one they are decided on. Positions, fills
+and the equity curve of a run are computed with array operations, whichever way the positions
+are decided:
+
+* a signal is a function ``signal(bars, **params)`` returning the target position at the close
+  of every bar, for strategies that can be expressed over whole arrays::
+
+      def momentum(bars, lookback):
+          change = bars['close'][lookback:] - bars['close'][:-lookback]
+          return np.concatenate((np.zeros(lookback), np.sign(change)))
+
+      result = run_vectorized(bars, momentum, lookback=120)
+
+* a strategy is an object whose ``on_bar(broker, bar)`` is called with each bar and places
+  orders on a ``SimulatedBroker``, for path-dependent logic, see ``run_events``.
+
+``sweep`` runs a signal or a strategy class over a grid of parameters on a process pool.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from core.broker import Broker
+from core.datatools import BAR_COLUMNS
+
+HSI_MULTIPLIER = 50  # HKD per index point of a Hang Seng Index future.
+
+FILL_DTYPE = np.dtype([('date', np.int64), ('quantity', np.float64), ('price', np.float64)])
+
+Bar = namedtuple('Bar', BAR_COLUMNS)
+"""Represents the bar given to ``on_bar``."""
+
+
+class BacktestResult(namedtuple('BacktestResult', ['dates', 'positions', 'equity', 'fills'])):
+    """Represents a run, ``positions`` and ``equity`` are at the close of each bar, ``fills`` a
+    ``FILL_DTYPE`` array."""
+    __slots__ = ()
+
+    @property
+    def pnl(self) -> float:
+        return float(self.equity[-1]) if len(self.equity) else 0.0
+
+    @property
+    def max_drawdown(self) -> float:
+        """The largest fall of the equity from a previous high, a positive amount."""
+        if not len(self.equity):
+            return 0.0
+        return float(np.max(np.maximum.accumulate(np.maximum(self.equity, 0)) - self.equity))
+
+
+SweepResult = namedtuple('SweepResult', ['params', 'pnl', 'max_drawdown', 'trades'])
+"""Represents the outcome of a run of a sweep."""
+
+
+class SimulatedBroker(Broker):
+    """Represents a broker filling the orders at the open of the next bar."""
+    def __init__(self):
+        self._position = 0.0
+        self._pending = 0.0
+        self._fills = []
+
+    @property
+    def position(self) -> float:
+        """The position held, without the pending orders."""
+        return self._position
+
+    def order(self, quantity: float):
+        """Places an order of ``quantity`` contracts, negative to sell."""
+        self._pending += quantity
+
+    def order_target(self, position: float):
+        """Places the order that brings the position to ``position``."""
+        self._pending = position - self._position
+
+    def get_orders(self):
+        """Gets the filled orders as ``(date, quantity, price)``."""
+        return list(self._fills)
+
+    def _fill(self, date_, price):
+        if self._pending:
+            self._fills.append((date_, self._pending, price))
+            self._position += self._pending
+            self._pending = 0.0
+
+
+def run_vectorized(bars: np.ndarray, signal, multiplier: float = HSI_MULTIPLIER,
+                   commission: float = 0.0, **params) -> BacktestResult:
+    """Runs a signal over bars sorted by date.
+
+    Args:
+        signal: called with the bars and ``params``, returns the target positions.
+        multiplier: currency per point and contract.
+        commission: currency per contract traded.
+    """
+    targets = np.asarray(signal(bars, **params), dtype=np.float64)
+    if len(targets) != len(bars):
+        raise ValueError("Signal returned %d positions for %d bars." % (len(targets), len(bars)))
+    held = np.empty(len(targets))
+    held[:1] = 0.0
+    held[1:] = targets[:-1]
+    return _account(bars, held, multiplier, commission)
+
+
+def run_events(bars: np.ndarray, strategy, multiplier: float = HSI_MULTIPLIER,
+               commission: float = 0.0) -> BacktestResult:
+    """Runs a strategy calling ``strategy.on_bar(broker, bar)`` with a ``SimulatedBroker`` and
+    each ``Bar``, sorted by date."""
+    broker = SimulatedBroker()
+    held = np.empty(len(bars))
+    for index, row in enumerate(bars[list(BAR_COLUMNS)].tolist()):
+        bar = Bar._make(row)
+        broker._fill(bar.date, bar.open)
+        held[index] = broker.position
+        strategy.on_bar(broker, bar)
+    return _account(bars, held, multiplier, commission)
+
+
+def sweep(strategy, grid, bars: np.ndarray, workers: int = None,
+          multiplier: float = HSI_MULTIPLIER, commission: float = 0.0):
+    """Runs a signal, or a strategy class instantiated with the parameters, over a grid.
+
+    Args:
+        strategy: a signal, see ``run_vectorized``, or a class whose instances have ``on_bar``.
+        grid: a mapping of parameter names to their values, all their combinations are run, or a
+            sequence of parameter mappings.
+        workers: processes of the pool, 1 runs in this process.
+
+    Returns:
+        list: the ``SweepResult`` of each combination, in grid order.
+    """
+    if hasattr(grid, 'items'):
+        names = sorted(grid)
+        grid = [dict(zip(names, values)) for values in itertools.product(*(grid[name]
+                                                                             for name in names))]
+    grid = list(grid)
+    workers = workers or os.cpu_count() or 1
+    # The bars are sent once per chunk instead of once per combination.
+    chunks = [grid[index::workers] for index in range(min(workers, len(grid)))]
+    tasks = [(strategy, chunk, bars, multiplier, commission) for chunk in chunks]
+    if workers == 1:
+        outcomes = list(map(_sweep_chunk, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_sweep_chunk, tasks))
+    results = [None] * len(grid)
+    for index, outcome in enumerate(outcomes):
+        results[index::workers] = outcome
+    return results
+
+
+def _sweep_chunk(task):
+    strategy, chunk, bars, multiplier, commission = task
+    results = []
+    for params in chunk:
+        if hasattr(strategy, 'on_bar'):
+            result = run_events(bars, strategy(**params), multiplier, commission)
+        else:
+            result = run_vectorized(bars, strategy, multiplier, commission, **params)
+        results.append(SweepResult(params, result.pnl, result.max_drawdown, len(result.fills)))
+    return results
+
+
+def _account(bars, held, multiplier, commission) -> BacktestResult:
+    """Computes the fills and the equity of the positions held over each bar, entered at its
+    open."""
+    opens = np.asarray(bars['open'], dtype=np.float64)
+    closes = np.asarray(bars['close'], dtype=np.float64)
+    trades = np.diff(np.concatenate(([0.0], held)))
+    cash = -np.cumsum(trades * opens) * multiplier - np.cumsum(np.abs(trades)) * commission
+    equity = cash + held * closes * multiplier
+
+    traded = np.flatnonzero(trades)
+    fills = np.empty(len(traded), dtype=FILL_DTYPE)
+    fills['date'] = bars['date'][traded]
+    fills['quantity'] = trades[traded]
+    fills['price'] = opens[traded]
+    return BacktestResult(np.asarray(bars['date']), held, equity, fills)
@@ -0,0 +1,138 @@
+""" Columnar on-disk store of bars.
+
+Bars are chunked by contract and month and every column is kept in its own ``.npy`` file so it
+can be memory-mapped on read::
+
+    <root>/<exchange>-<sec_type>-<symbol>/<yyyy-mm>/<column>.npy
+
+Dates are stored as int64 epoch seconds (see ``core.datatools.BAR_DTYPE``). Bars derived from a
+contract, e.g. resampled by ``core.resample.cached_resample``, are kept under the contract key
+followed by ``DERIVED_SEPARATOR``.
+"""
+import os
+
+import numpy as np
+
+from core.datatools import BAR_COLUMNS, BAR_DTYPE
+
+DERIVED_SEPARATOR = '@'
+
+
+class BarStore(object):
+    """Represents a columnar bar store rooted at a directory."""
+    def __init__(self, root_dir: str):
+        self._root_dir = os.path.abspath(root_dir)
+
+    @property
+    def root_dir(self):
+        return self._root_dir
+
+    def keys(self):
+        """Gets the contract keys held in the store, without the keys of derived bars."""
+        if not os.path.isdir(self._root_dir):
+            return []
+        return sorted(name for name in os.listdir(self._root_dir)
+                      if DERIVED_SEPARATOR not in name and
+                      os.path.isdir(os.path.join(self._root_dir, name)))
+
+    def months(self, key: str):
+        """Gets the ``yyyy-mm`` chunks held for a contract, in order."""
+        key_dir = os.path.join(self._root_dir, key)
+        if not os.path.isdir(key_dir):
+            return []
+        return sorted(name for name in os.listdir(key_dir)
+                      if os.path.exists(os.path.join(key_dir, name, 'date.npy')))
+
+    def modified(self, key: str, month: str):
+        """Gets the time a month chunk was last written, ``None`` if it does not exist."""
+        path = os.path.join(self._root_dir, key, month, 'date.npy')
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def write(self, key: str, bars):
+        """Writes bars of a contract, merging them into the existing month chunks.
+
+        Bars with a date already in the store replace the stored ones.
+        """
+        bars = _as_records(bars)
+        if len(bars) == 0:
+            return
+        months = bars['date'].astype('datetime64[s]').astype('datetime64[M]')
+        for month in np.unique(months):
+            chunk = bars[months == month]
+            month_name = str(month)
+            existing = self._read_month(key, month_name, BAR_COLUMNS, mmap=False)
+            if existing is not None:
+                chunk = np.concatenate([_as_records(existing), chunk])
+            self._write_month(key, month_name, _sorted_unique(chunk))
+
+    def read(self, key: str, start=None, end=None, columns=None, mmap: bool=True):
+        """Reads bars of a contract between the epoch seconds ``start`` (inclusive) and ``end``
+        (exclusive).
+
+        Returns:
+            dict: column name to array. Columns of a single month are memory-mapped views.
+        """
+        columns = BAR_COLUMNS if columns is None else tuple(columns)
+        first_month = None if start is None else _month_name(start)
+        last_month = None if end is None else _month_name(end - 1)
+
+        parts = []
+        for month_name in self.months(key):
+            if (first_month is not None and month_name < first_month) or \
+                    (last_month is not None and month_name > last_month):
+                continue
+            part = self._read_month(key, month_name, columns, mmap=mmap)
+            dates = part['date'] if 'date' in part else \
+                self._read_month(key, month_name, ('date',), mmap=True)['date']
+            lower = 0 if start is None else np.searchsorted(dates, start, side='left')
+            upper = len(dates) if end is None else np.searchsorted(dates, end, side='left')
+            if upper > lower:
+                parts.append({name: values[lower:upper] for name, values in part.items()})
+
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {name: np.empty(0, dtype=BAR_DTYPE[name]) for name in columns}
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    def _read_month(self, key, month_name, columns, mmap):
+        month_dir = os.path.join(self._root_dir, key, month_name)
+        if not os.path.exists(os.path.join(month_dir, 'date.npy')):
+            return None
+        mmap_mode = 'r' if mmap else None
+        return {name: np.load(os.path.join(month_dir, name + '.npy'), mmap_mode=mmap_mode)
+                for name in columns}
+
+    def _write_month(self, key, month_name, chunk):
+        month_dir = os.path.join(self._root_dir, key, month_name)
+        if not os.path.isdir(month_dir):
+            os.makedirs(month_dir)
+        # The date column is written last, a chunk is only visible once it exists.
+        for name in BAR_COLUMNS[1:] + BAR_COLUMNS[:1]:
+            path = os.path.join(month_dir, name + '.npy')
+            with open(path + '.tmp', 'wb') as npy_file:
+                np.save(npy_file, np.ascontiguousarray(chunk[name]))
+            os.replace(path + '.tmp', path)
+
+
+def _month_name(epoch_seconds) -> str:
+    return str(np.datetime64(int(epoch_seconds), 's').astype('datetime64[M]'))
+
+
+def _as_records(bars) -> np.ndarray:
+    """Converts a structured array or a mapping of columns into a ``BAR_DTYPE`` array."""
+    if isinstance(bars, np.ndarray) and bars.dtype == BAR_DTYPE:
+        return bars
+    records = np.empty(len(bars['date']), dtype=BAR_DTYPE)
+    for name in BAR_COLUMNS:
+        records[name] = bars[name]
+    return records
+
+
+def _sorted_unique(bars: np.ndarray) -> np.ndarray:
+    """Sorts bars by date keeping the last of any duplicated dates."""
+    order = np.argsort(bars['date'], kind='mergesort')
+    bars = bars[order]
+    keep = np.ones(len(bars), dtype=bool)
+    keep[:-1] = bars['date'][1:] != bars['date'][:-1]
+    return bars[keep]
@@ -7,7 +7,7 @@ class Broker(object):
 
     @abstractmethod
     def get_orders(self):
-        """ ffewff """
+        """ Gets the orders of the broker. """
         pass
 
 
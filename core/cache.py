@@ -0,0 +1,108 @@
+""" In-process cache of the bars of the daily files of the CSV tree.
+
+Research and backtest jobs read the same days again and again. ``BarCache`` keeps the parsed bars
+of each file in memory, evicting the least recently used ones beyond a memory budget, and reloads
+a file whose modification time or size changed. Cached arrays are read-only so they can be handed
+out without a copy::
+
+    cache = BarCache(max_bytes=64 * 1024 * 1024)
+    closes = core.datatools.load_bars('HKFE', 'IND', 'HSI', start, end, ['close'], cache=cache)
+"""
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import core.datatools
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions', 'invalidations', 'entries',
+                                       'nbytes'])
+"""Represents the counters of a ``BarCache``.
+
+Attributes:
+    hits (int): lookups served from memory.
+    misses (int): lookups that read the file, including the invalidated ones.
+    evictions (int): entries dropped to stay within the memory budget.
+    invalidations (int): entries reloaded because their file changed.
+    entries (int): number of cached files.
+    nbytes (int): memory held by the cached bars.
+"""
+
+
+class _Entry(object):
+    __slots__ = ('mtime', 'size', 'bars')
+
+    def __init__(self, mtime, size, bars):
+        self.mtime = mtime
+        self.size = size
+        self.bars = bars
+
+
+class BarCache(object):
+    """Represents a LRU cache of bar files bounded by the memory held by their bars.
+
+    Entries are keyed by file, i.e. contract and date, bar size and columns.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = self._invalidations = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def stats(self) -> CacheStats:
+        """Gets a snapshot of the counters."""
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._invalidations,
+                              len(self._entries), self._nbytes)
+
+    def clear(self):
+        """Drops all the entries, the counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def get(self, path: str, columns=None, bar_size="30 secs"):
+        """Gets the bars of a file, as read by ``core.datatools.read_bar_csv``.
+
+        Args:
+            columns: optional subset of ``BAR_COLUMNS``, the date is always included.
+            bar_size: bar size of the file, part of the key only.
+
+        Returns:
+            numpy.ndarray: a read-only array shared with the cache.
+        """
+        columns = None if columns is None else tuple(sorted(set(columns) | {'date'}))
+        key = (os.path.abspath(path), getattr(bar_size, 'value', bar_size), columns)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.mtime == stat.st_mtime_ns and entry.size == stat.st_size:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry.bars
+                self._remove(key)
+                self._invalidations += 1
+            self._misses += 1
+
+        bars = core.datatools.read_bar_csv(path, columns)
+        bars.setflags(write=False)
+        with self._lock:
+            if key in self._entries:  # Loaded by another thread meanwhile.
+                self._remove(key)
+            if bars.nbytes <= self._max_bytes:
+                self._entries[key] = _Entry(stat.st_mtime_ns, stat.st_size, bars)
+                self._nbytes += bars.nbytes
+                while self._nbytes > self._max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self._evictions += 1
+        return bars
+
+    def _remove(self, key):
+        self._nbytes -= self._entries.pop(key).bars.nbytes
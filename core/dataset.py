@@ -0,0 +1,170 @@
+"""Sliding windows of bars for model training.
+
+``WindowDataset`` turns a bar array into batches of ``(windows, labels)``: windows of ``window``
+consecutive bars of some features, normalised, and labelled with the log return of the close
+``horizon`` bars after their last bar::
+
+    bars = core.datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 1), date(2010, 12, 31))
+    for x, y in WindowDataset(bars, window=120, horizon=10, batch_size=512, seed=1):
+        model.train_on_batch(x, y)
+
+The windows are a read-only strided view of the feature matrix, only the bars of a batch are
+copied. Windows and their labels never span a break in the bars: the lunch break, the overnight
+gap or missing bars with ``Boundary.Session``, only the overnight gap with ``Boundary.Day``.
+Batches are drawn in a new random order on each iteration and prepared ahead on a thread.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+from enum import Enum
+from queue import Full, Queue
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+PRICE_FEATURES = ('open', 'high', 'low', 'close')
+
+
+class Normalize(Enum):
+    """Represents the normalisation of the windows."""
+    Nothing = "nothing"
+    LastClose = "last close"  # Features relative to the close of the last bar, minus 1.
+    ZScore = "z-score"  # Each feature less its mean over the window, divided by its deviation.
+
+
+class Boundary(Enum):
+    """Represents the breaks in the bars windows may not span."""
+    Session = "session"
+    Day = "day"
+
+
+class WindowDataset(object):
+    """Represents the windows of bars sorted by date, with their labels.
+
+    Args:
+        window: number of bars of a window.
+        horizon: number of bars from the last bar of a window to the close of its label.
+        features: columns of the windows.
+        bar_seconds: length of the bars, longer gaps between bars are session breaks.
+        prefetch: number of batches prepared ahead, 0 prepares them on iteration.
+        seed: seed of the random order of the windows, ``shuffle=False`` keeps the date order.
+    """
+    def __init__(self, bars, window: int, horizon: int = 1, features=PRICE_FEATURES,
+                 batch_size: int = 256, normalize: Normalize = Normalize.LastClose,
+                 boundary: Boundary = Boundary.Session, bar_seconds: int = 30,
+                 shuffle: bool = True, drop_remainder: bool = False, prefetch: int = 2,
+                 seed: int = None):
+        self._window = window
+        self._batch_size = batch_size
+        self._normalize = normalize
+        self._shuffle = shuffle
+        self._drop_remainder = drop_remainder
+        self._prefetch = prefetch
+        self._random = np.random.RandomState(seed)
+
+        self._features = np.ascontiguousarray(
+            np.column_stack([np.asarray(bars[name], dtype=np.float32) for name in features]))
+        closes = np.asarray(bars['close'], dtype=np.float64)
+        self._last_closes = closes.astype(np.float32)
+        dates = np.asarray(bars['date'], dtype=np.int64)
+
+        # Bars of a run are contiguous, a window and its label lie within one run.
+        if boundary == Boundary.Session:
+            breaks = np.diff(dates) != bar_seconds
+        else:
+            breaks = np.diff(dates // 86400) != 0
+        runs = np.concatenate(([0], np.cumsum(breaks)))
+        span = window + horizon
+        count = max(len(dates) - span + 1, 0)
+        self._starts = np.flatnonzero(runs[:count] == runs[span - 1:span - 1 + count])
+
+        last = self._starts + window - 1
+        self._labels = np.log(closes[last + horizon] / closes[last]).astype(np.float32)
+        rows, columns = self._features.strides
+        self._windows = as_strided(self._features,
+                                   shape=(max(len(dates) - window + 1, 0), window,
+                                          self._features.shape[1]),
+                                   strides=(rows, rows, columns), writeable=False)
+
+    @property
+    def windows(self) -> np.ndarray:
+        """The raw windows of every start bar, a view of the features."""
+        return self._windows
+
+    @property
+    def starts(self) -> np.ndarray:
+        """The index of the first bar of each window of the dataset."""
+        return self._starts
+
+    @property
+    def labels(self) -> np.ndarray:
+        """The label of each window of the dataset."""
+        return self._labels
+
+    def __len__(self):
+        """Gets the number of batches of an iteration."""
+        if self._drop_remainder:
+            return len(self._starts) // self._batch_size
+        return -(-len(self._starts) // self._batch_size)
+
+    def batch(self, positions) -> tuple:
+        """Gets the normalised windows and the labels of the windows at ``positions`` in
+        ``starts``."""
+        starts = self._starts[positions]
+        windows = self._windows[starts]
+        if self._normalize == Normalize.LastClose:
+            windows /= self._last_closes[starts + self._window - 1][:, None, None]
+            windows -= 1
+        elif self._normalize == Normalize.ZScore:
+            windows -= windows.mean(axis=1, keepdims=True)
+            deviations = windows.std(axis=1, keepdims=True)
+            windows /= np.where(deviations > 0, deviations, 1)
+        return windows, self._labels[positions]
+
+    def __iter__(self):
+        order = self._random.permutation(len(self._starts)) if self._shuffle else \
+            np.arange(len(self._starts))
+        chunks = (order[index:index + self._batch_size]
+                  for index in range(0, len(self) * self._batch_size, self._batch_size))
+        batches = (self.batch(chunk) for chunk in chunks)
+        return _prefetch(batches, self._prefetch) if self._prefetch else batches
+
+
+_END = object()
+
+
+def _prefetch(batches, size):
+    """Iterates over batches prepared by a thread, at most ``size`` ahead."""
+    queue = Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for batch in batches:
+                while not stopped.is_set():
+                    try:
+                        queue.put(batch, timeout=0.1)
+                        break
+                    except Full:  # The consumer may have stopped.
+                        continue
+                if stopped.is_set():
+                    return
+            queue.put(_END)
+        except Exception as e:  # Raised to the consumer.
+            queue.put(e)
+
+    thread = threading.Thread(target=produce, name='WindowDataset')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
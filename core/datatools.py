@@ -1,8 +1,41 @@
 """ contains tools for reading various data.
 """
+import csv
+import io
+import os
 from datetime import date
 from datetime import timedelta
 
+import numpy as np
+import pandas as pd
+
+from core.metrics import METRICS
+
+BAR_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume', 'bar_count', 'wap', 'has_gaps')
+"""Column names of a bar, in the order written by the IB data loader."""
+
+BAR_DTYPE = np.dtype([
+    ('date', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.int32),
+    ('bar_count', np.int32),
+    ('wap', np.float64),
+    ('has_gaps', np.bool_)])
+"""Typed bar record. ``date`` holds the exchange wall-clock time as seconds since 1970-01-01."""
+
+_BARS_WRITTEN = METRICS.counter('bars_written_total', "Bars written to CSV files.")
+
+MARKET_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               'market-data', 'ib', 'hk')
+"""Root of the bundled IB market data tree."""
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_UNIT_SECONDS = {'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+
+
 def date_range(start: date, end: date):
     """ Gets a range of dates.
     """
@@ -17,6 +50,264 @@ def date_range(start: date, end: date):
             yield the_date
             the_date -= delta
 
+
+def contract_key(exchange: str, sec_type: str, symbol: str) -> str:
+    """ Gets the key that identifies a contract on disk, e.g. ``HKFE-IND-HSI``.
+    """
+    return "%s-%s-%s" % (exchange, sec_type, symbol)
+
+
+def bar_seconds(bar_size) -> int:
+    """ Gets the length in seconds of a bar size, a ``providers.ibtws.BarSize`` or its value such as
+    ``"30 secs"``. Monthly bars have no fixed length and raise ``ValueError``.
+    """
+    text = getattr(bar_size, 'value', bar_size)
+    count, unit = text.split()
+    unit = unit.rstrip('s')
+    if unit not in _UNIT_SECONDS:
+        raise ValueError("Bar size [%s] has no fixed length." % text)
+    return int(count) * _UNIT_SECONDS[unit]
+
+
+def parse_ib_date(text: str) -> int:
+    """ Parses a single IB bar date, ``yyyymmdd  hh:mm:ss`` or ``yyyymmdd``, into epoch seconds.
+    """
+    days = date(int(text[0:4]), int(text[4:6]), int(text[6:8])).toordinal() - _EPOCH_ORDINAL
+    if len(text) < 18:
+        return days * 86400
+    return days * 86400 + int(text[10:12]) * 3600 + int(text[13:15]) * 60 + int(text[16:18])
+
+
+def parse_ib_dates(values) -> np.ndarray:
+    """ Parses IB bar dates into an int64 array of epoch seconds.
+
+    The fixed width ``yyyymmdd  hh:mm:ss`` strings are decoded with array arithmetic on their
+    digits instead of calling ``strptime`` per row. Daily bars (``yyyymmdd``) are also accepted.
+    """
+    raw = np.asarray(values)
+    if raw.dtype.kind != 'S':
+        raw = raw.astype('S18')
+    elif raw.dtype.itemsize != 18:
+        raw = raw.astype('S18')
+    if raw.size == 0:
+        return np.empty(0, dtype=np.int64)
+
+    digits = raw.view(np.uint8).reshape(-1, 18).astype(np.int64) - ord('0')
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    seconds = _days_from_civil(year, month, day) * 86400
+
+    has_time = digits[:, 8] != -ord('0')
+    if has_time.any():
+        time_of_day = (digits[:, 10] * 10 + digits[:, 11]) * 3600 + \
+                      (digits[:, 13] * 10 + digits[:, 14]) * 60 + \
+                      (digits[:, 16] * 10 + digits[:, 17])
+        seconds += np.where(has_time, time_of_day, 0)
+    return seconds
+
+
+def format_ib_dates(seconds) -> np.ndarray:
+    """ Formats epoch seconds as IB bar dates, ``yyyymmdd  hh:mm:ss`` (vectorised).
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    days, time_of_day = np.divmod(seconds, 86400)
+    year, month, day = _civil_from_days(days)
+    hour, minute, second = time_of_day // 3600, time_of_day // 60 % 60, time_of_day % 60
+
+    text = np.empty((len(seconds), 18), dtype=np.uint8)
+    text[:, 8:10] = ord(' ')
+    text[:, [12, 15]] = ord(':')
+    fields = ((year, 4), (month, 2), (day, 2), (hour, 2), (minute, 2), (second, 2))
+    for position, (value, width) in zip((0, 4, 6, 10, 13, 16), fields):
+        for digit in range(width):
+            text[:, position + width - 1 - digit] = value // 10 ** digit % 10 + ord('0')
+    return text.view('S18').ravel().astype('U18')
+
+
+def _days_from_civil(year, month, day):
+    """Days since 1970-01-01 of the proleptic Gregorian dates (vectorised)."""
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _civil_from_days(days):
+    """Proleptic Gregorian dates of the days since 1970-01-01 (vectorised)."""
+    days = days + 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 -
+                   day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    month = shifted_month + np.where(shifted_month < 10, 3, -9)
+    return year_of_era + era * 400 + (month <= 2), month, day
+
+
+def read_bar_csv(path: str, columns=None) -> np.ndarray:
+    """ Reads a bar file written by the IB data loader into a ``BAR_DTYPE`` array.
+    """
+    return _read_bar_files([path], columns)
+
+
+def load_bars(exchange: str, sec_type: str, symbol: str, start: date, end: date, columns=None,
+              root_dir: str=MARKET_DATA_DIR, manifest=None, cache=None) -> np.ndarray:
+    """ Loads the bars of a contract between two dates (inclusive) from the CSV tree written by
+    ``tools.ib_data_loader.store_file``, i.e. ``<root_dir>/<yyyy-mm-dd>/<contract key>.csv``.
+
+    All the files in the range are read and parsed in a single pass. Bars are ordered by date and
+    bars repeated by holiday directories are dropped.
+
+    Args:
+        columns: optional subset of ``BAR_COLUMNS`` to return, e.g. ``['close']``.
+        manifest: optional ``core.manifest.FetchManifest`` of the tree, only the valid files it
+            indexes are read.
+        cache: optional ``core.cache.BarCache`` the files are read through. A range within a
+            single file is then a read-only view of the cached bars.
+
+    Returns:
+        numpy.ndarray: a structured array with the fields of ``BAR_DTYPE`` that were requested.
+    """
+    if start > end:
+        start, end = end, start
+    key = contract_key(exchange, sec_type, symbol)
+    if manifest is not None:
+        paths = manifest.valid_files(key, start, end)
+    else:
+        first, last = str(start), str(end)
+        paths = [os.path.join(root_dir, name, key + '.csv')
+                 for name in sorted(os.listdir(root_dir)) if first <= name <= last]
+        paths = [path for path in paths if os.path.isfile(path)]
+    lower = (start.toordinal() - _EPOCH_ORDINAL) * 86400
+    upper = (end.toordinal() + 1 - _EPOCH_ORDINAL) * 86400
+    if cache is None:
+        bars = _read_bar_files(paths, columns)
+    elif len(paths) == 1:
+        # Files hold the sorted bars of one day, the range is a slice.
+        bars = cache.get(paths[0], columns)
+        dates = bars['date']
+        bars = bars[np.searchsorted(dates, lower):np.searchsorted(dates, upper)]
+        return bars if columns is None or 'date' in columns else _select_fields(bars, columns)
+    else:
+        bars = [cache.get(path, columns) for path in paths]
+        bars = np.concatenate(bars) if bars else _read_bar_files([], columns)
+
+    dates = bars['date']
+    keep = (dates >= lower) & (dates < upper)
+    order = np.argsort(dates, kind='mergesort')
+    keep = keep[order]
+    keep[1:] &= dates[order][1:] != dates[order][:-1]
+    bars = bars[order[keep]]
+
+    if columns is not None and 'date' not in columns:
+        bars = _select_fields(bars, columns)
+    return bars
+
+
+def _read_bar_files(paths, columns=None) -> np.ndarray:
+    """Reads bar files in one ``read_csv`` call, always including the date column."""
+    names = BAR_COLUMNS if columns is None else \
+        ('date',) + tuple(name for name in BAR_COLUMNS[1:] if name in columns)
+    unknown = set(columns or ()) - set(BAR_COLUMNS)
+    if unknown:
+        raise KeyError("Unknown bar columns: %s" % ", ".join(sorted(unknown)))
+
+    content = io.BytesIO()
+    for path in paths:
+        with open(path, 'rb') as csv_file:
+            csv_file.readline()  # Skips heading row.
+            rows = csv_file.read()
+        content.write(rows)
+        if rows and not rows.endswith(b'\n'):
+            content.write(b'\n')
+    bars = np.empty(0, dtype=_bar_dtype(names))
+    if content.tell() == 0:
+        return bars
+    content.seek(0)
+
+    dtypes = {name: np.int8 if name == 'has_gaps' else BAR_DTYPE[name] for name in names[1:]}
+    dtypes['date'] = str
+    frame = pd.read_csv(content, header=None, names=BAR_COLUMNS, usecols=list(names), dtype=dtypes)
+    bars = np.empty(len(frame), dtype=_bar_dtype(names))
+    bars['date'] = parse_ib_dates(frame['date'].values)
+    for name in names[1:]:
+        bars[name] = frame[name].values
+    return bars
+
+
+def write_bar_csv(path: str, bars, header: bool=True):
+    """ Writes bars in the CSV format of the IB data loader in one call.
+
+    Args:
+        path: a file path or an opened text file.
+        bars: a ``BAR_DTYPE`` array or a mapping of its columns.
+        header: whether the heading row is written, ``False`` to append to an opened file.
+    """
+    columns = [format_ib_dates(bars['date']).tolist()] + \
+              [np.asarray(bars[name]).tolist() for name in BAR_COLUMNS[1:-1]] + \
+              [np.asarray(bars['has_gaps'], dtype=np.int8).tolist()]
+    if isinstance(path, str):
+        with open(path, 'w', newline='') as csv_file:
+            _write_bar_rows(csv_file, columns, header)
+    else:
+        _write_bar_rows(path, columns, header)
+    _BARS_WRITTEN.inc(len(columns[0]))
+
+
+def _write_bar_rows(csv_file, columns, header):
+    csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    if header:
+        csv_writer.writerow(BAR_COLUMNS)
+    csv_writer.writerows(zip(*columns))
+
+
+class BarBuffer(object):
+    """ Represents a growable ``BAR_DTYPE`` array that bars are appended to one at a time.
+    """
+    __slots__ = ('_bars', '_size')
+
+    def __init__(self, capacity: int=512):
+        self._bars = np.empty(max(1, capacity), dtype=BAR_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def bars(self) -> np.ndarray:
+        """Gets a view of the bars appended so far."""
+        return self._bars[:self._size]
+
+    def append(self, date_, open_, high, low, close, volume, bar_count, wap, has_gaps):
+        """Appends a bar, ``date_`` is either an IB date string or epoch seconds."""
+        if self._size == len(self._bars):
+            self._bars = np.resize(self._bars, 2 * len(self._bars))
+        if isinstance(date_, str):
+            date_ = int(date_) if date_.isdigit() and len(date_) != 8 else parse_ib_date(date_)
+        self._bars[self._size] = (date_, open_, high, low, close, volume, bar_count, wap, has_gaps)
+        self._size += 1
+
+    def clear(self):
+        """Removes the bars appended so far, keeping the allocated capacity."""
+        self._size = 0
+
+
+def _bar_dtype(names) -> np.dtype:
+    return np.dtype([(name, BAR_DTYPE[name]) for name in names])
+
+
+def _select_fields(bars: np.ndarray, names) -> np.ndarray:
+    names = [name for name in BAR_COLUMNS if name in names]
+    selected = np.empty(len(bars), dtype=_bar_dtype(names))
+    for name in names:
+        selected[name] = bars[name]
+    return selected
+
 """Class
 """
 class Expando(object):
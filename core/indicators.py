@@ -0,0 +1,227 @@
+"""Technical indicators over ``BAR_DTYPE`` bars, in batch or bar by bar.
+
+Every indicator computes over a whole bar array with ``batch``, e.g. when backfilling research
+data, and keeps a fixed-size state updated in constant time per bar with ``update``, e.g. on the
+bars of a ``providers.tickbars.BarAggregator`` whose sink it can be::
+
+    sma = Sma(20)
+    history = sma.batch(bars)
+    aggregator = BarAggregator(BarSize.Min1, sma.update)
+
+Both modes perform the same floating point operations in the same order, so they give identical
+results. Values are NaN until an indicator has seen enough bars.
+
+Moving sums are differences of running totals, so their rounding does not depend on the window.
+Recursive indicators (``Ema``, ``Atr``) run their recurrence in a loop in ``batch`` as well.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+from core.datatools import BAR_COLUMNS
+
+_NAN = float('nan')
+_DATE, _HIGH, _LOW, _CLOSE = (BAR_COLUMNS.index(name) for name in ('date', 'high', 'low', 'close'))
+
+
+class Indicator(object):
+    """Represents an indicator, ``update`` takes the fields of a bar in ``BAR_COLUMNS`` order like
+    the sinks of ``BarAggregator``."""
+    def batch(self, bars) -> np.ndarray:
+        """Computes the indicator at each bar of an array sorted by date, without changing the
+        state used by ``update``."""
+        raise NotImplementedError
+
+    def update(self, *bar) -> float:
+        """Adds the next bar and returns the value of the indicator."""
+        raise NotImplementedError
+
+    @property
+    def value(self) -> float:
+        """The value of the indicator at the last bar."""
+        return self._value
+
+
+class _MovingSum(object):
+    """Represents the sum of the last ``period`` values, as the difference of running totals."""
+    __slots__ = ('_totals', '_index', '_count', '_total')
+
+    def __init__(self, period):
+        self._totals = [0.0] * period
+        self._index = 0
+        self._count = 0
+        self._total = 0.0
+
+    def add(self, value) -> float:
+        """Adds a value and returns the moving sum, NaN until ``period`` values are added."""
+        self._total += value
+        oldest = self._totals[self._index]
+        self._totals[self._index] = self._total
+        self._index = (self._index + 1) % len(self._totals)
+        self._count += 1
+        return self._total - oldest if self._count >= len(self._totals) else _NAN
+
+
+def _moving_sum(values, period) -> np.ndarray:
+    """Computes the sums of the last ``period`` values, see ``_MovingSum``."""
+    totals = np.cumsum(np.asarray(values, dtype=np.float64))
+    sums = np.full(len(totals), _NAN)
+    if len(totals) >= period:
+        sums[period - 1] = totals[period - 1] - 0.0
+        sums[period:] = totals[period:] - totals[:-period]
+    return sums
+
+
+class Sma(Indicator):
+    """Represents the simple moving average of a field over ``period`` bars."""
+    def __init__(self, period: int, field: str = 'close'):
+        self._period = period
+        self._field = field
+        self._index = BAR_COLUMNS.index(field)
+        self._sum = _MovingSum(period)
+        self._value = _NAN
+
+    def batch(self, bars) -> np.ndarray:
+        return _moving_sum(bars[self._field], self._period) / self._period
+
+    def update(self, *bar) -> float:
+        self._value = self._sum.add(float(bar[self._index])) / self._period
+        return self._value
+
+
+class Ema(Indicator):
+    """Represents the exponential moving average of a field with a smoothing of
+    ``2 / (period + 1)``, seeded with the first value."""
+    def __init__(self, period: int, field: str = 'close'):
+        self._alpha = 2.0 / (period + 1)
+        self._field = field
+        self._index = BAR_COLUMNS.index(field)
+        self._value = _NAN
+
+    def batch(self, bars) -> np.ndarray:
+        return np.array(_smooth(np.asarray(bars[self._field], dtype=np.float64).tolist(),
+                                self._alpha))
+
+    def update(self, *bar) -> float:
+        self._value = _smooth_step(self._value, float(bar[self._index]), self._alpha)
+        return self._value
+
+
+class Vwap(Indicator):
+    """Represents the average typical price ``(high + low + close) / 3`` of the day weighted by
+    volume. Index bars have no volume, their ``bar_count`` can weigh them instead."""
+    def __init__(self, weight: str = 'volume'):
+        self._weight = weight
+        self._index = BAR_COLUMNS.index(weight)
+        self._day = None
+        self._notional = 0.0
+        self._weights = 0.0
+        self._value = _NAN
+
+    def batch(self, bars) -> np.ndarray:
+        typical = _typical(bars['high'], bars['low'], bars['close'])
+        weights = np.asarray(bars[self._weight], dtype=np.float64)
+        days = np.asarray(bars['date'], dtype=np.int64) // 86400
+        # Running totals restart each day.
+        starts = np.flatnonzero(np.diff(days)) + 1
+        notional = np.concatenate([np.cumsum(part) for part in
+                                   np.split(typical * weights, starts)]) if len(days) else []
+        totals = np.concatenate([np.cumsum(part) for part in
+                                 np.split(weights, starts)]) if len(days) else []
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(totals > 0, np.divide(notional, totals), _NAN)
+
+    def update(self, *bar) -> float:
+        weight = float(bar[self._index])
+        day = int(bar[_DATE]) // 86400
+        if day != self._day:
+            self._day = day
+            self._notional = self._weights = 0.0
+        self._notional += _typical(float(bar[_HIGH]), float(bar[_LOW]), float(bar[_CLOSE])) * weight
+        self._weights += weight
+        self._value = self._notional / self._weights if self._weights > 0 else _NAN
+        return self._value
+
+
+class Atr(Indicator):
+    """Represents the average true range with Wilder's smoothing of ``1 / period``, seeded with
+    the range of the first bar."""
+    def __init__(self, period: int = 14):
+        self._alpha = 1.0 / period
+        self._close = None
+        self._value = _NAN
+
+    def batch(self, bars) -> np.ndarray:
+        high = np.asarray(bars['high'], dtype=np.float64)
+        low = np.asarray(bars['low'], dtype=np.float64)
+        ranges = high - low
+        previous = np.asarray(bars['close'], dtype=np.float64)[:-1]
+        ranges[1:] = np.maximum(np.maximum(ranges[1:], np.abs(high[1:] - previous)),
+                                np.abs(low[1:] - previous))
+        return np.array(_smooth(ranges.tolist(), self._alpha))
+
+    def update(self, *bar) -> float:
+        high, low = float(bar[_HIGH]), float(bar[_LOW])
+        true_range = high - low
+        if self._close is not None:
+            true_range = max(max(true_range, abs(high - self._close)), abs(low - self._close))
+        self._close = float(bar[_CLOSE])
+        self._value = _smooth_step(self._value, true_range, self._alpha)
+        return self._value
+
+
+class Volatility(Indicator):
+    """Represents the standard deviation of the close to close log returns over ``period``
+    returns, per bar."""
+    def __init__(self, period: int):
+        self._period = period
+        self._sum = _MovingSum(period)
+        self._squares = _MovingSum(period)
+        self._close = None
+        self._value = _NAN
+
+    def batch(self, bars) -> np.ndarray:
+        closes = np.asarray(bars['close'], dtype=np.float64)
+        returns = np.log(closes[1:] / closes[:-1])
+        deviations = _deviation(_moving_sum(returns, self._period),
+                                _moving_sum(returns * returns, self._period), self._period)
+        return np.concatenate(([_NAN], deviations))[:len(closes)]
+
+    def update(self, *bar) -> float:
+        close = float(bar[_CLOSE])
+        if self._close is None:
+            self._close = close
+            return self._value
+        value = float(np.log(close / self._close))
+        self._close = close
+        self._value = float(_deviation(self._sum.add(value), self._squares.add(value * value),
+                                       self._period))
+        return self._value
+
+
+def _smooth_step(previous, value, alpha):
+    return value if math.isnan(previous) else previous + alpha * (value - previous)
+
+
+def _smooth(values, alpha):
+    """Runs the recurrence of ``_smooth_step`` over a list."""
+    smoothed = []
+    previous = _NAN
+    for value in values:
+        previous = _smooth_step(previous, value, alpha)
+        smoothed.append(previous)
+    return smoothed
+
+
+def _typical(high, low, close):
+    return (high + low + close) / 3.0
+
+
+def _deviation(sums, squares, period):
+    """Gets the sample standard deviation from the moving sums of values and their squares."""
+    variance = (squares - sums * sums / period) / (period - 1)
+    return np.sqrt(np.maximum(variance, 0.0))
@@ -0,0 +1,185 @@
+""" Persistent index of the historical data files fetched from IB.
+
+Each ``(contract, date)`` file of the CSV tree has one row in a SQLite database recording its
+status, row count, first and last bar, and checksum, so a backfill can be planned and readers can
+find the valid files with a single indexed query instead of a stat call per file.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from enum import Enum
+
+import numpy as np
+
+import core.datatools
+
+MANIFEST_FILE = 'manifest.sqlite'
+"""Name of the manifest kept at the root of a CSV tree."""
+
+
+class FileStatus(Enum):
+    """Represents the status of a fetched file."""
+    Complete = "complete"
+    """All the bars of a full trading day."""
+    HalfDay = "half_day"
+    """All the bars of a trading day that closed at noon."""
+    Holiday = "holiday"
+    """No bars on the date, IB answered with the previous trading day."""
+    Incomplete = "incomplete"
+    """Some bars are missing, the file has to be fetched again."""
+    Failed = "failed"
+    """IB could not be queried for the date."""
+
+
+FETCHED = (FileStatus.Complete, FileStatus.HalfDay, FileStatus.Holiday)
+"""Statuses of the files that do not need to be fetched again."""
+
+VALID = (FileStatus.Complete, FileStatus.HalfDay)
+"""Statuses of the files holding the bars of their date."""
+
+_HALF_DAY_CLOSE = 13 * 3600  # Last bar of a half day starts before 1pm.
+
+
+class FetchManifest(object):
+    """Represents the manifest of a CSV tree.
+
+    Args:
+        calendar: optional ``core.tradingcalendar.TradingCalendar``, files holding fewer bars than
+            it expects on their date are incomplete.
+        bar_size: size of the bars of the tree, for the expected number of bars.
+    """
+    def __init__(self, root_dir: str, file_name: str = MANIFEST_FILE, calendar=None,
+                 bar_size="30 secs"):
+        self._root_dir = os.path.abspath(root_dir)
+        self._calendar = calendar
+        self._bar_size = bar_size
+        if not os.path.isdir(self._root_dir):
+            os.makedirs(self._root_dir)
+        # Shared by the threads of a client, e.g. the TWS reader thread of a live recorder.
+        self._connection = sqlite3.connect(os.path.join(self._root_dir, file_name),
+                                           check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " contract TEXT NOT NULL, date TEXT NOT NULL, status TEXT NOT NULL,"
+                " rows INTEGER NOT NULL, first_bar INTEGER, last_bar INTEGER, checksum TEXT,"
+                " updated REAL NOT NULL, PRIMARY KEY (contract, date))")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS files_status ON files (contract, status, date)")
+
+    @property
+    def root_dir(self):
+        return self._root_dir
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def path(self, contract: str, the_date: date) -> str:
+        """Gets the path of the file of a contract on a date."""
+        return os.path.join(self._root_dir, str(the_date), contract + '.csv')
+
+    def record_file(self, contract: str, the_date: date, expected_rows: int = None) -> FileStatus:
+        """Indexes the file of a contract on a date and returns its status.
+
+        Args:
+            expected_rows: number of bars of the trading day if known, fewer bars are incomplete.
+                Defaults to the count of the calendar of the manifest, unknown for the days
+                outside it.
+        """
+        if expected_rows is None and self._calendar is not None and \
+                self._calendar.covers(the_date):
+            expected_rows = self._calendar.expected_bars(the_date, self._bar_size) or None
+        full_path = self.path(contract, the_date)
+        with open(full_path, 'rb') as data_file:
+            checksum = hashlib.sha1(data_file.read()).hexdigest()
+        bars = core.datatools.read_bar_csv(full_path)
+        day_start = (the_date.toordinal() - date(1970, 1, 1).toordinal()) * 86400
+        bars = bars[(bars['date'] >= day_start) & (bars['date'] < day_start + 86400)]
+
+        if len(bars) == 0:
+            status = FileStatus.Holiday
+        elif np.any(bars['has_gaps']) or (expected_rows is not None and len(bars) < expected_rows):
+            status = FileStatus.Incomplete
+        elif bars['date'][-1] - day_start < _HALF_DAY_CLOSE:
+            status = FileStatus.HalfDay
+        else:
+            status = FileStatus.Complete
+
+        first_bar = int(bars['date'][0]) if len(bars) else None
+        last_bar = int(bars['date'][-1]) if len(bars) else None
+        self._upsert(contract, the_date, status, len(bars), first_bar, last_bar, checksum)
+        return status
+
+    def record_failure(self, contract: str, the_date: date):
+        """Records that the file of a contract on a date could not be fetched."""
+        self._upsert(contract, the_date, FileStatus.Failed, 0, None, None, None)
+
+    def status(self, contract: str, the_date: date) -> FileStatus:
+        """Gets the status of the file of a contract on a date, ``None`` if it is not indexed."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status FROM files WHERE contract = ? AND date = ?",
+                (contract, str(the_date))).fetchone()
+        return None if row is None else FileStatus(row[0])
+
+    def entries(self, contract: str, start: date, end: date, statuses=None):
+        """Gets the ``(date, status, rows, first_bar, last_bar, checksum)`` entries of a contract
+        between two dates (inclusive), in date order."""
+        query = "SELECT date, status, rows, first_bar, last_bar, checksum FROM files " \
+                "WHERE contract = ? AND date BETWEEN ? AND ?"
+        parameters = [contract, str(min(start, end)), str(max(start, end))]
+        if statuses is not None:
+            query += " AND status IN (%s)" % ", ".join("?" * len(statuses))
+            parameters += [status.value for status in statuses]
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY date", parameters).fetchall()
+        return [(date(*map(int, row[0].split('-'))), FileStatus(row[1])) + tuple(row[2:])
+                for row in rows]
+
+    def fetched(self, contracts, start: date, end: date) -> set:
+        """Gets the ``(contract, date)`` pairs that do not need to be fetched again."""
+        contracts = list(contracts)
+        query = "SELECT contract, date FROM files WHERE contract IN (%s) AND status IN (%s) " \
+                "AND date BETWEEN ? AND ?" % (", ".join("?" * len(contracts)),
+                                              ", ".join("?" * len(FETCHED)))
+        parameters = contracts + [status.value for status in FETCHED] + \
+            [str(min(start, end)), str(max(start, end))]
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return {(row[0], date(*map(int, row[1].split('-')))) for row in rows}
+
+    def valid_files(self, contract: str, start: date, end: date):
+        """Gets the paths of the files holding the bars of a contract between two dates."""
+        return [self.path(contract, entry[0])
+                for entry in self.entries(contract, start, end, VALID)]
+
+    def scan(self, expected_rows: int = None):
+        """Indexes the files of the tree that are not indexed yet."""
+        with self._lock:
+            indexed = set(self._connection.execute("SELECT contract, date FROM files").fetchall())
+        for date_dir in sorted(os.listdir(self._root_dir)):
+            full_dir = os.path.join(self._root_dir, date_dir)
+            if not os.path.isdir(full_dir):
+                continue
+            for file_name in sorted(os.listdir(full_dir)):
+                contract = file_name[:-len('.csv')]
+                if file_name.endswith('.csv') and (contract, date_dir) not in indexed:
+                    self.record_file(contract, date(*map(int, date_dir.split('-'))), expected_rows)
+
+    def _upsert(self, contract, the_date, status, rows, first_bar, last_bar, checksum):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (contract, str(the_date), status.value, rows, first_bar, last_bar, checksum,
+                 time.time()))
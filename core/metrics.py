@@ -0,0 +1,242 @@
+"""Counters and latency histograms of the hot paths.
+
+Instruments are created once, with their labels, and updated without lookups::
+
+    callbacks = METRICS.histogram('tws_callback_seconds', "Handler time per callback.",
+                                  callback='tickPrice')
+    callbacks.observe(elapsed)
+
+``METRICS`` is the registry of the process, ``METRICS.enabled = False`` turns every update into
+a no-op. Updates take no lock, a lock would double the cost of an instrumented callback, so
+updates of an instrument from several threads at once may rarely be lost. ``snapshot`` gets the
+current values and ``write_prometheus`` the Prometheus text format, e.g. for the textfile
+collector of the node exporter; rates such as bars written per second are derived from the
+counters by the monitoring side.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5,
+                   10, 30, 60)
+"""Default upper bounds of the histogram buckets, in seconds."""
+
+
+class Counter(object):
+    """Represents a monotonic count."""
+    __slots__ = ('_registry', '_value')
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._value = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    def inc(self, amount=1):
+        if self._registry.enabled:
+            self._value += amount
+
+
+class Histogram(object):
+    """Represents the distribution of observed values in cumulative buckets."""
+    __slots__ = ('_registry', '_bounds', '_counts', '_sum')
+
+    def __init__(self, registry, buckets):
+        self._registry = registry
+        self._bounds = tuple(buckets)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+
+    @property
+    def enabled(self):
+        return self._registry.enabled
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def observe(self, value: float):
+        if self._registry.enabled:
+            self._counts[bisect_left(self._bounds, value)] += 1
+            self._sum += value
+
+    def buckets(self):
+        """Gets the ``(upper bound, cumulative count)`` of the buckets, the last bound is inf."""
+        counts = list(self._counts)
+        cumulative = 0
+        result = []
+        for bound, count in zip(self._bounds + (float('inf'),), counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+
+class CallTimer(object):
+    """Represents the count of calls of a hot path and the durations of one call in ``every``.
+
+    Timing every call would cost about as much as a trivial callback, the sampled durations still
+    give their distribution::
+
+        started = timer.start()
+        handler.tickPrice(request, field, price, can_auto_execute)
+        if started:
+            timer.stop(started)
+    """
+    __slots__ = ('_calls', '_seconds', '_every')
+
+    def __init__(self, calls: Counter, seconds: Histogram, every: int = 16):
+        self._calls = calls
+        self._seconds = seconds
+        self._every = every
+
+    def start(self) -> float:
+        """Counts a call, returns its start time if its duration is sampled, 0 otherwise."""
+        calls = self._calls
+        if not calls._registry.enabled:
+            return 0.0
+        calls._value += 1
+        return 0.0 if calls._value % self._every else time.perf_counter()
+
+    def stop(self, started: float):
+        self._seconds.observe(time.perf_counter() - started)
+
+
+class TimedLock(object):
+    """Represents a lock whose acquisition waits are observed by a histogram."""
+    __slots__ = ('_lock', '_waits')
+
+    def __init__(self, waits: Histogram):
+        self._lock = threading.Lock()
+        self._waits = waits
+
+    def __enter__(self):
+        if not self._waits.enabled:
+            self._lock.acquire()
+            return self
+        started = time.perf_counter()
+        self._lock.acquire()
+        self._waits.observe(time.perf_counter() - started)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._lock.release()
+
+
+class MetricsRegistry(object):
+    """Represents the instruments of a process by name and labels."""
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._families = {}  # name to (type, help, {labels: instrument})
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        """Gets the counter of a name and labels, created on first use."""
+        return self._instrument(name, 'counter', help_text, labels, lambda: Counter(self))
+
+    def histogram(self, name: str, help_text: str, buckets=LATENCY_BUCKETS,
+                  **labels) -> Histogram:
+        """Gets the histogram of a name and labels, created on first use."""
+        return self._instrument(name, 'histogram', help_text, labels,
+                                lambda: Histogram(self, buckets))
+
+    def snapshot(self) -> dict:
+        """Gets the current values, by name then by labels, sorted ``(label, value)`` tuples.
+        Counters are numbers, histograms are dicts of ``count``, ``sum`` and ``buckets``."""
+        result = {}
+        for name, (kind, _, instruments) in self._copy().items():
+            result[name] = {labels: instrument.value if kind == 'counter' else
+                            {'count': instrument.count, 'sum': instrument.sum,
+                             'buckets': instrument.buckets()}
+                            for labels, instrument in instruments.items()}
+        return result
+
+    def prometheus_text(self) -> str:
+        """Formats the current values in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, help_text, instruments) in sorted(self._copy().items()):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, instrument in sorted(instruments.items()):
+                if kind == 'counter':
+                    lines.append("%s%s %s" % (name, _format_labels(labels),
+                                              _format_value(instrument.value)))
+                    continue
+                for bound, count in instrument.buckets():
+                    lines.append("%s_bucket%s %d" % (name, _format_labels(
+                        labels + (('le', _format_value(bound)),)), count))
+                lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                                              _format_value(instrument.sum)))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels), instrument.count))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Writes the Prometheus text to a file, replaced at once so readers never see a part."""
+        with open(path + '.part', 'w') as text_file:
+            text_file.write(self.prometheus_text())
+        os.replace(path + '.part', path)
+
+    def start_export(self, path: str, interval: float = 15) -> threading.Event:
+        """Writes the Prometheus text file every ``interval`` seconds on a thread, until the
+        returned event is set."""
+        stopped = threading.Event()
+
+        def export():
+            while not stopped.wait(interval):
+                try:
+                    self.write_prometheus(path)
+                except Exception:  # The export must keep running.
+                    MetricsRegistry.logger.exception("Unable to write metrics to %s.", path)
+
+        thread = threading.Thread(target=export, name='MetricsExport')
+        thread.daemon = True
+        thread.start()
+        return stopped
+
+    def _instrument(self, name, kind, help_text, labels, create):
+        labels = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (kind, help_text, {})
+            elif family[0] != kind:
+                raise ValueError("Metric %s is a %s, not a %s." % (name, family[0], kind))
+            instrument = family[2].get(labels)
+            if instrument is None:
+                instrument = family[2][labels] = create()
+            return instrument
+
+    def _copy(self):
+        with self._lock:
+            return {name: (kind, help_text, dict(instruments))
+                    for name, (kind, help_text, instruments) in self._families.items()}
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+METRICS = MetricsRegistry()
+"""Registry of the process."""
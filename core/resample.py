@@ -0,0 +1,136 @@
+""" Derives bars of a larger ``BarSize`` from stored bars.
+
+Bars are aggregated in one vectorised pass: open and close of the first and last bar, high and
+low extremes, summed volume and bar count, volume weighted ``wap`` and ``has_gaps`` if any source
+bar had gaps or is missing. Intraday bars are aligned to the start of each trading session so a
+bar never spans the lunch break.
+
+Derived bars can be cached in a ``BarStore`` next to their source, see ``cached_resample``.
+"""
+import numpy as np
+
+from core.barstore import BarStore, DERIVED_SEPARATOR
+from core.datatools import BAR_DTYPE, bar_seconds
+from core.tradingcalendar import HKFE_CALENDAR
+
+HKFE_SESSIONS = ((10 * 3600, 12 * 3600 + 1800), (14 * 3600 + 1800, 16 * 3600))
+"""Morning and afternoon sessions of HKFE indices until 2011-03-04, as seconds of the day. The
+sessions of ``HKFE_CALENDAR`` follow the later changes of the trading hours."""
+
+_DAY = 86400
+_WEEK = 7 * _DAY
+_MONDAY_OFFSET = 3  # 1970-01-01 was a Thursday.
+
+
+def resample(bars, bar_size, sessions=HKFE_CALENDAR, source_seconds: int = 30) -> np.ndarray:
+    """Aggregates bars sorted by date into bars of ``bar_size``.
+
+    Args:
+        bars: a ``BAR_DTYPE`` array or a mapping of its columns.
+        bar_size: a ``providers.ibtws.BarSize`` or its value, e.g. ``"5 mins"``.
+        sessions: ``(start, end)`` seconds of the day of the trading sessions, or a
+            ``core.tradingcalendar.TradingCalendar`` when the trading hours changed over the bars.
+        source_seconds: length of the source bars, used to flag incomplete bars as gapped.
+
+    Returns:
+        numpy.ndarray: a ``BAR_DTYPE`` array dated by the start of each bar.
+    """
+    seconds = bar_seconds(bar_size)
+    dates = np.asarray(bars['date'], dtype=np.int64)
+    if len(dates) == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+    if seconds < _DAY and hasattr(sessions, 'regimes'):
+        parts = []
+        for start, end, regime in sessions.regimes(dates[0], dates[-1] + 1):
+            lower = 0 if start is None else np.searchsorted(dates, start)
+            upper = len(dates) if end is None else np.searchsorted(dates, end)
+            if upper > lower:
+                part = {name: np.asarray(bars[name])[lower:upper] for name in BAR_DTYPE.names}
+                parts.append(resample(part, bar_size, regime, source_seconds))
+        return np.concatenate(parts)
+
+    days, time_of_day = np.divmod(dates, _DAY)
+    if seconds >= _WEEK:
+        starts = (days - (days + _MONDAY_OFFSET) % 7) * _DAY
+        expected = None
+    elif seconds >= _DAY:
+        starts = days * _DAY
+        expected = None
+    else:
+        session_starts = np.array([start for start, _ in sessions], dtype=np.int64)
+        session_ends = np.array([end for _, end in sessions], dtype=np.int64)
+        session = np.clip(np.searchsorted(session_starts, time_of_day, side='right') - 1, 0, None)
+        anchor = session_starts[session]
+        offset = (time_of_day - anchor) // seconds * seconds
+        starts = days * _DAY + anchor + offset
+        bar_end = np.minimum(anchor + offset + seconds, session_ends[session])
+        expected = (bar_end - anchor - offset) // source_seconds
+
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+    last = np.concatenate((first[1:], [len(dates)])) - 1
+    counts = last - first + 1
+
+    volume = np.asarray(bars['volume'], dtype=np.int64)
+    wap = np.asarray(bars['wap'], dtype=np.float64)
+    total_volume = np.add.reduceat(volume, first)
+    weighted = np.add.reduceat(wap * volume, first)
+    mean_wap = np.add.reduceat(wap, first) / counts
+    gaps = np.add.reduceat(np.asarray(bars['has_gaps'], dtype=np.int64), first) > 0
+    if expected is not None:
+        gaps |= counts < expected[first]
+
+    resampled = np.empty(len(first), dtype=BAR_DTYPE)
+    resampled['date'] = starts[first]
+    resampled['open'] = np.asarray(bars['open'])[first]
+    resampled['high'] = np.maximum.reduceat(np.asarray(bars['high']), first)
+    resampled['low'] = np.minimum.reduceat(np.asarray(bars['low']), first)
+    resampled['close'] = np.asarray(bars['close'])[last]
+    resampled['volume'] = total_volume
+    resampled['bar_count'] = np.add.reduceat(np.asarray(bars['bar_count'], dtype=np.int64), first)
+    resampled['wap'] = np.where(total_volume > 0, weighted / np.maximum(total_volume, 1), mean_wap)
+    resampled['has_gaps'] = gaps
+    return resampled
+
+
+def derived_key(key: str, bar_size) -> str:
+    """Gets the store key of the bars of a contract resampled to ``bar_size``, e.g.
+    ``HKFE-IND-HSI@5mins``."""
+    return "%s%s%s" % (key, DERIVED_SEPARATOR,
+                       getattr(bar_size, 'value', bar_size).replace(' ', ''))
+
+
+def cached_resample(store: BarStore, key: str, bar_size, start=None, end=None,
+                    sessions=HKFE_CALENDAR, source_seconds: int = 30):
+    """Reads the bars of a contract resampled to ``bar_size`` between the epoch seconds ``start``
+    (inclusive) and ``end`` (exclusive).
+
+    Source months overlapping the range are resampled once and written to the store under
+    ``derived_key``; a month is resampled again only when its source chunk was written after the
+    derived one. Weekly bars are derived from the cached daily bars.
+    """
+    if bar_seconds(bar_size) >= _WEEK:
+        # A weekly bar holds the days of the week from its date.
+        daily = cached_resample(store, key, "1 day", start, None if end is None else end + _WEEK,
+                                sessions, source_seconds)
+        weekly = resample(daily, bar_size)
+        lower = 0 if start is None else np.searchsorted(weekly['date'], start, side='left')
+        upper = len(weekly) if end is None else np.searchsorted(weekly['date'], end, side='left')
+        return {name: weekly[name][lower:upper] for name in BAR_DTYPE.names}
+
+    target = derived_key(key, bar_size)
+    for month in store.months(key):
+        month_start, month_end = _month_range(month)
+        if (start is not None and month_end <= start) or (end is not None and month_start >= end):
+            continue
+        source_modified = store.modified(key, month)
+        target_modified = store.modified(target, month)
+        if target_modified is None or target_modified < source_modified:
+            source = store.read(key, month_start, month_end, mmap=False)
+            store.write(target, resample(source, bar_size, sessions, source_seconds))
+    return store.read(target, start, end)
+
+
+def _month_range(month: str):
+    first = np.datetime64(month, 'M')
+    return (int(first.astype('datetime64[s]').astype(np.int64)),
+            int((first + 1).astype('datetime64[s]').astype(np.int64)))
@@ -0,0 +1,189 @@
+""" Trading calendar of the Hong Kong Futures Exchange.
+
+A ``TradingCalendar`` holds the holidays, half days and session hours of an exchange and answers
+from tables precomputed per day, indexed by date ordinal:
+
+    >>> HKFE_CALENDAR.is_trading_day(date(2010, 2, 15))
+    False
+    >>> HKFE_CALENDAR.expected_bars(date(2010, 1, 4), "30 secs")
+    480
+
+Holidays are the weekdays the exchange is closed, half days only trade the morning session.
+The built-in holidays and half days are listed for the bundled 2010 data only; on the days they are
+not listed for, every weekday is a full trading day with the sessions of its regime. Later years
+and their holidays can be given to the constructor.
+"""
+from datetime import date
+
+import numpy as np
+
+import core.datatools
+
+_HOUR = 3600
+
+HKFE_HOLIDAYS = (
+    date(2010, 1, 1), date(2010, 2, 15), date(2010, 2, 16), date(2010, 4, 2), date(2010, 4, 5),
+    date(2010, 4, 6), date(2010, 5, 21), date(2010, 6, 16), date(2010, 7, 1), date(2010, 9, 23),
+    date(2010, 10, 1), date(2010, 12, 27),
+)
+"""Weekdays HKFE was closed."""
+
+HKFE_HALF_DAYS = (date(2010, 12, 24), date(2010, 12, 31))
+"""Days HKFE closed at noon, after the morning session."""
+
+HKFE_LISTED = (date(2010, 1, 1), date(2010, 12, 31))
+"""Range of the days ``HKFE_HOLIDAYS`` and ``HKFE_HALF_DAYS`` are complete for (inclusive)."""
+
+HKFE_SESSION_REGIMES = (
+    (date(1970, 1, 1), ((10 * _HOUR, 12 * _HOUR + 1800), (14 * _HOUR + 1800, 16 * _HOUR))),
+    (date(2011, 3, 7), ((9 * _HOUR + 1800, 12 * _HOUR), (13 * _HOUR + 1800, 16 * _HOUR))),
+    (date(2012, 3, 5), ((9 * _HOUR + 1800, 12 * _HOUR), (13 * _HOUR, 16 * _HOUR))),
+)
+"""``(first day, sessions)`` of the trading hours of HKFE indices, sessions are ``(start, end)``
+seconds of the day."""
+
+
+class TradingCalendar(object):
+    """Represents the trading days and sessions of an exchange between two dates.
+
+    Args:
+        holidays: weekdays the exchange is closed.
+        half_days: days only the first session is traded.
+        regimes: ``(first day, sessions)`` of the trading hours, in date order.
+        listed: ``(first day, last day)`` the holidays and half days are complete for, other
+            weekdays are full trading days. Every day of the tables if None.
+        start, end: the range of the tables (inclusive), queries of days outside raise
+            ``ValueError``.
+    """
+    def __init__(self, holidays=HKFE_HOLIDAYS, half_days=HKFE_HALF_DAYS,
+                 regimes=HKFE_SESSION_REGIMES, listed=HKFE_LISTED,
+                 start: date = date(2000, 1, 1), end: date = date(2040, 12, 31)):
+        self._start = start
+        self._end = end
+        self._listed = (start, end) if listed is None else tuple(listed)
+        self._first = start.toordinal()
+        self._last = end.toordinal()
+        ordinals = np.arange(self._first, self._last + 1)
+        # date.toordinal() of a Monday is 1 modulo 7.
+        trading = (ordinals % 7 != 6) & (ordinals % 7 != 0)
+        trading[self._indices(holidays)] = False
+        half = np.zeros(len(ordinals), dtype=bool)
+        half[self._indices(half_days)] = True
+
+        # Each day points into the table of distinct sessions, half days to their first session.
+        self._sessions = []
+        session_index = np.full(len(ordinals), -1, dtype=np.int16)
+        starts = [first.toordinal() for first, _ in regimes] + [self._last + 1]
+        for (first, sessions), following in zip(regimes, starts[1:]):
+            lower = max(first.toordinal(), self._first) - self._first
+            upper = max(following, self._first) - self._first
+            session_index[lower:upper] = self._session_id(tuple(sessions))
+            session_index[lower:upper][half[lower:upper]] = self._session_id(tuple(sessions[:1]))
+        session_index[~trading] = -1
+
+        self._trading = trading
+        self._half = half & trading
+        self._session_index = session_index
+        self._cumulative = np.concatenate(([0], np.cumsum(trading)))
+        self._trading_ordinals = ordinals[trading]
+        self._bar_counts = {}
+        epoch = date(1970, 1, 1).toordinal()
+        self._regimes = [((first.toordinal() - epoch) * 86400, tuple(sessions))
+                         for first, sessions in regimes]
+
+    @property
+    def start(self) -> date:
+        """The first day of the tables."""
+        return self._start
+
+    @property
+    def end(self) -> date:
+        """The last day of the tables."""
+        return self._end
+
+    def covers(self, the_date: date) -> bool:
+        """Checks whether a day is within the range of the tables."""
+        return self._first <= the_date.toordinal() <= self._last
+
+    def is_listed(self, the_date: date) -> bool:
+        """Checks whether the holidays and half days are listed for a day, otherwise it is a
+        trading day if it is a weekday."""
+        return self._listed[0] <= the_date <= self._listed[1]
+
+    def is_trading_day(self, the_date: date) -> bool:
+        return bool(self._trading[self._index(the_date)])
+
+    def is_half_day(self, the_date: date) -> bool:
+        return bool(self._half[self._index(the_date)])
+
+    def sessions(self, the_date: date) -> tuple:
+        """Gets the ``(start, end)`` seconds of the day of the sessions of a day, empty on
+        non-trading days."""
+        index = self._index(the_date)
+        if self._session_index[index] < 0:
+            return ()
+        return self._sessions[self._session_index[index]]
+
+    def count_trading_days(self, start: date, end: date) -> int:
+        """Counts the trading days between two dates (inclusive)."""
+        lower, upper = self._bounds(start, end)
+        return int(self._cumulative[upper] - self._cumulative[lower])
+
+    def trading_days(self, start: date, end: date):
+        """Gets the trading days between two dates (inclusive), in the order of the arguments
+        like ``core.datatools.date_range``."""
+        lower, upper = self._bounds(start, end)
+        ordinals = self._trading_ordinals[self._cumulative[lower]:self._cumulative[upper]]
+        days = [date.fromordinal(int(ordinal)) for ordinal in ordinals]
+        return days if start <= end else days[::-1]
+
+    def expected_bars(self, the_date: date, bar_size) -> int:
+        """Gets the number of bars of ``bar_size`` of a day, 0 on non-trading days.
+
+        Bars are aligned to the start of each session, the last one may be cut short.
+        """
+        index = self._index(the_date)
+        if self._session_index[index] < 0:
+            return 0
+        seconds = core.datatools.bar_seconds(bar_size)
+        counts = self._bar_counts.get(seconds)
+        if counts is None:
+            counts = [1 if seconds >= 86400 else sum(-(-(end - start) // seconds)
+                                                     for start, end in sessions)
+                      for sessions in self._sessions]
+            self._bar_counts[seconds] = counts
+        return counts[self._session_index[index]]
+
+    def regimes(self, start: int = None, end: int = None):
+        """Gets the ``(start, end, sessions)`` of the periods of constant trading hours that
+        overlap the epoch seconds ``start`` (inclusive) and ``end`` (exclusive). The end of the
+        last period is ``None``."""
+        periods = []
+        for (lower, sessions), (upper, _) in zip(self._regimes, self._regimes[1:] + [(None, None)]):
+            if (end is None or lower < end) and (start is None or upper is None or upper > start):
+                periods.append((lower, upper, sessions))
+        return periods
+
+    def _session_id(self, sessions) -> int:
+        if sessions not in self._sessions:
+            self._sessions.append(sessions)
+        return self._sessions.index(sessions)
+
+    def _indices(self, days):
+        indices = np.array([day.toordinal() for day in days], dtype=np.int64) - self._first
+        return indices[(indices >= 0) & (indices < self._last - self._first + 1)]
+
+    def _index(self, the_date) -> int:
+        if not self.covers(the_date):
+            raise ValueError("%s is outside the calendar, from %s to %s." %
+                             (the_date, self._start, self._end))
+        return the_date.toordinal() - self._first
+
+    def _bounds(self, start, end):
+        if start > end:
+            start, end = end, start
+        return self._index(start), self._index(end) + 1
+
+
+HKFE_CALENDAR = TradingCalendar()
+"""Calendar of HKFE indices."""
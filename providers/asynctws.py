@@ -0,0 +1,173 @@
+"""Asyncio front-end of ``TwsClient``.
+
+Historical data requests are awaitable and market data subscriptions are async iterators of
+ticks. TWS callbacks still arrive on the socket reader thread; they are handed to the event loop
+with ``call_soon_threadsafe`` only when a coroutine is waiting, so no thread is started per
+request and one connection can carry many concurrent requests.
+
+Example::
+
+    client = AsyncTwsClient(TwsClient(client_id=16))
+    bars = await client.historical_data(contract, "20100105 00:00:00", bar_size=BarSize.Sec30)
+    async for tick in await client.market_data(contract):
+        print(tick.field, tick.value)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import threading
+from collections import deque
+
+from swigibpy import Contract
+
+import core.datatools
+from core.metrics import METRICS
+from providers.ibtws import TwsClient, Tick, BarSize, WhatToShow, UseRth, FormatDate
+
+MAX_TICKS = 10000
+"""Default number of ticks a ``TickStream`` queues for a slow consumer."""
+
+_DROPPED = METRICS.counter('tws_ticks_dropped_total', "Ticks dropped by a full tick stream.")
+
+
+class RequestError(RuntimeError):
+    """Raised when TWS cancels a request with an error."""
+    pass
+
+
+class _HistoricalBars(object):
+    """Collects the bars of a historical data request on the reader thread."""
+    def __init__(self):
+        self.bars = core.datatools.BarBuffer()
+
+    def historicalData(self, request, date, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        self.bars.append(date, open_, high, low, close, volume, bar_count, wap, has_gaps)
+
+
+class TickStream(object):
+    """Represents a market data subscription as an async iterator of ``Tick``.
+
+    Ticks are queued on the reader thread and the waiting coroutine, if any, is woken up once.
+    At most ``max_ticks`` are queued, the oldest tick is dropped for a new one when a consumer
+    falls behind.
+    """
+    def __init__(self, max_ticks: int = MAX_TICKS):
+        self._lock = threading.Lock()
+        self._ticks = deque(maxlen=max_ticks)
+        self._dropped = 0
+        self._waiter = None
+        self._closed = False
+        self._request = None
+
+    @property
+    def request(self):
+        return self._request
+
+    @property
+    def dropped(self) -> int:
+        """The number of ticks dropped because the queue was full."""
+        return self._dropped
+
+    def close(self):
+        """Cancels the subscription, ticks already received can still be iterated."""
+        if self._request is not None:
+            self._request.cancel()
+        self._push(None, closing=True)
+
+    def _attach(self, request):
+        self._request = request
+        request.add_done_callback(lambda done: self._push(None, closing=True))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            with self._lock:
+                if self._ticks:
+                    return self._ticks.popleft()
+                if self._closed:
+                    if self._request is not None and self._request.error is not None:
+                        raise RequestError(self._request.error)
+                    raise StopAsyncIteration
+                loop = asyncio.get_running_loop()
+                waiter = loop.create_future()
+                self._waiter = (loop, waiter)
+            await waiter
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        self._push(Tick('price', field, price))
+
+    def tickSize(self, request, field, size):
+        self._push(Tick('size', field, size))
+
+    def tickGeneric(self, request, tick_type, value):
+        self._push(Tick('generic', tick_type, value))
+
+    def tickString(self, request, tick_type, value):
+        self._push(Tick('string', tick_type, value))
+
+    def _push(self, tick, closing=False):
+        with self._lock:
+            if closing:
+                self._closed = True
+            elif not self._closed:
+                if len(self._ticks) == self._ticks.maxlen:
+                    self._dropped += 1
+                    _DROPPED.inc()
+                self._ticks.append(tick)
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_wake, future)
+
+
+class AsyncTwsClient(object):
+    """Represents an asyncio front-end of a connected ``TwsClient``."""
+    def __init__(self, client: TwsClient):
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client
+
+    async def historical_data(self, contract: Contract, end_datetime: str, duration: str = "1 D",
+                              bar_size: BarSize = BarSize.Min1,
+                              what_to_show: WhatToShow = WhatToShow.Trades,
+                              use_rth: UseRth = UseRth.WithinTradingHour,
+                              format_date: FormatDate = FormatDate.InString):
+        """Requests historical data and returns its bars as a ``BAR_DTYPE`` array.
+
+        Raises:
+            RequestError: TWS cancelled the request.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        handler = _HistoricalBars()
+        request = self._client.reqHistoricalData(handler, contract, end_datetime, duration,
+                                                 bar_size, what_to_show, use_rth, format_date)
+        request.add_done_callback(lambda done: loop.call_soon_threadsafe(_wake, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            request.cancel()
+            raise
+        if request.error is not None:
+            raise RequestError(request.error)
+        return handler.bars.bars
+
+    async def market_data(self, contract: Contract, generic_tick: str = "",
+                          snapshot: bool = False, max_ticks: int = MAX_TICKS) -> TickStream:
+        """Subscribes to market data and returns the stream of its ticks, see ``TickStream``."""
+        stream = TickStream(max_ticks)
+        # noinspection PyProtectedMember
+        stream._attach(self._client.reqMarketData(stream, contract, generic_tick, snapshot))
+        return stream
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,157 @@
+"""Conflating market data subscriber.
+
+``TwsClient.reqMarketData`` calls its handler on the TWS reader thread, so a slow handler holds
+up the socket for every subscription. ``ConflatingHandler`` only records each tick, in a snapshot
+of the latest value per tick type and a bounded ring buffer of recent ticks, and a delivery
+thread hands the accumulated ticks to the consumer in batches. The reader thread never runs
+consumer code.
+
+Example::
+
+    def on_batch(batches):
+        for batch in batches:
+            print(batch.request.request_id, batch.snapshot.get(TickType.Last))
+
+    with ConflatingHandler(on_batch, interval=0.5, history=0) as handler:
+        tws.reqMarketData(handler, hsi, "")
+        tws.reqMarketData(handler, hhi, "")
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import threading
+from collections import deque, namedtuple
+
+from providers.ibtws import Tick
+
+TickBatch = namedtuple('TickBatch', ['request', 'snapshot', 'ticks', 'dropped'])
+"""Represents the ticks of a request since the previous batch.
+
+Attributes:
+    request: the market data request.
+    snapshot (dict): latest value per tick type, e.g. ``snapshot[TickType.Last]``.
+    ticks (list): the most recent ``Tick`` received, at most ``history`` of them.
+    dropped (int): number of ticks received but pushed out of the ring buffer.
+"""
+
+
+class _Subscription(object):
+    __slots__ = ('request', 'snapshot', 'ticks', 'received')
+
+    def __init__(self, request, history):
+        self.request = request
+        self.snapshot = {}
+        self.ticks = deque(maxlen=history) if history else None
+        self.received = 0
+
+
+class ConflatingHandler(object):
+    """Represents a market data handler delivering ticks to a consumer in batches.
+
+    Args:
+        consumer: called on the delivery thread with the list of ``TickBatch`` of the requests
+            that ticked since the previous call.
+        interval: seconds between deliveries.
+        batch_size: number of ticks that triggers a delivery before the interval elapses.
+        history: size of the ring buffer of each request, 0 to only keep the snapshot.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, consumer, interval: float = 0.1, batch_size: int = 1000,
+                 history: int = 1024):
+        self._consumer = consumer
+        self._interval = interval
+        self._batch_size = batch_size
+        self._history = history
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._dirty = {}
+        self._pending = 0
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the delivery thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._deliver_loop, name='ConflatingHandler')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stops the delivery thread once the pending ticks are delivered."""
+        self._stopped.set()
+        self._ready.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def snapshot(self, request) -> dict:
+        """Gets a copy of the latest value per tick type of a request."""
+        with self._lock:
+            subscription = self._subscriptions.get(request.request_id)
+            return {} if subscription is None else dict(subscription.snapshot)
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        self._record(request, Tick('price', field, price))
+
+    def tickSize(self, request, field, size):
+        self._record(request, Tick('size', field, size))
+
+    def tickGeneric(self, request, tick_type, value):
+        self._record(request, Tick('generic', tick_type, value))
+
+    def tickString(self, request, tick_type, value):
+        self._record(request, Tick('string', tick_type, value))
+
+    def flush(self):
+        """Delivers the pending ticks on the calling thread."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._pending = 0
+            batches = [TickBatch(subscription.request, dict(subscription.snapshot),
+                                 list(subscription.ticks) if subscription.ticks is not None else [],
+                                 subscription.received - len(subscription.ticks or ()))
+                       for subscription in dirty.values()]
+            for subscription in dirty.values():
+                subscription.received = 0
+                if subscription.ticks is not None:
+                    subscription.ticks.clear()
+        if batches:
+            self._consumer(batches)
+
+    def _record(self, request, tick):
+        with self._lock:
+            subscription = self._subscriptions.get(request.request_id)
+            if subscription is None:
+                subscription = _Subscription(request, self._history)
+                self._subscriptions[request.request_id] = subscription
+            subscription.snapshot[tick.field] = tick.value
+            if subscription.ticks is not None:
+                subscription.ticks.append(tick)
+            subscription.received += 1
+            self._dirty[request.request_id] = subscription
+            self._pending += 1
+            full = self._pending >= self._batch_size
+        if full:
+            self._ready.set()
+
+    def _deliver_loop(self):
+        while not self._stopped.is_set():
+            self._ready.wait(self._interval)
+            self._ready.clear()
+            try:
+                self.flush()
+            except Exception:  # The consumer must not stop the delivery of later batches.
+                ConflatingHandler.logger.exception("Tick batch consumer failed.")
+        self.flush()
@@ -34,14 +34,17 @@ Todo:
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
-from enum import Enum
+from collections import namedtuple
+from enum import Enum, IntEnum
 
 import logging
-import threading
 
 from threading import Event, Lock
 from swigibpy import EWrapper, EPosixClientSocket, Contract
 
+from core.metrics import METRICS, CallTimer
+from providers.registry import REGISTRY, RequestRegistry, RequestOutcome
+
 
 class Disconnecting(object):
     """Represents context manager that disconnects the TWS socket."""
@@ -116,6 +119,20 @@ class FormatDate(Enum):
     """dates are returned as a long integer specifying the number of seconds since 1/1/1970 GMT."""
 
 
+class TickType(IntEnum):
+    """Represents the field of the market data tick callbacks."""
+    BidSize = 0
+    Bid = 1
+    Ask = 2
+    AskSize = 3
+    Last = 4
+    LastSize = 5
+    High = 6
+    Low = 7
+    Volume = 8
+    Close = 9
+
+
 class RequestType(Enum):
     """Represents the request types."""
     HistoricalData = "HistoricalData"
@@ -124,6 +141,10 @@ class RequestType(Enum):
     """Request of live market data."""
 
 
+Tick = namedtuple('Tick', ['kind', 'field', 'value'])
+"""Represents a market data callback, ``kind`` is one of price, size, generic or string."""
+
+
 class Request(object):
     """Represents a pending request."""
     def __init__(self, client, request_type: RequestType, request_id: int, handler):
@@ -132,7 +153,10 @@ class Request(object):
         self._request_id = request_id
         self._handler = handler
         self._done = Event()
+        self._completed = Event()
         self._error = None
+        self._callbacks = []
+        self._callbacks_lock = Lock()
 
     @property
     def request_id(self):
@@ -154,20 +178,73 @@ class Request(object):
     def error(self):
         return self._error
 
+    def wait(self, timeout: float = None) -> bool:
+        """Waits until the request is finished or cancelled, returns whether it finished."""
+        self._completed.wait(timeout)
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """Adds a callback invoked with the request once it is finished or cancelled.
+        The callback is invoked on the thread that completes the request."""
+        with self._callbacks_lock:
+            if self._callbacks is not None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self):
+        """Marks the request as finished."""
+        self._done.set()
+        self._notify()
+
     def cancel(self, error=None):
-        """Cancels the pending request"""
-        self._error = error
-        return self._client.cancelRequest(self)
+        """Cancels the pending request, a request already finished keeps its outcome."""
+        cancelled = True  # cancelRequest only raises once the request is removed.
+        try:
+            cancelled = self._client.cancelRequest(self)
+            return cancelled
+        finally:
+            if cancelled:
+                self._error = error
+                self._notify()
+
+    def _notify(self):
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, None
+        self._completed.set()
+        for callback in callbacks or ():
+            callback(self)
+
 
 """ Represents a IB event wrapper that multicasts"""
 
 
 class _MulticastWrapper(EWrapper):
-    def __init__(self, requests: dict, lock: Lock):
+    def __init__(self, requests: RequestRegistry):
         super().__init__()
 
         self._requests = requests
-        self._lock = lock
+
+        def handler_timer(callback):
+            return CallTimer(
+                METRICS.counter('tws_callbacks_total', "Callbacks passed to a handler.",
+                                callback=callback),
+                METRICS.histogram('tws_handler_seconds', "Time spent in the handlers, sampled.",
+                                  callback=callback))
+
+        self._historical_data_timer = handler_timer('historicalData')
+        self._tick_price_timer = handler_timer('tickPrice')
+        self._tick_size_timer = handler_timer('tickSize')
+        self._tick_generic_timer = handler_timer('tickGeneric')
+        self._tick_string_timer = handler_timer('tickString')
+        self._unmatched = METRICS.counter('tws_callbacks_unmatched_total',
+                                          "Callbacks with no associated request.")
+
+        def errors(severity):
+            return METRICS.counter('tws_errors_total', "TWS error messages.", severity=severity)
+
+        self._errors = {severity: errors(severity)
+                        for severity in ('warning', 'client', 'request', 'system', 'other')}
 
     def orderStatus(self, id_, status, filled, remaining, avg_fill_price, perm_id,
                     parent_id, last_filled_price, client_id, why_held):
@@ -191,62 +268,82 @@ class _MulticastWrapper(EWrapper):
     def historicalData(self, req_id: int, date, open_, high, low, close, volume, bar_count, wap, has_gaps):
         """historicalData(EWrapper self, TickerId reqId, IBString const & date, double open, double high, double low,
         double close, int volume, int barCount, double WAP, int hasGaps)"""
-        with self._lock:
-            request = self._requests.get(req_id)
-            if request is None:
-                logging.warning("historicalData[req_id= %d] with no associated request - ignored.." % req_id)
-                return
-            elif date[:8] == 'finished':
-                del self._requests[req_id]
-                request.done.set()
-                return
-            request.handler.historicalData(request, date, open_, high, low, close, volume, bar_count, wap, has_gaps)
+        request = self._requests.get(req_id)
+        if request is None:
+            logging.warning("historicalData[req_id= %d] with no associated request - ignored..", req_id)
+            self._unmatched.inc()
+            return
+        elif date[:8] == 'finished':
+            if self._requests.remove(request, RequestOutcome.Finished):
+                end = getattr(request.handler, 'historicalDataEnd', None)
+                if end is not None:
+                    end(request)
+                request.finish()
+            return
+        started = self._historical_data_timer.start()
+        request.handler.historicalData(request, date, open_, high, low, close, volume, bar_count, wap, has_gaps)
+        if started:
+            self._historical_data_timer.stop(started)
 
     def tickPrice(self, req_id: int, field: int, price: float, can_auto_execute: int):
         """tickPrice(EWrapper self, TickerId tickerId, TickType field, double price, int canAutoExecute)"""
-        with self._lock:
-            request = self._requests.get(req_id)
-            if request is None:
-                logging.warning("tickPrice[req_id= %d] with no associated request - ignored." % req_id)
+        request = self._requests.get(req_id)
+        if request is None:
+            logging.debug("tickPrice[req_id= %d] with no associated request - ignored.", req_id)
+            self._unmatched.inc()
+            return
+        started = self._tick_price_timer.start()
         request.handler.tickPrice(request, field, price, can_auto_execute)
+        if started:
+            self._tick_price_timer.stop(started)
 
     def tickSize(self, req_id: int, field: int, size: int):
         """tickSize(EWrapper self, TickerId tickerId, TickType field, int size)"""
-        with self._lock:
-            request = self._requests.get(req_id)
-            if request is None:
-                logging.warning("tickSize[req_id= %d] with no associated request - ignored." % req_id)
-                return
-
+        request = self._requests.get(req_id)
+        if request is None:
+            logging.debug("tickSize[req_id= %d] with no associated request - ignored.", req_id)
+            self._unmatched.inc()
+            return
+        started = self._tick_size_timer.start()
         request.handler.tickSize(request, field, size)
+        if started:
+            self._tick_size_timer.stop(started)
 
     def tickGeneric(self, req_id: int, tick_type: int, value: float):
         """tickGeneric(EWrapper self, TickerId tickerId, TickType tickType, double value)"""
-        with self._lock:
-            request = self._requests.get(req_id)
-            if request is None:
-                logging.warning("tickGeneric[req_id=" + str(req_id) + "] with no associated request - ignored.")
-                return
-
+        request = self._requests.get(req_id)
+        if request is None:
+            logging.debug("tickGeneric[req_id= %d] with no associated request - ignored.", req_id)
+            self._unmatched.inc()
+            return
+        started = self._tick_generic_timer.start()
         request.handler.tickGeneric(request, tick_type, value)
+        if started:
+            self._tick_generic_timer.stop(started)
 
     def tickString(self, req_id: int, tick_type: int, value: str):
         """tickString(EWrapper self, TickerId tickerId, TickType tickType, IBString const & value)"""
-        with self._lock:
-            request = self._requests.get(req_id)
-            if request is None:
-                logging.warning("tickGeneric[req_id=" + str(req_id) + "] with no associated request - ignored.")
-                return
+        request = self._requests.get(req_id)
+        if request is None:
+            logging.debug("tickString[req_id= %d] with no associated request - ignored.", req_id)
+            self._unmatched.inc()
+            return
+        started = self._tick_string_timer.start()
         request.handler.tickString(request, tick_type, value)
+        if started:
+            self._tick_string_timer.stop(started)
 
     def error(self, req_id: int, error_code: int, error_string: str):
         import sys
         if error_code == 165:  # Historical data sevice message
+            self._errors['warning'].inc()
             sys.stderr.write("TWS Warning - %s: %s\n" % (error_code, error_string))
         elif 501 <= error_code < 600:  # Socket read failed
+            self._errors['client'].inc()
             sys.stderr.write("TWS Client Error - %s: %s\n" % (error_code, error_string))
 
         elif 100 <= error_code < 1100:
+            self._errors['request'].inc()
             sys.stderr.write("TWS Error - %s: %s\n" % (error_code, error_string))
             request = self._requests.get(req_id)
             if request is not None:
@@ -254,30 +351,38 @@ class _MulticastWrapper(EWrapper):
                 return
 
         elif 1100 <= error_code < 2100:
+            self._errors['system'].inc()
             sys.stderr.write("TWS System Error - %s: %s\n" % (error_code, error_string))
         elif 2100 <= error_code <= 2110:
+            self._errors['warning'].inc()
             sys.stderr.write("TWS Warning - %s: %s\n" % (error_code, error_string))
         else:
+            self._errors['other'].inc()
             sys.stderr.write("TWS Error - %s: %s\n" % (error_code, error_string))
 
 
 class TwsClient(object):
     logger = logging.getLogger(__name__)
     """Represents Interactive Broker's TWS."""
-    _next_request_id = 0
 
-    def __init__(self, client_id: int):
-        """Initialises an instance for the specified client id."""
+    def __init__(self, client_id: int, socket_factory=EPosixClientSocket,
+                 registry: RequestRegistry = None):
+        """Initialises an instance for the specified client id.
+        The socket factory is called with the wrapper receiving the TWS callbacks. Request ids
+        are allocated by the registry, the registry of the process by default."""
         self._client_id = client_id
-        self._requests_lock = threading.Lock()
-        self._requests = {}
-        self._wrapper = _MulticastWrapper(self._requests, self._requests_lock)
-        self._socket = EPosixClientSocket(self._wrapper)
+        self._requests = REGISTRY if registry is None else registry
+        self._wrapper = _MulticastWrapper(self._requests)
+        self._socket = socket_factory(self._wrapper)
 
     @property
     def client_id(self):
         return self._client_id
 
+    @property
+    def registry(self) -> RequestRegistry:
+        return self._requests
+
     def connect(self, host: str="", port: int=7496)->Disconnecting:
         """Connects to TWS."""
         if not self._socket.eConnect(host, port, self.client_id):
@@ -286,11 +391,21 @@ class TwsClient(object):
         TwsClient.logger.info("Client[%d] connected at Host: %s, Port: %d" % (self._client_id, host, port))
         return Disconnecting(self._socket)
 
+    def isConnected(self) -> bool:
+        """Checks whether the socket to TWS is still connected."""
+        return bool(self._socket.isConnected())
+
+    def disconnect(self):
+        """Disconnects from TWS."""
+        self._socket.eDisconnect()
+
     def reqHistoricalData(self, handler, contract: Contract, end_datetime: str, duration: str = "1 D",
                           bar_size: BarSize = BarSize.Min1, what_to_show: WhatToShow = WhatToShow.Trades,
-                          use_rth: UseRth = UseRth.WithinTradingHour, format_date: FormatDate = FormatDate.InString):
-        """"""
-        request = self._createRequest(RequestType.HistoricalData, handler)
+                          use_rth: UseRth = UseRth.WithinTradingHour, format_date: FormatDate = FormatDate.InString,
+                          timeout: float = None):
+        """Requests historical data, cancelled with the error ``registry.TIMED_OUT`` if not finished
+        within ``timeout`` seconds."""
+        request = self._createRequest(RequestType.HistoricalData, handler, timeout)
         self._socket.reqHistoricalData(request.request_id, contract, end_datetime, duration, bar_size.value,
                                        what_to_show.value, use_rth.value, format_date.value)
         return request
@@ -307,29 +422,25 @@ class TwsClient(object):
     def cancelRequest(self, request: Request):
         """"""
         req_id = request.request_id
-        with self._requests_lock:
-            if self._requests.get(req_id) != request:
-                return False
-            del self._requests[req_id]
-            try:
-                {
-                    RequestType.HistoricalData: lambda:
-                        self._socket.cancelHistoricalData(req_id),
-                    RequestType.MarketData: lambda:
-                        self.cancelMktData(req_id)
-                }[request.request_type]()
-            except KeyError:
-                raise LookupError("Client[%d] Reqest: %d - Unable to cancel unknown request type [%s]." %
-                                  (self._client_id, req_id, request.request_type.value))
+        if not self._requests.remove(request):
+            return False
+        try:
+            {
+                RequestType.HistoricalData: lambda:
+                    self._socket.cancelHistoricalData(req_id),
+                RequestType.MarketData: lambda:
+                    self.cancelMktData(req_id)
+            }[request.request_type]()
+        except KeyError:
+            raise LookupError("Client[%d] Reqest: %d - Unable to cancel unknown request type [%s]." %
+                              (self._client_id, req_id, request.request_type.value))
+        return True
 
     def cancelMktData(self, req_id):
         TwsClient.logger.info('MarketData request[%d] is cancelled.' % req_id)
         self._socket.cancelMktData(req_id)
 
-    def _createRequest(self, req_type: RequestType, handler) -> Request:
-        TwsClient._next_request_id += 1
-        req_id = TwsClient._next_request_id
-        request = Request(self, req_type, req_id, handler)
-        with self._requests_lock:
-            self._requests[req_id] = request
+    def _createRequest(self, req_type: RequestType, handler, timeout: float = None) -> Request:
+        request = Request(self, req_type, self._requests.next_id(), handler)
+        self._requests.add(request, timeout)
         return request
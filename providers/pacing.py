@@ -0,0 +1,110 @@
+"""Models the pacing limits TWS applies to historical data requests.
+
+TWS rejects historical data requests with a pacing violation when:
+
+* more than 60 requests are made within any 10 minute period.
+* an identical request is made within 15 seconds.
+
+``Pacer`` keeps a client within those limits so requests can be issued as soon as they are
+allowed instead of sleeping a fixed amount of time between them.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+from core.metrics import METRICS
+
+PACING_WAITS = METRICS.histogram('tws_pacing_wait_seconds',
+                                 "Time requests waited for the pacing limits.")
+
+
+class TokenBucket(object):
+    """Represents a token bucket holding up to ``capacity`` tokens refilled at ``rate`` per
+    second."""
+    def __init__(self, capacity: float, rate: float, clock=time.monotonic):
+        self._capacity = capacity
+        self._rate = rate
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def delay(self, tokens: float = 1) -> float:
+        """Gets the seconds to wait until ``tokens`` are available."""
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self._rate
+
+    def consume(self, tokens: float = 1) -> bool:
+        """Takes ``tokens`` from the bucket if they are available."""
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class Pacer(object):
+    """Represents the pacing limits of historical data requests.
+
+    The bucket starts with ``burst`` tokens and refills at the rate that leaves room for them, so
+    that no ``period`` ever holds more than ``max_requests`` requests.
+    """
+    def __init__(self, max_requests: int = 60, period: float = 600, burst: int = 6,
+                 identical_interval: float = 15, clock=time.monotonic):
+        if not 0 < burst < max_requests:
+            raise ValueError("burst must be between 0 and %d." % max_requests)
+        self._bucket = TokenBucket(burst, (max_requests - burst) / period, clock)
+        self._identical_interval = identical_interval
+        self._clock = clock
+        self._last_issued = {}
+        self._lock = threading.Lock()
+
+    def delay(self, key) -> float:
+        """Gets the seconds to wait before the request identified by ``key`` can be issued."""
+        with self._lock:
+            return max(self._bucket.delay(), self._identical_delay(key))
+
+    def try_acquire(self, key) -> bool:
+        """Records the request identified by ``key`` as issued if pacing allows it now."""
+        with self._lock:
+            if self._identical_delay(key) > 0 or not self._bucket.consume():
+                return False
+            now = self._clock()
+            if len(self._last_issued) >= 1024:
+                self._last_issued = {issued_key: issued
+                                     for issued_key, issued in self._last_issued.items()
+                                     if issued + self._identical_interval > now}
+            self._last_issued[key] = now
+            return True
+
+    def acquire(self, key, sleep=time.sleep):
+        """Blocks until the request identified by ``key`` can be issued, then records it."""
+        waited = 0.0
+        while not self.try_acquire(key):
+            delay = self.delay(key)
+            sleep(delay)
+            waited += delay
+        PACING_WAITS.observe(waited)
+
+    def _identical_delay(self, key) -> float:
+        last_issued = self._last_issued.get(key)
+        if last_issued is None:
+            return 0.0
+        return max(0.0, last_issued + self._identical_interval - self._clock())
@@ -0,0 +1,385 @@
+"""Pool of TWS sessions.
+
+TWS accepts up to 32 clients with distinct client ids. ``TwsClientPool`` connects one
+``TwsClient`` per client id and routes every request to the session with the fewest requests in
+flight. A supervisor thread checks the sessions, reconnects the dropped ones with exponential
+back-off and issues their requests in flight again, on the least loaded connected session.
+
+Requests of the pool are ``PooledRequest`` which keep their id, handler and ``done`` event
+across re-issues, so handlers and callers see a single request::
+
+    with TwsClientPool([15, 16, 17]) as pool:
+        requests = [pool.reqHistoricalData(HistoricalData(), contract, end) for end in ends]
+        for request in requests:
+            request.wait()
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import logging
+import threading
+import time
+
+from swigibpy import EPosixClientSocket, Contract
+
+from providers.ibtws import TwsClient, BarSize, WhatToShow, UseRth, FormatDate, RequestType
+
+CHECK_INTERVAL = 1  # Seconds between checks of the sessions.
+MIN_BACKOFF = 1  # Seconds before the first reconnection attempt.
+MAX_BACKOFF = 60  # Maximum seconds between reconnection attempts.
+
+
+class PooledRequest(object):
+    """Represents a request of the pool, issued on one session at a time."""
+    def __init__(self, pool, request_type: RequestType, request_id: int, handler, issue):
+        self._pool = pool
+        self._request_type = request_type
+        self._request_id = request_id
+        self._handler = handler
+        self._issue = issue
+        self._done = threading.Event()
+        self._completed = threading.Event()
+        self._error = None
+        self._request = None
+        self._session = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._generation = 0  # Callbacks of the requests of previous sessions are ignored.
+        self._delivered = 0  # Historical bars received, skipped when the request is re-issued.
+        self._skip = 0
+
+    @property
+    def request_id(self):
+        return self._request_id
+
+    @property
+    def request_type(self):
+        return self._request_type
+
+    @property
+    def handler(self):
+        return self._handler
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def client_id(self):
+        """The client id of the session the request is issued on."""
+        session = self._session
+        return None if session is None else session.client_id
+
+    def wait(self, timeout: float = None) -> bool:
+        """Waits until the request is finished or cancelled, returns whether it finished."""
+        self._completed.wait(timeout)
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """Adds a callback invoked with the request once it is finished or cancelled."""
+        with self._lock:
+            if self._callbacks is not None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self, error=None):
+        """Cancels the request."""
+        with self._lock:
+            request = self._request
+            if self._callbacks is None:
+                return False
+        self._error = error
+        cancelled = request is not None and request.cancel(error)
+        self._complete(None)
+        return cancelled
+
+    def _attach(self, session):
+        """Issues the request on a session."""
+        with self._lock:
+            self._session = session
+            self._generation += 1
+            self._skip = max(self._skip, self._delivered)
+            self._delivered = 0
+            self._request = self._issue(session.client, _PooledHandler(self, self._generation))
+            request = self._request
+        request.add_done_callback(self._on_done)
+
+    def _on_done(self, request):
+        if request is not self._request:
+            return  # Abandoned with its dropped session.
+        self._error = request.error
+        self._complete(request)
+
+    def _complete(self, request):
+        with self._lock:
+            if request is not None and request is not self._request:
+                return
+            callbacks, self._callbacks = self._callbacks, None
+            session, self._request = self._session, None
+        if callbacks is None:
+            return
+        self._pool._release(self, session)
+        if request is not None and request.done.is_set():
+            self._done.set()
+        self._completed.set()
+        for callback in callbacks:
+            callback(self)
+
+    def _accept(self, generation: int) -> bool:
+        """Checks whether a callback comes from the current session."""
+        return generation == self._generation
+
+    def _accept_bar(self, generation: int) -> bool:
+        """Counts a historical bar, False for the bars already delivered before a re-issue."""
+        if generation != self._generation:
+            return False
+        self._delivered += 1
+        return self._delivered > self._skip
+
+
+class _PooledHandler(object):
+    """Forwards the callbacks of the request of a session to the handler of the pooled request."""
+    __slots__ = ('_pooled', '_generation')
+
+    def __init__(self, pooled: PooledRequest, generation: int):
+        self._pooled = pooled
+        self._generation = generation
+
+    def historicalData(self, request, date, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        if self._pooled._accept_bar(self._generation):
+            self._pooled.handler.historicalData(self._pooled, date, open_, high, low, close,
+                                                volume, bar_count, wap, has_gaps)
+
+    def historicalDataEnd(self, request):
+        end = getattr(self._pooled.handler, 'historicalDataEnd', None)
+        if end is not None and self._pooled._accept(self._generation):
+            end(self._pooled)
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        if self._pooled._accept(self._generation):
+            self._pooled.handler.tickPrice(self._pooled, field, price, can_auto_execute)
+
+    def tickSize(self, request, field, size):
+        if self._pooled._accept(self._generation):
+            self._pooled.handler.tickSize(self._pooled, field, size)
+
+    def tickGeneric(self, request, tick_type, value):
+        if self._pooled._accept(self._generation):
+            self._pooled.handler.tickGeneric(self._pooled, tick_type, value)
+
+    def tickString(self, request, tick_type, value):
+        if self._pooled._accept(self._generation):
+            self._pooled.handler.tickString(self._pooled, tick_type, value)
+
+
+class _Session(object):
+    """Represents the connection of a client id."""
+    __slots__ = ('client_id', 'client', 'requests', 'backoff', 'retry_at')
+
+    def __init__(self, client_id, backoff):
+        self.client_id = client_id
+        self.client = None
+        self.requests = set()
+        self.backoff = backoff
+        self.retry_at = 0.0
+
+
+class TwsClientPool(object):
+    """Represents a pool of TWS sessions with distinct client ids.
+
+    Args:
+        client_ids: the client id of each session.
+        socket_factory: called with the wrapper of each session, see ``TwsClient``.
+        check_interval: seconds between checks of the sessions by the supervisor thread.
+        min_backoff, max_backoff: bounds of the exponential back-off of reconnections.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, client_ids, host: str = "", port: int = 7496,
+                 socket_factory=EPosixClientSocket, check_interval: float = CHECK_INTERVAL,
+                 min_backoff: float = MIN_BACKOFF, max_backoff: float = MAX_BACKOFF,
+                 clock=time.monotonic):
+        if len(set(client_ids)) != len(client_ids):
+            raise ValueError("Client ids of a pool must be distinct: %s" % (client_ids,))
+        self._sessions = [_Session(client_id, min_backoff) for client_id in client_ids]
+        self._parked = []  # Requests of dropped sessions while no session is connected.
+        self._host = host
+        self._port = port
+        self._socket_factory = socket_factory
+        self._check_interval = check_interval
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def client_ids(self):
+        return [session.client_id for session in self._sessions]
+
+    def connected_ids(self):
+        """Gets the client ids of the connected sessions."""
+        with self._lock:
+            return [session.client_id for session in self._sessions if session.client is not None]
+
+    def load(self) -> dict:
+        """Gets the number of requests in flight per client id."""
+        with self._lock:
+            return {session.client_id: len(session.requests) for session in self._sessions}
+
+    def connect(self):
+        """Connects the sessions and starts the supervisor thread.
+
+        Raises:
+            RuntimeError: if no session could be connected.
+        """
+        for session in self._sessions:
+            self._connect(session)
+        if not self.connected_ids():
+            raise RuntimeError("No TWS session could be connected at Host: %s, Port: %d" %
+                               (self._host, self._port))
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._supervise, name='TwsClientPool')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stops the supervisor thread and disconnects the sessions."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            for session in self._sessions:
+                if session.client is not None:
+                    session.client.disconnect()
+                    session.client = None
+
+    def __enter__(self):
+        return self.connect()
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def reqHistoricalData(self, handler, contract: Contract, end_datetime: str,
+                          duration: str = "1 D", bar_size: BarSize = BarSize.Min1,
+                          what_to_show: WhatToShow = WhatToShow.Trades,
+                          use_rth: UseRth = UseRth.WithinTradingHour,
+                          format_date: FormatDate = FormatDate.InString,
+                          timeout: float = None) -> PooledRequest:
+        """Requests historical data on the least loaded session, see ``TwsClient``. The timeout
+        applies to each issue of the request."""
+        return self._submit(RequestType.HistoricalData, handler, lambda client, pooled_handler:
+                            client.reqHistoricalData(pooled_handler, contract, end_datetime,
+                                                     duration, bar_size, what_to_show, use_rth,
+                                                     format_date, timeout))
+
+    def reqMarketData(self, handler, contract: Contract, generic_tick: str,
+                      snapshot: bool = False) -> PooledRequest:
+        """Requests market data on the least loaded session, see ``TwsClient``."""
+        return self._submit(RequestType.MarketData, handler, lambda client, pooled_handler:
+                            client.reqMarketData(pooled_handler, contract, generic_tick, snapshot))
+
+    def check(self):
+        """Reconnects the dropped sessions that are due and re-issues their requests."""
+        now = self._clock()
+        due = []
+        with self._lock:
+            orphans, self._parked = self._parked, []
+            for session in self._sessions:
+                if session.client is not None and not session.client.isConnected():
+                    TwsClientPool.logger.warning("Client[%d] disconnected.", session.client_id)
+                    # The requests of the dropped session are issued again, theirs are abandoned.
+                    for pooled in session.requests:
+                        abandoned = pooled._request
+                        if abandoned is not None:
+                            session.client.registry.remove(abandoned)
+                    session.client.disconnect()
+                    session.client = None
+                    session.retry_at = now
+                    orphans.extend(session.requests)
+                    session.requests.clear()
+                if session.client is None and session.retry_at <= now:
+                    session.retry_at = float('inf')  # Connecting, skipped by other checks.
+                    due.append(session)
+        # Connecting may take seconds, requests are submitted and released meanwhile.
+        for session in due:
+            try:
+                self._connect(session)
+            finally:
+                with self._lock:
+                    if session.retry_at == float('inf'):  # Connected, or _connect raised.
+                        session.retry_at = now
+        for pooled in orphans:
+            self._reissue(pooled)
+
+    def _submit(self, request_type, handler, issue) -> PooledRequest:
+        pooled = PooledRequest(self, request_type, next(self._ids), handler, issue)
+        with self._lock:
+            session = self._least_loaded()
+            session.requests.add(pooled)
+        pooled._attach(session)
+        return pooled
+
+    def _reissue(self, pooled):
+        with self._lock:
+            if pooled.done.is_set():
+                return
+            session = self._least_loaded(required=False)
+            if session is None:
+                self._parked.append(pooled)
+                return
+            session.requests.add(pooled)
+        TwsClientPool.logger.info("Request[%d] re-issued on client[%d].", pooled.request_id,
+                                  session.client_id)
+        pooled._attach(session)
+
+    def _release(self, pooled, session):
+        with self._lock:
+            if session is not None:
+                session.requests.discard(pooled)
+            if pooled in self._parked:
+                self._parked.remove(pooled)
+
+    def _least_loaded(self, required: bool = True):
+        connected = [session for session in self._sessions if session.client is not None]
+        if not connected:
+            if required:
+                raise RuntimeError("No TWS session connected.")
+            return None
+        return min(connected, key=lambda session: len(session.requests))
+
+    def _connect(self, session):
+        """Connects a session, on failure the next attempt is delayed by the back-off."""
+        client = TwsClient(session.client_id, socket_factory=self._socket_factory)
+        try:
+            client.connect(self._host, self._port)
+        except RuntimeError as e:
+            TwsClientPool.logger.warning("%s - retry in %.0f seconds.", e, session.backoff)
+            with self._lock:
+                session.retry_at = self._clock() + session.backoff
+                session.backoff = min(session.backoff * 2, self._max_backoff)
+            return
+        with self._lock:
+            session.client = client
+            session.backoff = self._min_backoff
+
+    def _supervise(self):
+        while not self._stopped.wait(self._check_interval):
+            try:
+                self.check()
+            except Exception:  # The supervisor must keep running.
+                TwsClientPool.logger.exception("TWS session check failed.")
@@ -0,0 +1,221 @@
+"""Process-wide registry of the pending TWS requests.
+
+Request ids are allocated from a single counter shared by all the ``TwsClient`` of the process.
+Each request may have a deadline, deadlines are kept in a hashed timer wheel advanced by one
+thread, which cancels the requests still pending when their deadline passes. The registry also
+counts the requests in flight per ``RequestType`` and keeps the latency of the recent finished
+ones::
+
+    stats = REGISTRY.stats(RequestType.HistoricalData)
+    print(stats.in_flight, stats.expired, stats.p99)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import math
+import threading
+import time
+from collections import deque, namedtuple
+from enum import Enum
+
+import numpy as np
+
+from core.metrics import METRICS, TimedLock
+
+TIMED_OUT = "Request timed out."
+"""Error of the requests cancelled by their deadline."""
+
+
+class RequestOutcome(Enum):
+    """Represents how a request left the registry."""
+    Finished = "finished"
+    Cancelled = "cancelled"
+    Expired = "expired"
+
+
+RequestStats = namedtuple('RequestStats', ['in_flight', 'finished', 'cancelled', 'expired',
+                                           'p50', 'p90', 'p99'])
+"""Represents the counters of a request type, latencies are in seconds over the recent finished
+requests, ``None`` before the first one."""
+
+
+class _TypeStats(object):
+    __slots__ = ('in_flight', 'outcomes', 'latencies', 'seconds', 'outcomes_total')
+
+    def __init__(self, request_type, window):
+        self.in_flight = 0
+        self.outcomes = dict.fromkeys(RequestOutcome, 0)
+        self.latencies = deque(maxlen=window)
+        type_name = getattr(request_type, 'value', request_type)
+        self.seconds = METRICS.histogram('tws_request_seconds',
+                                         "Time from the request to its last callback.",
+                                         type=type_name)
+        self.outcomes_total = {outcome: METRICS.counter('tws_requests_total',
+                                                        "Requests removed by outcome.",
+                                                        type=type_name, outcome=outcome.value)
+                               for outcome in RequestOutcome}
+
+
+_LOCK_WAITS = METRICS.histogram('tws_registry_lock_wait_seconds',
+                                "Time waiting for the lock of the request registry.")
+
+
+class RequestRegistry(object):
+    """Represents the pending requests by id.
+
+    Lookups read the current dictionary without locking. Updates are serialised by a lock and
+    publish a modified copy, so the callback hot path never waits on request creation or
+    cancellation.
+
+    Args:
+        tick: resolution of the deadlines in seconds.
+        slots: number of slots of the timer wheel, deadlines beyond ``tick * slots`` take more
+            than one turn.
+        latency_window: number of recent latencies kept per request type.
+        timer: whether a thread advances the wheel, otherwise ``advance`` has to be called.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, tick: float = 0.1, slots: int = 512, latency_window: int = 1024,
+                 timer: bool = True, clock=time.monotonic):
+        self._tick = tick
+        self._clock = clock
+        self._timer = timer
+        self._lock = TimedLock(_LOCK_WAITS)
+        self._next_id = 0
+        self._requests = {}
+        self._started = {}
+        self._expiring = set()
+        self._wheel = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._cursor = 0
+        self._origin = clock()
+        self._latency_window = latency_window
+        self._stats = {}
+        self._thread = None
+
+    def __len__(self):
+        return len(self._requests)
+
+    def next_id(self) -> int:
+        """Allocates a request id."""
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def get(self, req_id: int):
+        return self._requests.get(req_id)
+
+    def add(self, request, timeout: float = None):
+        """Registers a request, cancelled if still pending after ``timeout`` seconds."""
+        with self._lock:
+            requests = dict(self._requests)
+            requests[request.request_id] = request
+            self._requests = requests
+            self._started[request.request_id] = self._clock()
+            self._type_stats(request.request_type).in_flight += 1
+            if timeout is not None:
+                self._schedule(request, timeout)
+        if timeout is not None and self._timer and self._thread is None:
+            self._start_timer()
+
+    def remove(self, request, outcome: RequestOutcome = RequestOutcome.Cancelled) -> bool:
+        """Removes the request, returns False if it was already removed."""
+        with self._lock:
+            req_id = request.request_id
+            if self._requests.get(req_id) is not request:
+                return False
+            requests = dict(self._requests)
+            del requests[req_id]
+            self._requests = requests
+            slot = self._slot_of.pop(req_id, None)
+            if slot is not None:
+                del self._wheel[slot][req_id]
+            if req_id in self._expiring:
+                self._expiring.discard(req_id)
+                if outcome == RequestOutcome.Cancelled:
+                    outcome = RequestOutcome.Expired
+            stats = self._type_stats(request.request_type)
+            stats.in_flight -= 1
+            stats.outcomes[outcome] += 1
+            stats.outcomes_total[outcome].inc()
+            started = self._started.pop(req_id)
+            if outcome == RequestOutcome.Finished:
+                latency = self._clock() - started
+                stats.latencies.append(latency)
+                stats.seconds.observe(latency)
+            return True
+
+    def stats(self, request_type) -> RequestStats:
+        """Gets the counters of a request type."""
+        with self._lock:
+            stats = self._type_stats(request_type)
+            latencies = np.array(stats.latencies)
+            outcomes = dict(stats.outcomes)
+            in_flight = stats.in_flight
+        percentiles = np.percentile(latencies, [50, 90, 99]).tolist() if len(latencies) \
+            else [None] * 3
+        return RequestStats(in_flight, outcomes[RequestOutcome.Finished],
+                            outcomes[RequestOutcome.Cancelled], outcomes[RequestOutcome.Expired],
+                            *percentiles)
+
+    def advance(self):
+        """Cancels the requests whose deadline passed."""
+        expired = []
+        with self._lock:
+            due = int((self._clock() - self._origin) / self._tick)
+            while self._cursor < due:
+                self._cursor += 1
+                slot = self._wheel[self._cursor % len(self._wheel)]
+                for req_id, (request, rounds) in list(slot.items()):
+                    if rounds > 0:
+                        slot[req_id] = (request, rounds - 1)
+                        continue
+                    del slot[req_id]
+                    del self._slot_of[req_id]
+                    self._expiring.add(req_id)
+                    expired.append(request)
+        for request in expired:
+            RequestRegistry.logger.info("Request[%d] timed out.", request.request_id)
+            try:
+                request.cancel(TIMED_OUT)
+            except Exception:  # A failing cancellation must not stop the expiry of the others.
+                RequestRegistry.logger.exception("Request[%d] cancellation failed.",
+                                                 request.request_id)
+        with self._lock:
+            self._expiring.difference_update(request.request_id for request in expired)
+
+    def _schedule(self, request, timeout):
+        now_tick = int((self._clock() - self._origin) / self._tick)
+        ticks = max(1, int(math.ceil(timeout / self._tick))) + max(0, now_tick - self._cursor)
+        slot = (self._cursor + ticks) % len(self._wheel)
+        self._wheel[slot][request.request_id] = (request, (ticks - 1) // len(self._wheel))
+        self._slot_of[request.request_id] = slot
+
+    def _type_stats(self, request_type) -> _TypeStats:
+        stats = self._stats.get(request_type)
+        if stats is None:
+            stats = self._stats[request_type] = _TypeStats(request_type, self._latency_window)
+        return stats
+
+    def _start_timer(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run_timer, name='RequestRegistry')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self._tick)
+            try:
+                self.advance()
+            except Exception:  # The timer must keep running.
+                RequestRegistry.logger.exception("Request expiry failed.")
+
+
+REGISTRY = RequestRegistry()
+"""Registry of the process, shared by the ``TwsClient`` that are not given one."""
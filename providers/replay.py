@@ -0,0 +1,197 @@
+"""Replays stored bars through the ``TwsClient`` interface.
+
+``BarReplay`` stands in for the socket of a ``TwsClient``, so handlers are called by the same
+``_MulticastWrapper`` as with TWS:
+
+* historical data requests are answered at once with the stored bars of the requested period,
+  resampled to the requested bar size;
+* market data subscriptions receive ``TickType.Last`` and ``TickType.LastSize`` ticks derived
+  from the stored bars when ``run`` is called. The ticks of all the subscriptions are merged in
+  time order.
+
+``clock`` gives the replayed time, e.g. for a ``providers.tickbars.BarAggregator``::
+
+    replay = BarReplay(date(2010, 1, 4), date(2010, 1, 8), speed=10)
+    tws = replay.client()
+    tws.reqMarketData(BarAggregator(BarSize.Min1, sink, clock=replay.clock), hsi, "")
+    replay.run()
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import heapq
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+import core.datatools
+from core.resample import resample
+from core.tradingcalendar import HKFE_CALENDAR
+from providers.ibtws import TwsClient, TickType
+
+_DURATION_SECONDS = {'S': 1, 'D': 86400, 'W': 7 * 86400, 'M': 31 * 86400, 'Y': 366 * 86400}
+
+
+def csv_source(root_dir: str = core.datatools.MARKET_DATA_DIR):
+    """Gets a source of bars reading the CSV tree of ``tools.ib_data_loader``."""
+    def load(key, start, end):
+        exchange, sec_type, symbol = key.split('-', 2)
+        return core.datatools.load_bars(exchange, sec_type, symbol, start, end, root_dir=root_dir)
+    return load
+
+
+def store_source(store):
+    """Gets a source of bars reading a ``core.barstore.BarStore``."""
+    epoch = date(1970, 1, 1).toordinal()
+
+    def load(key, start, end):
+        columns = store.read(key, (start.toordinal() - epoch) * 86400,
+                             (end.toordinal() + 1 - epoch) * 86400)
+        bars = np.empty(len(columns['date']), dtype=core.datatools.BAR_DTYPE)
+        for name in core.datatools.BAR_COLUMNS:
+            bars[name] = columns[name]
+        return bars
+    return load
+
+
+class BarReplay(object):
+    """Represents a replay of the stored 30-second bars between two dates (inclusive).
+
+    Args:
+        source: called with a contract key and two dates, returns the ``BAR_DTYPE`` bars.
+        speed: ``None`` to replay as fast as possible, 1 in real time, N for N times faster.
+    """
+    def __init__(self, start: date, end: date, source=None, speed: float = None,
+                 bar_seconds: int = 30, sleep=time.sleep, timer=time.monotonic):
+        self._start = start
+        self._end = end
+        self._source = csv_source() if source is None else source
+        self._speed = speed
+        self._bar_seconds = bar_seconds
+        self._sleep = sleep
+        self._timer = timer
+        self._wrapper = None
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._now = 0.0
+        self._stopped = threading.Event()
+
+    def client(self, client_id: int = 0, registry=None) -> TwsClient:
+        """Creates a client whose requests are answered by the replay."""
+        return TwsClient(client_id, socket_factory=self._attach, registry=registry)
+
+    def clock(self) -> float:
+        """Gets the replayed time, in seconds since 1970-01-01 in exchange wall-clock time."""
+        return self._now
+
+    def stop(self):
+        """Stops ``run`` after the current tick."""
+        self._stopped.set()
+
+    def run(self) -> int:
+        """Replays the ticks of the market data subscriptions and returns their number."""
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        streams = [self._ticks(req_id, key) for req_id, key in subscriptions]
+        wrapper = self._wrapper
+        started = None
+        count = 0
+        for the_time, _, req_id, kind, field, value in heapq.merge(*streams):
+            if self._stopped.is_set():
+                break
+            if self._speed is not None:
+                if started is None:
+                    started = (self._timer(), the_time)
+                delay = started[0] + (the_time - started[1]) / self._speed - self._timer()
+                if delay > 0:
+                    self._sleep(delay)
+            self._now = the_time
+            if req_id not in self._subscriptions:
+                continue  # Cancelled meanwhile.
+            if kind == 'price':
+                wrapper.tickPrice(req_id, field, value, 0)
+            else:
+                wrapper.tickSize(req_id, field, value)
+            count += 1
+        return count
+
+    def _attach(self, wrapper):
+        self._wrapper = wrapper
+        return _ReplaySocket(self)
+
+    def _subscribe(self, req_id, contract):
+        with self._lock:
+            self._subscriptions[req_id] = _key(contract)
+
+    def _unsubscribe(self, req_id):
+        with self._lock:
+            self._subscriptions.pop(req_id, None)
+
+    def _ticks(self, req_id, key):
+        """Yields the ticks of a subscription, ``(time, sequence, req_id, kind, field, value)``.
+
+        A bar trades at its open, then at its low and high, or high and low for a falling bar,
+        and at its close just before its end; its volume is one trade size after the close.
+        """
+        bars = self._source(key, self._start, self._end)
+        step = self._bar_seconds / 4
+        for bar in bars[['date', 'open', 'high', 'low', 'close', 'volume']].tolist():
+            start, open_, high, low, close, volume = bar
+            extremes = (low, high) if close >= open_ else (high, low)
+            prices = (open_,) + extremes + (close,)
+            for index, price in enumerate(prices):
+                yield start + index * step, 0, req_id, 'price', TickType.Last, price
+            yield start + 3 * step, 1, req_id, 'size', TickType.LastSize, volume
+
+    def _historical(self, req_id, contract, end_datetime, duration, bar_size):
+        end = core.datatools.parse_ib_date(end_datetime.replace(' ', '  ', 1))
+        amount, unit = duration.split()
+        start = end - int(amount) * _DURATION_SECONDS[unit]
+        epoch = date(1970, 1, 1).toordinal()
+        bars = self._source(_key(contract), date.fromordinal(epoch + start // 86400),
+                            date.fromordinal(epoch + (end - 1) // 86400))
+        bars = bars[(bars['date'] >= start) & (bars['date'] < end)]
+        if core.datatools.bar_seconds(bar_size) != self._bar_seconds:
+            bars = resample(bars, bar_size, HKFE_CALENDAR, self._bar_seconds)
+        dates = core.datatools.format_ib_dates(bars['date'])
+        for date_, bar in zip(dates, bars.tolist()):
+            self._wrapper.historicalData(req_id, date_, *bar[1:])
+        self._wrapper.historicalData(req_id, "finished-%s-%s" % tuple(
+            core.datatools.format_ib_dates([start, end])), -1, -1, -1, -1, -1, -1, -1, 0)
+
+
+class _ReplaySocket(object):
+    """Implements the calls of ``TwsClient`` on its socket."""
+    def __init__(self, replay: BarReplay):
+        self._replay = replay
+        self._connected = False
+
+    def eConnect(self, host, port, client_id):
+        self._connected = True
+        return True
+
+    def eDisconnect(self):
+        self._connected = False
+
+    def isConnected(self):
+        return self._connected
+
+    def reqHistoricalData(self, req_id, contract, end_datetime, duration, bar_size, what_to_show,
+                          use_rth, format_date):
+        self._replay._historical(req_id, contract, end_datetime, duration, bar_size)
+
+    def cancelHistoricalData(self, req_id):
+        pass
+
+    def reqMktData(self, req_id, contract, generic_tick, snapshot):
+        self._replay._subscribe(req_id, contract)
+
+    def cancelMktData(self, req_id):
+        self._replay._unsubscribe(req_id)
+
+
+def _key(contract) -> str:
+    return core.datatools.contract_key(contract.exchange, contract.secType, contract.symbol)
@@ -0,0 +1,115 @@
+"""Aggregates live market data ticks into bars.
+
+``BarAggregator`` is a market data handler that folds ``tickPrice``/``tickSize`` callbacks into
+the bar of the current interval in constant time per tick and hands every completed bar to a sink
+with the fields of ``core.datatools.BAR_DTYPE``, the same as historical data::
+
+    sink(date, open_, high, low, close, volume, bar_count, wap, has_gaps)
+
+Bars are aligned to multiples of the bar size since midnight and dated, like historical data, by
+their start in the wall-clock time of TWS.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+import core.datatools
+from providers.ibtws import BarSize, TickType
+
+
+def wall_clock() -> float:
+    """Gets the local wall-clock time as seconds since 1970-01-01, the time base of bar dates."""
+    now = time.time()
+    return now + time.localtime(now).tm_gmtoff
+
+
+class BarAggregator(object):
+    """Represents a market data handler building bars of a fixed size.
+
+    Trades are the ``TickType.Last`` prices, they set the open, high, low and close and are
+    counted in ``bar_count``. ``TickType.LastSize`` adds to the volume and weights the ``wap``.
+    """
+    def __init__(self, bar_size: BarSize, sink, clock=wall_clock):
+        self._seconds = core.datatools.bar_seconds(bar_size)
+        self._sink = sink
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._start = None
+        self._open = self._high = self._low = self._close = 0.0
+        self._last = None
+        self._volume = 0
+        self._bar_count = 0
+        self._notional = 0.0
+
+    @property
+    def bar_seconds(self):
+        return self._seconds
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        if field != TickType.Last or price <= 0:
+            return
+        completed = None
+        with self._lock:
+            start = self._bar_start(self._clock())
+            if start != self._start:
+                completed = self._roll(start)
+            if self._bar_count == 0:
+                self._open = self._high = self._low = price
+            elif price > self._high:
+                self._high = price
+            elif price < self._low:
+                self._low = price
+            self._close = self._last = price
+            self._bar_count += 1
+        if completed is not None:
+            self._sink(*completed)
+
+    def tickSize(self, request, field, size):
+        if field != TickType.LastSize or self._last is None:
+            return
+        completed = None
+        with self._lock:
+            start = self._bar_start(self._clock())
+            if start != self._start:
+                completed = self._roll(start)
+            self._volume += size
+            self._notional += size * self._last
+        if completed is not None:
+            self._sink(*completed)
+
+    def tickGeneric(self, request, tick_type, value):
+        pass
+
+    def tickString(self, request, tick_type, value):
+        pass
+
+    def flush(self, force: bool = False):
+        """Emits the current bar if its interval has ended, or anyway when ``force``d.
+        Should be called periodically when ticks may stop, e.g. at the close."""
+        completed = None
+        with self._lock:
+            if self._start is not None and \
+                    (force or self._bar_start(self._clock()) != self._start):
+                completed = self._roll(None)
+        if completed is not None:
+            self._sink(*completed)
+
+    def _bar_start(self, now: float) -> int:
+        now = int(now)
+        return now - now % self._seconds
+
+    def _roll(self, start):
+        """Starts the bar of a new interval and returns the completed one, if it traded."""
+        completed = None
+        if self._start is not None and self._bar_count > 0:
+            wap = self._notional / self._volume if self._volume else 0.0
+            completed = (self._start, self._open, self._high, self._low, self._close,
+                         self._volume, self._bar_count, wap, 0)
+        self._start = start
+        self._volume = 0
+        self._bar_count = 0
+        self._notional = 0.0
+        return completed
@@ -1,18 +1,64 @@
 # A method which obtains stock data from Yahoo finance
 # Requires that you have an internet connection to retreive stock data from Yahoo finance
+"""Downloads daily bars from Yahoo finance.
+
+``download_many`` refreshes a universe of symbols concurrently into a cache of one CSV file per
+symbol, requesting only the days after the last cached row::
+
+    frames = download_many(["0005.HK", "0700.HK", "^HSI"], "./data-market/daily/hk")
+
+Requests go through a transport, ``transport(symbol, start, end)`` returning a DataFrame indexed
+by date, ``datareader_transport`` by default and ``http_transport`` for a server of CSV files.
+"""
+import os
 import time
 import datetime
-from datetime import date
-import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import quote
+from urllib.request import urlopen
+
+import pandas as pd
+
+from core.metrics import METRICS
+
+MAX_RETRY = 3
+MIN_BACKOFF = 1  # Seconds before the first retry.
+MAX_BACKOFF = 60  # Maximum seconds between retries.
+WORKERS = 8
+HISTORY_START = date(2010, 1, 1)
+
+_RETRIES = METRICS.counter('loader_retries_total', "Requests issued again after a failure.",
+                           loader='yahoo')
 
-from pandas_datareader import data
 
-def download_with_dates(contract: str, start_date: date, end_date: date):
+def datareader_transport(contract: str, start: date, end: date) -> pd.DataFrame:
+    """Gets the daily bars of a symbol with ``pandas_datareader``."""
+    from pandas_datareader import data
+    return data.get_data_yahoo(contract, datetime.datetime(start.year, start.month, start.day),
+                               datetime.datetime(end.year, end.month, end.day))
+
+
+def http_transport(url: str, timeout: float = 30):
+    """Gets a transport reading CSV bars from ``url``, a format string of ``symbol``, ``start``
+    and ``end`` (yyyy-mm-dd), e.g. ``"http://localhost:8000/%(symbol)s.csv?start=%(start)s"``.
+    """
+    def transport(contract, start, end):
+        location = url % {'symbol': quote(contract), 'start': start.isoformat(),
+                          'end': end.isoformat()}
+        with urlopen(location, timeout=timeout) as response:
+            return pd.read_csv(response, index_col=0, parse_dates=True)
+    return transport
+
+
+def download_with_dates(contract: str, start_date: date, end_date: date, transport=None):
     return download(contract, start_date.year, start_date.month, start_date.day,
-                    end_date.year, end_date.month, end_date.day)
+                    end_date.year, end_date.month, end_date.day, transport=transport)
+
 
 def download(contract: str, start_year: int, s_month: int,
-             s_day: int, e_year: int, e_month: int, e_day: int):
+             s_day: int, e_year: int, e_month: int, e_day: int, transport=None,
+             sleep=time.sleep):
     """
     Args:
         contract (str): the name of the stock/etf
@@ -22,22 +68,83 @@ def download(contract: str, start_year: int, s_month: int,
         e_year (int): end year
         e_month (int): end month
         e_day (int): end day
+        transport: gets the bars, ``datareader_transport`` by default
+    Returns:
+        Pandas Dataframe: Daily OHLCV bars, None if Yahoo finance is not reachable
+    """
+    try:
+        return _fetch(transport or datareader_transport, contract, date(start_year, s_month, s_day),
+                      date(e_year, e_month, e_day), sleep)
+    except Exception:
+        print("Yahoo Finance is not reachable.")
+        return None
+
+
+def download_many(contracts, cache_dir: str, end: date = None, start: date = HISTORY_START,
+                  transport=None, workers: int = WORKERS, sleep=time.sleep) -> dict:
+    """Brings the cached daily bars of symbols up to date, concurrently.
+
+    The bars of each symbol are cached in ``<cache_dir>/<symbol>.csv``. Only the days after the
+    last cached row are requested and appended, from ``start`` for a symbol not cached yet.
+
     Returns:
-        Pandas Dataframe: Daily OHLCV bars
+        dict: symbol to the DataFrame of its cached bars, None when it could not be fetched.
     """
-    start = datetime.datetime(start_year, s_month, s_day)
-    end = datetime.datetime(e_year, e_month, e_day)
-    retry_cnt, max_num_retry = 0, 3
-    while retry_cnt < max_num_retry:
+    end = end or date.today()
+    transport = transport or datareader_transport
+    os.makedirs(cache_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {contract: executor.submit(_refresh, transport, contract,
+                                             cache_path(cache_dir, contract), start, end, sleep)
+                   for contract in contracts}
+    frames = {}
+    for contract, future in futures.items():
+        try:
+            frames[contract] = future.result()
+        except Exception as e:
+            print('Unable to download "%s": %s' % (contract, e))
+            frames[contract] = None
+    return frames
+
+
+def cache_path(cache_dir: str, contract: str) -> str:
+    """Gets the cache file of a symbol."""
+    return os.path.join(cache_dir, "%s.csv" % contract)
+
+
+def _refresh(transport, contract, path, start, end, sleep) -> pd.DataFrame:
+    cached = pd.read_csv(path, index_col=0, parse_dates=True) if os.path.exists(path) else None
+    if cached is not None and len(cached):
+        start = max(start, cached.index[-1].date() + timedelta(days=1))
+    if start > end:
+        return cached
+
+    fetched = _fetch(transport, contract, start, end, sleep)
+    if cached is not None and len(cached):
+        fetched = fetched[fetched.index > cached.index[-1]]
+    if not len(fetched):
+        return cached
+    if cached is None:
+        fetched.to_csv(path)
+        return fetched
+    fetched = fetched[list(cached.columns)]
+    fetched.to_csv(path, mode='a', header=False)
+    return pd.concat([cached, fetched])
+
+
+def _fetch(transport, contract, start, end, sleep) -> pd.DataFrame:
+    """Calls the transport, retrying with exponential back-off."""
+    backoff = MIN_BACKOFF
+    for attempt in range(MAX_RETRY):
         try:
-            bars = data.get_data_yahoo(contract, start, end)
-            return bars
-        except:
-            retry_cnt += 1
-            time.sleep(random.randint(1, 10))
-
-    print("Yahoo Finance is not reachable.")
-    return None
+            return transport(contract, start, end)
+        except Exception:
+            if attempt == MAX_RETRY - 1:
+                raise
+            sleep(backoff)
+            _RETRIES.inc()
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
 
 if __name__ == "__main__":
     TODAY = date.today()
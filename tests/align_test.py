@@ -0,0 +1,54 @@
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.align import Fill, align, load_aligned
+
+KEYS = ['HKFE-IND-HSI', 'HKFE-IND-HHI.HK']
+
+
+def bars(dates, closes, has_gaps=None):
+    result = np.zeros(len(dates), dtype=datatools.BAR_DTYPE)
+    result['date'] = dates
+    result['close'] = closes
+    if has_gaps is not None:
+        result['has_gaps'] = has_gaps
+    return result
+
+
+class AlignTest(unittest.TestCase):
+    def test_as_of_fills_forward(self):
+        aligned = align([('A', bars([0, 30, 90], [1, 2, 4], [0, 1, 0])),
+                         ('B', bars([30, 60], [20, 30]))], columns=('close',))
+        np.testing.assert_array_equal([0, 30, 60, 90], aligned.dates)
+        np.testing.assert_array_equal([[1, np.nan], [2, 20], [2, 30], [4, 30]],
+                                      aligned.values['close'])
+        np.testing.assert_array_equal([[False, True], [True, False], [True, False],
+                                       [False, True]], aligned.mask)
+
+    def test_exact_and_max_age(self):
+        pairs = [('A', bars([0, 30, 90], [1, 2, 4])), ('B', bars([30, 60], [20, 30]))]
+        exact = align(pairs, columns=('close',), fill=Fill.Exact)
+        np.testing.assert_array_equal([[1, np.nan], [2, 20], [np.nan, 30], [4, np.nan]],
+                                      exact.values['close'])
+        recent = align(pairs, columns=('close',), grid=[60, 90, 120], max_age=30)
+        np.testing.assert_array_equal([[2, 30], [4, 30], [4, np.nan]], recent.values['close'])
+
+    def test_loads_contracts_on_one_grid(self):
+        aligned = load_aligned(KEYS, date(2010, 1, 4), date(2010, 1, 8), columns=('close',))
+        self.assertEqual(KEYS, aligned.keys)
+        for index, key in enumerate(KEYS):
+            exchange, sec_type, symbol = key.split('-', 2)
+            closes = datatools.load_bars(exchange, sec_type, symbol, date(2010, 1, 4),
+                                         date(2010, 1, 8))
+            complete = ~aligned.mask[:, index]
+            np.testing.assert_array_equal(closes['date'][~closes['has_gaps']],
+                                          aligned.dates[complete])
+            np.testing.assert_array_equal(closes['close'][~closes['has_gaps']],
+                                          aligned.values['close'][complete, index])
+
+
+if __name__ == '__main__':
+    unittest.main()
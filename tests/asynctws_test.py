@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import unittest
+
+from swigibpy import Contract
+
+from providers.asynctws import AsyncTwsClient, RequestError, TickStream
+from providers.ibtws import TwsClient, BarSize
+
+
+class FakeSocket(object):
+    """Stands in for EPosixClientSocket, answering every request from a reader thread."""
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.cancelled = []
+
+    def reqHistoricalData(self, req_id, contract, end_datetime, duration, bar_size, what_to_show,
+                          use_rth, format_date):
+        threading.Thread(target=self._historical, args=(req_id, contract.symbol)).start()
+
+    def reqMktData(self, req_id, contract, generic_tick, snapshot):
+        threading.Thread(target=self._ticks, args=(req_id,)).start()
+
+    def cancelHistoricalData(self, req_id):
+        self.cancelled.append(req_id)
+
+    def cancelMktData(self, req_id):
+        self.cancelled.append(req_id)
+
+    def _historical(self, req_id, symbol):
+        if symbol == "UNKNOWN":
+            self.wrapper.error(req_id, 200, "No security definition has been found")
+            return
+        for minute in range(3):
+            self.wrapper.historicalData(req_id, "20100104  10:0%d:00" % minute, 1.0, 2.0, 0.5, 1.5,
+                                        0, 10, 0.0, 0)
+        self.wrapper.historicalData(req_id, "finished", -1, -1, -1, -1, -1, -1, -1, 0)
+
+    def _ticks(self, req_id):
+        for index in range(100):
+            self.wrapper.tickPrice(req_id, 4, 21000.0 + index, 0)
+            self.wrapper.tickSize(req_id, 5, index)
+
+
+def contract(symbol):
+    the_contract = Contract()
+    the_contract.exchange = "HKFE"
+    the_contract.secType = "IND"
+    the_contract.symbol = symbol
+    the_contract.currency = "HKD"
+    return the_contract
+
+
+class AsyncTwsClientTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncTwsClient(TwsClient(1, socket_factory=FakeSocket))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_concurrent_historical_data(self):
+        async def fetch():
+            return await asyncio.gather(*[
+                self.client.historical_data(contract(symbol), "20100105 00:00:00",
+                                            bar_size=BarSize.Sec30) for symbol in ("HSI", "HHI.HK")])
+
+        results = self.loop.run_until_complete(fetch())
+        self.assertEqual([3, 3], [len(bars) for bars in results])
+        self.assertEqual([1.5, 1.5, 1.5], results[0]['close'].tolist())
+
+    def test_historical_data_error(self):
+        with self.assertRaises(RequestError):
+            self.loop.run_until_complete(
+                self.client.historical_data(contract("UNKNOWN"), "20100105 00:00:00"))
+
+    def test_market_data_stream(self):
+        async def collect():
+            stream = await self.client.market_data(contract("HSI"))
+            ticks = []
+            async for tick in stream:
+                ticks.append(tick)
+                if len(ticks) == 200:
+                    stream.close()
+            return ticks
+
+        ticks = self.loop.run_until_complete(collect())
+        self.assertEqual(200, len(ticks))
+        self.assertEqual(('price', 4, 21099.0), tuple(ticks[-2]))
+        self.assertEqual(('size', 5, 99), tuple(ticks[-1]))
+
+    def test_full_stream_drops_oldest(self):
+        stream = TickStream(max_ticks=3)
+        for index in range(5):
+            stream.tickSize(None, 5, index)
+        stream.close()
+
+        async def collect():
+            return [tick.value async for tick in stream]
+
+        self.assertEqual([2, 3, 4], self.loop.run_until_complete(collect()))
+        self.assertEqual(2, stream.dropped)
+
+
+if __name__ == '__main__':
+    unittest.main()
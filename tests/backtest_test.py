@@ -0,0 +1,80 @@
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.backtest import SimulatedBroker, run_events, run_vectorized, sweep
+
+
+def momentum(bars, lookback):
+    change = bars['close'][lookback:] - bars['close'][:-lookback]
+    return np.concatenate((np.zeros(lookback), np.sign(change)))
+
+
+class Momentum(object):
+    """Event-driven ``momentum``."""
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.closes = []
+
+    def on_bar(self, broker, bar):
+        self.closes.append(bar.close)
+        if len(self.closes) > self.lookback:
+            broker.order_target(np.sign(self.closes[-1] - self.closes[-1 - self.lookback]))
+
+
+class BacktestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 8))
+
+    def test_accounts_fills_at_next_open(self):
+        bars = np.zeros(3, dtype=datatools.BAR_DTYPE)
+        bars['date'] = [0, 30, 60]
+        bars['open'] = [100.0, 102.0, 105.0]
+        bars['close'] = [101.0, 104.0, 103.0]
+        result = run_vectorized(bars, lambda bars: [1, 1, 0], multiplier=1, commission=0.5)
+
+        np.testing.assert_array_equal([0, 1, 1], result.positions)
+        np.testing.assert_array_equal([(30, 1.0, 102.0)], result.fills.tolist())
+        np.testing.assert_allclose([0.0, 1.5, 0.5], result.equity)
+        self.assertEqual(1.0, result.max_drawdown)
+
+    def test_events_match_vectorized(self):
+        vectorized = run_vectorized(self.bars, momentum, lookback=20)
+        strategy = Momentum(20)
+        events = run_events(self.bars, strategy)
+
+        np.testing.assert_array_equal(vectorized.positions, events.positions)
+        np.testing.assert_array_equal(vectorized.fills, events.fills)
+        np.testing.assert_allclose(vectorized.equity, events.equity)
+        self.assertTrue(len(events.fills) > 0)
+
+    def test_broker_fills_pending_orders(self):
+        broker = SimulatedBroker()
+        broker.order(2)
+        broker.order(-1)
+        self.assertEqual(0, broker.position)
+        broker._fill(30, 100.0)
+        broker.order_target(-1)
+        broker._fill(60, 101.0)
+        self.assertEqual(-1, broker.position)
+        self.assertEqual([(30, 1, 100.0), (60, -2, 101.0)], broker.get_orders())
+
+    def test_sweep_keeps_grid_order(self):
+        grid = {'lookback': [5, 10, 20, 40, 80]}
+        serial = sweep(momentum, grid, self.bars, workers=1)
+        parallel = sweep(momentum, grid, self.bars, workers=2)
+        events = sweep(Momentum, grid, self.bars, workers=2)
+
+        self.assertEqual([{'lookback': lookback} for lookback in grid['lookback']],
+                         [result.params for result in serial])
+        self.assertEqual(serial, parallel)
+        for expected, actual in zip(serial, events):
+            self.assertEqual(expected.trades, actual.trades)
+            self.assertAlmostEqual(expected.pnl, actual.pnl)
+
+
+if __name__ == '__main__':
+    unittest.main()
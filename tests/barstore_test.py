@@ -0,0 +1,79 @@
+import calendar
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from core import datatools
+from core.barstore import BarStore
+from tools.bar_store_converter import convert
+
+SAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', 'market-data', 'ib', 'hk')
+
+
+def epoch(*args):
+    return calendar.timegm(datetime(*args).timetuple())
+
+
+def make_bars(dates):
+    bars = np.zeros(len(dates), dtype=datatools.BAR_DTYPE)
+    bars['date'] = dates
+    bars['close'] = np.arange(len(dates), dtype=np.float64)
+    return bars
+
+
+class ParseIbDatesTest(unittest.TestCase):
+    def test_intraday_and_daily(self):
+        parsed = datatools.parse_ib_dates(['20100104  10:00:30', '20000229  23:59:59', '19991231'])
+        self.assertEqual([epoch(2010, 1, 4, 10, 0, 30), epoch(2000, 2, 29, 23, 59, 59),
+                          epoch(1999, 12, 31)], parsed.tolist())
+
+    def test_scalar_matches_vectorised(self):
+        text = '20100909  15:59:30'
+        self.assertEqual(datatools.parse_ib_dates([text])[0], datatools.parse_ib_date(text))
+
+
+class BarStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = BarStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_write_splits_months_and_reads_range(self):
+        dates = [epoch(2010, 1, 29, 10), epoch(2010, 1, 30, 10), epoch(2010, 2, 1, 10)]
+        self.store.write('HKFE-IND-HSI', make_bars(dates))
+        self.assertEqual(['2010-01', '2010-02'], self.store.months('HKFE-IND-HSI'))
+
+        bars = self.store.read('HKFE-IND-HSI', start=dates[1], end=dates[2] + 1, columns=['close'])
+        self.assertEqual(['close'], list(bars))
+        self.assertEqual([1.0, 2.0], bars['close'].tolist())
+
+    def test_single_month_read_is_memory_mapped(self):
+        self.store.write('HKFE-IND-HSI', make_bars([epoch(2010, 1, 4, 10), epoch(2010, 1, 5, 10)]))
+        bars = self.store.read('HKFE-IND-HSI')
+        self.assertIsInstance(bars['close'].base, np.memmap)
+
+    def test_write_replaces_duplicated_dates(self):
+        first = make_bars([epoch(2010, 1, 4, 10), epoch(2010, 1, 5, 10)])
+        second = make_bars([epoch(2010, 1, 5, 10), epoch(2010, 1, 6, 10)])
+        second['close'] = [10.0, 11.0]
+        self.store.write('HKFE-IND-HSI', first)
+        self.store.write('HKFE-IND-HSI', second)
+        self.assertEqual([0.0, 10.0, 11.0], self.store.read('HKFE-IND-HSI')['close'].tolist())
+
+    def test_convert_sample_tree(self):
+        store = convert(SAMPLE_DIR, self.root)
+        self.assertEqual(['HKFE-IND-HHI.HK', 'HKFE-IND-HSI'], store.keys())
+        bars = store.read('HKFE-IND-HSI', start=epoch(2010, 1, 4), end=epoch(2010, 1, 5))
+        expected = datatools.read_bar_csv(os.path.join(SAMPLE_DIR, '2010-01-04', 'HKFE-IND-HSI.csv'))
+        self.assertTrue(np.array_equal(expected['close'], bars['close']))
+        self.assertTrue(np.all(np.diff(store.read('HKFE-IND-HSI', columns=['date'])['date']) > 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
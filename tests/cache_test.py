@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.cache import BarCache
+
+SAMPLE = os.path.join(datatools.MARKET_DATA_DIR, '2010-01-04', 'HKFE-IND-HSI.csv')
+
+
+class BarCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_hits_share_bars(self):
+        cache = BarCache()
+        bars = cache.get(SAMPLE)
+        self.assertIs(bars, cache.get(SAMPLE))
+        self.assertFalse(bars.flags.writeable)
+        self.assertEqual((1, 1, 0, 0, 1, bars.nbytes), tuple(cache.stats()))
+
+    def test_columns_are_keyed(self):
+        cache = BarCache()
+        self.assertEqual(('date', 'close'), cache.get(SAMPLE, ['close']).dtype.names)
+        self.assertEqual(datatools.BAR_COLUMNS, cache.get(SAMPLE).dtype.names)
+        self.assertEqual(2, cache.stats().misses)
+
+    def test_lru_eviction(self):
+        one_day = datatools.read_bar_csv(SAMPLE).nbytes
+        cache = BarCache(max_bytes=2 * one_day)
+        paths = [os.path.join(datatools.MARKET_DATA_DIR, day, 'HKFE-IND-HSI.csv')
+                 for day in ('2010-01-04', '2010-01-05', '2010-01-06')]
+        cache.get(paths[0])
+        cache.get(paths[1])
+        cache.get(paths[0])
+        cache.get(paths[2])
+        stats = cache.stats()
+        self.assertEqual((1, 2, 2 * one_day), (stats.evictions, stats.entries, stats.nbytes))
+        cache.get(paths[0])
+        self.assertEqual(2, cache.stats().hits)
+
+    def test_invalidated_when_file_changes(self):
+        path = os.path.join(self.root, 'bars.csv')
+        bars = datatools.read_bar_csv(SAMPLE)
+        datatools.write_bar_csv(path, bars)
+        cache = BarCache()
+        self.assertEqual(480, len(cache.get(path)))
+        datatools.write_bar_csv(path, bars[:10])
+        self.assertEqual(10, len(cache.get(path)))
+        self.assertEqual(1, cache.stats().invalidations)
+
+    def test_load_bars_through_cache(self):
+        cache = BarCache()
+        start, end = date(2010, 1, 1), date(2010, 1, 8)
+        expected = datatools.load_bars('HKFE', 'IND', 'HSI', start, end)
+        cached = datatools.load_bars('HKFE', 'IND', 'HSI', start, end, cache=cache)
+        self.assertTrue(np.array_equal(expected, cached))
+        day = date(2010, 1, 4)
+        bars = datatools.load_bars('HKFE', 'IND', 'HSI', day, day, cache=cache)
+        self.assertIs(cache.get(SAMPLE), bars.base)
+        closes = datatools.load_bars('HKFE', 'IND', 'HSI', start, end, ['close'], cache=cache)
+        self.assertEqual(('close',), closes.dtype.names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import threading
+import time
+import unittest
+
+from providers.conflation import ConflatingHandler
+from providers.ibtws import TickType
+
+
+class FakeRequest(object):
+    def __init__(self, request_id):
+        self.request_id = request_id
+
+
+class ConflatingHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.delivered = threading.Event()
+
+    def consume(self, batches):
+        self.batches.append(batches)
+        self.delivered.set()
+
+    def test_flush_conflates_per_request(self):
+        handler = ConflatingHandler(self.consume, history=2)
+        hsi, hhi = FakeRequest(1), FakeRequest(2)
+        for price in (21000.0, 21001.0, 21002.0):
+            handler.tickPrice(hsi, TickType.Last, price, 0)
+        handler.tickSize(hhi, TickType.LastSize, 3)
+        handler.flush()
+
+        batches = {batch.request.request_id: batch for batch in self.batches[0]}
+        self.assertEqual({TickType.Last: 21002.0}, batches[1].snapshot)
+        self.assertEqual([21001.0, 21002.0], [tick.value for tick in batches[1].ticks])
+        self.assertEqual(1, batches[1].dropped)
+        self.assertEqual(3, batches[2].snapshot[TickType.LastSize])
+
+        handler.flush()
+        self.assertEqual(1, len(self.batches))
+
+    def test_snapshot_only(self):
+        handler = ConflatingHandler(self.consume, history=0)
+        handler.tickPrice(FakeRequest(1), TickType.Bid, 10.0, 0)
+        handler.tickPrice(FakeRequest(1), TickType.Ask, 11.0, 0)
+        handler.flush()
+        batch = self.batches[0][0]
+        self.assertEqual({TickType.Bid: 10.0, TickType.Ask: 11.0}, batch.snapshot)
+        self.assertEqual([], batch.ticks)
+
+    def test_batch_size_triggers_delivery(self):
+        with ConflatingHandler(self.consume, interval=60, batch_size=10) as handler:
+            for price in range(10):
+                handler.tickPrice(FakeRequest(1), TickType.Last, price, 0)
+            self.assertTrue(self.delivered.wait(5))
+        self.assertEqual(10, len(self.batches[0][0].ticks))
+
+    def test_reader_thread_does_not_wait_for_consumer(self):
+        release = threading.Event()
+        handler = ConflatingHandler(lambda batches: release.wait(5), interval=0.01).start()
+        try:
+            handler.tickPrice(FakeRequest(1), TickType.Last, 1.0, 0)
+            time.sleep(0.05)
+            started = time.time()
+            for price in range(1000):
+                handler.tickPrice(FakeRequest(1), TickType.Last, price, 0)
+            self.assertLess(time.time() - started, 1)
+        finally:
+            release.set()
+            handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.dataset import Boundary, Normalize, WindowDataset
+
+
+class WindowDatasetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 8))
+
+    def test_windows_stay_within_sessions(self):
+        dataset = WindowDataset(self.bars, window=20, horizon=5, normalize=Normalize.Nothing)
+        # 300 morning and 180 afternoon bars a day, each session has 300 - 24 and 180 - 24 windows.
+        self.assertEqual(5 * (276 + 156), len(dataset.starts))
+        self.assertTrue(np.shares_memory(dataset.windows, dataset._features))
+
+        dates = self.bars['date']
+        spans = dates[dataset.starts + 24] - dates[dataset.starts]
+        np.testing.assert_array_equal(24 * 30, spans)
+
+        by_day = WindowDataset(self.bars, window=20, horizon=5, boundary=Boundary.Day)
+        self.assertEqual(5 * (480 - 24), len(by_day.starts))
+
+    def test_batches_cover_windows_once(self):
+        dataset = WindowDataset(self.bars, window=20, horizon=5, batch_size=100, seed=1,
+                                normalize=Normalize.Nothing)
+        batches = list(dataset)
+        self.assertEqual(len(dataset), len(batches))
+        labels = np.concatenate([y for _, y in batches])
+        self.assertEqual(sorted(dataset.labels.tolist()), sorted(labels.tolist()))
+
+        x, y = batches[0]
+        self.assertEqual((100, 20, 4), x.shape)
+        start = dataset.starts[list(dataset.labels).index(y[0])]
+        closes = self.bars['close']
+        np.testing.assert_allclose(np.log(closes[start + 24] / closes[start + 19]), y[0],
+                                   rtol=1e-6)
+
+    def test_normalizes_by_last_close(self):
+        dataset = WindowDataset(self.bars, window=10, shuffle=False, prefetch=0)
+        x, _ = next(iter(dataset))
+        np.testing.assert_allclose(0, x[:, -1, 3], atol=1e-7)
+        np.testing.assert_allclose(self.bars['open'][0] / self.bars['close'][9] - 1, x[0, 0, 0],
+                                   rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
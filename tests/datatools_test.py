@@ -0,0 +1,59 @@
+import io
+import os
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+
+
+class LoadBarsTest(unittest.TestCase):
+    def test_loads_range_in_date_order(self):
+        bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 6))
+        self.assertEqual(datatools.BAR_DTYPE, bars.dtype)
+        self.assertEqual(3 * 480, len(bars))
+        self.assertTrue(np.all(np.diff(bars['date']) > 0))
+        self.assertEqual(datatools.parse_ib_date('20100104  10:00:00'), bars['date'][0])
+
+    def test_drops_bars_repeated_by_holidays(self):
+        # 2010-01-01 holds the bars of 2009-12-31 and 2010-02-15/16 repeat 2010-02-12.
+        self.assertEqual(480, len(datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 1),
+                                                      date(2010, 1, 4))))
+        self.assertEqual(480, len(datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 2, 12),
+                                                      date(2010, 2, 16))))
+
+    def test_column_projection(self):
+        bars = datatools.load_bars('HKFE', 'IND', 'HHI.HK', date(2010, 1, 4), date(2010, 1, 4),
+                                   columns=['close'])
+        self.assertEqual(('close',), bars.dtype.names)
+        expected = datatools.read_bar_csv(
+            os.path.join(datatools.MARKET_DATA_DIR, '2010-01-04', 'HKFE-IND-HHI.HK.csv'))
+        self.assertTrue(np.array_equal(expected['close'], bars['close']))
+
+    def test_unknown_column(self):
+        with self.assertRaises(KeyError):
+            datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 4),
+                                columns=['price'])
+
+
+class BarBufferTest(unittest.TestCase):
+    def test_append_grows_and_parses_dates(self):
+        buffer = datatools.BarBuffer(capacity=1)
+        buffer.append('20100104  10:00:00', 1.0, 2.0, 0.5, 1.5, 10, 3, 1.2, 0)
+        buffer.append('20100104  10:00:30', 1.5, 2.5, 1.0, 2.0, 20, 4, 1.7, 1)
+        self.assertEqual(2, len(buffer))
+        self.assertEqual([datatools.parse_ib_date('20100104  10:00:00'),
+                          datatools.parse_ib_date('20100104  10:00:30')], buffer.bars['date'].tolist())
+        self.assertEqual([False, True], buffer.bars['has_gaps'].tolist())
+
+    def test_write_bar_csv_round_trip(self):
+        path = os.path.join(datatools.MARKET_DATA_DIR, '2010-01-04', 'HKFE-IND-HSI.csv')
+        output = io.StringIO(newline='')
+        datatools.write_bar_csv(output, datatools.read_bar_csv(path))
+        with open(path, newline='') as csv_file:
+            self.assertEqual(csv_file.read(), output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import date
+
+import numpy as np
+from swigibpy import Contract
+
+from core import datatools
+from providers.ibtws import TwsClient
+from providers.pacing import Pacer
+from tools.gap_repair import GapSpan, expected_dates, find_gaps, plan_repairs, repair
+
+
+class SampleSocket(object):
+    """Stands in for EPosixClientSocket, answering historical data requests from the sample."""
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.requested = []
+
+    def reqHistoricalData(self, req_id, contract, end_datetime, duration, bar_size, what_to_show,
+                          use_rth, format_date):
+        self.requested.append((end_datetime, duration))
+        end = datatools.parse_ib_date(end_datetime.replace(' ', '  '))
+        start = end - int(duration.split()[0])
+        threading.Timer(0.01, self._respond, (req_id, start, end)).start()
+
+    def cancelHistoricalData(self, req_id):
+        pass
+
+    def _respond(self, req_id, start, end):
+        bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 4))
+        bars = bars[(bars['date'] >= start) & (bars['date'] < end)]
+        for date_, bar in zip(datatools.format_ib_dates(bars['date']), bars.tolist()):
+            self.wrapper.historicalData(req_id, date_, *bar[1:])
+        self.wrapper.historicalData(req_id, "finished", -1, -1, -1, -1, -1, -1, -1, 0)
+
+
+def hsi():
+    contract = Contract()
+    contract.exchange = "HKFE"
+    contract.secType = "IND"
+    contract.symbol = "HSI"
+    contract.currency = "HKD"
+    return contract
+
+
+class GapRepairTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv')
+        os.makedirs(os.path.dirname(self.path))
+        self.bars = datatools.read_bar_csv(os.path.join(datatools.MARKET_DATA_DIR, '2010-01-04',
+                                                        'HKFE-IND-HSI.csv'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_find_gaps(self):
+        expected = expected_dates(date(2010, 1, 4))
+        self.assertTrue(np.array_equal(self.bars['date'], expected))
+        self.assertEqual([], find_gaps(self.bars, expected))
+        damaged = np.delete(self.bars, list(range(10, 21)) + list(range(295, 305)))
+        damaged['has_gaps'][-1] = True
+        day = datatools.parse_ib_date('20100104')
+        self.assertEqual([GapSpan(day + 36300, day + 36630), GapSpan(day + 44850, day + 52350),
+                          GapSpan(day + 57570, day + 57600)], find_gaps(damaged, expected))
+        span = GapSpan(day + 44850, day + 52350)
+        self.assertEqual(("20100104 14:32:30", "7500 S"), (span.end_datetime, span.duration))
+        self.assertEqual([GapSpan(day + 36000, day + 57600)], find_gaps(self.bars[:0], expected))
+
+    def test_repair(self):
+        damaged = np.delete(self.bars, list(range(10, 21)) + list(range(295, 305)))
+        damaged['has_gaps'][-1] = True
+        damaged['close'][-1] = 0
+        datatools.write_bar_csv(self.path, damaged)
+        repairs = plan_repairs(self.root, [hsi()], date(2010, 1, 1), date(2010, 1, 5))
+        self.assertEqual([(date(2010, 1, 4), 3), (date(2010, 1, 5), 1)],
+                         [(day.the_date, len(day.spans)) for day in repairs])
+
+        sockets = []
+
+        def socket_factory(wrapper):
+            sockets.append(SampleSocket(wrapper))
+            return sockets[-1]
+        tws = TwsClient(1, socket_factory=socket_factory)
+        failed = repair(tws, repairs[:1], pacer=Pacer(burst=10))
+        self.assertEqual([], failed)
+        self.assertEqual([("20100104 10:10:30", "330 S"), ("20100104 14:32:30", "7500 S"),
+                          ("20100104 16:00:00", "30 S")], sockets[0].requested)
+        self.assertTrue(np.array_equal(self.bars, datatools.read_bar_csv(self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
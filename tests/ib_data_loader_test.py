@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import date, datetime, timedelta
+
+from swigibpy import Contract
+
+from core.manifest import FetchManifest, FileStatus
+from providers.ibtws import TwsClient
+from providers.pacing import Pacer
+from tools.ib_data_loader import BackfillScheduler, StreamingHistoricalData
+
+
+class FakeSocket(object):
+    """Stands in for EPosixClientSocket, answering historical data requests from a timer."""
+    def __init__(self, wrapper, failures=0):
+        self.wrapper = wrapper
+        self.failures = failures
+        self.requested = []
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self._lock = threading.Lock()
+
+    def reqHistoricalData(self, req_id, contract, end_datetime, duration, bar_size, what_to_show,
+                          use_rth, format_date):
+        with self._lock:
+            self.requested.append((contract.symbol, end_datetime))
+            self.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding, self.outstanding)
+            fail = self.failures > 0
+            self.failures -= 1
+        the_date = (datetime.strptime(end_datetime, "%Y%m%d %H:%M:%S") - timedelta(days=1))
+        threading.Timer(0.01, self._respond, (req_id, the_date.strftime("%Y%m%d"), fail)).start()
+
+    def cancelHistoricalData(self, req_id):
+        pass
+
+    def _respond(self, req_id, the_date, fail):
+        with self._lock:
+            self.outstanding -= 1
+        if fail:
+            self.wrapper.error(req_id, 162, "Historical Market Data Service error message")
+        else:
+            for the_time in ("10:00:00", "15:59:30"):
+                self.wrapper.historicalData(req_id, "%s  %s" % (the_date, the_time), 21848.0,
+                                            21852.0, 21825.0, 21837.0, 0, 41, 0.0, 0)
+            self.wrapper.historicalData(req_id, "finished-20100104  00:00:00-20100105  00:00:00",
+                                        -1, -1, -1, -1, -1, -1, -1, 0)
+
+
+def contract(symbol):
+    the_contract = Contract()
+    the_contract.exchange = "HKFE"
+    the_contract.secType = "IND"
+    the_contract.symbol = symbol
+    the_contract.currency = "HKD"
+    return the_contract
+
+
+class BackfillSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dates = [date(2010, 1, day) for day in range(4, 9)]
+        self.jobs = [(the_date, contract(symbol)) for the_date in self.dates
+                     for symbol in ("HSI", "HHI.HK")]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def client(self, failures=0):
+        sockets = []
+
+        def socket_factory(wrapper):
+            sockets.append(FakeSocket(wrapper, failures))
+            return sockets[-1]
+        tws = TwsClient(1, socket_factory=socket_factory)
+        return tws, sockets[0]
+
+    def test_keeps_requests_outstanding(self):
+        tws, socket = self.client()
+        scheduler = BackfillScheduler(tws, self.root, max_outstanding=4,
+                                      pacer=Pacer(max_requests=100, burst=50))
+        written = scheduler.run(self.jobs)
+        self.assertEqual(10, len(written))
+        self.assertEqual(4, socket.max_outstanding)
+        with open(os.path.join(self.root, '2010-01-08', 'HKFE-IND-HHI.HK.csv')) as csv_file:
+            self.assertEqual(['date,open,high,low,close,volume,bar_count,wap,has_gaps',
+                              '20100108  10:00:00,21848.0,21852.0,21825.0,21837.0,0,41,0.0,0',
+                              '20100108  15:59:30,21848.0,21852.0,21825.0,21837.0,0,41,0.0,0'],
+                             csv_file.read().splitlines())
+
+    def test_retries_cancelled_requests(self):
+        tws, socket = self.client(failures=3)
+        scheduler = BackfillScheduler(tws, self.root, max_outstanding=2,
+                                      pacer=Pacer(max_requests=100, burst=50, identical_interval=0))
+        self.assertEqual(10, len(scheduler.run(self.jobs)))
+        self.assertEqual(13, len(socket.requested))
+        self.assertEqual([], scheduler.failed)
+
+    def test_skips_existing_files(self):
+        os.makedirs(os.path.join(self.root, '2010-01-04'))
+        open(os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv'), 'w').close()
+        tws, socket = self.client()
+        BackfillScheduler(tws, self.root, pacer=Pacer(max_requests=100, burst=50)).run(self.jobs)
+        self.assertNotIn(("HSI", "20100105 00:00:00"), socket.requested)
+
+    def test_plans_from_manifest(self):
+        with FetchManifest(self.root) as manifest:
+            manifest.record_failure('HKFE-IND-HSI', date(2010, 1, 4))
+            tws, socket = self.client()
+            scheduler = BackfillScheduler(tws, self.root, pacer=Pacer(max_requests=100, burst=50),
+                                          manifest=manifest)
+            scheduler.run(self.jobs)
+            self.assertEqual(10, len(socket.requested))
+            self.assertEqual(FileStatus.Complete, manifest.status('HKFE-IND-HSI', date(2010, 1, 4)))
+
+            tws, socket = self.client()
+            BackfillScheduler(tws, self.root, pacer=Pacer(max_requests=100, burst=50),
+                              manifest=manifest).run(self.jobs)
+            self.assertEqual([], socket.requested)
+
+
+class StreamingHistoricalDataTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.full_path = os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def stream(self, handler, count):
+        for index in range(count):
+            handler.historicalData(None, "20100104  10:%02d:00" % index, 1.0, 2.0, 0.5, 1.5, 0,
+                                   index, 0.0, 0)
+
+    def test_writes_batches_then_renames(self):
+        handler = StreamingHistoricalData(self.full_path, batch_size=2)
+        self.stream(handler, 5)
+        self.assertEqual(4, handler.rows)
+        self.assertFalse(os.path.exists(self.full_path))
+        handler.historicalDataEnd(None)
+        with open(self.full_path) as csv_file:
+            lines = csv_file.read().splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertEqual('20100104  10:04:00,1.0,2.0,0.5,1.5,0,4,0.0,0', lines[-1])
+        self.assertFalse(os.path.exists(handler.temp_path))
+
+    def test_discard_removes_partial_file(self):
+        handler = StreamingHistoricalData(self.full_path, batch_size=2)
+        self.stream(handler, 3)
+        handler.discard()
+        self.assertEqual([], os.listdir(os.path.dirname(self.full_path)))
+
+    def test_resume_appends_after_last_bar(self):
+        handler = StreamingHistoricalData(self.full_path, batch_size=2)
+        self.stream(handler, 3)
+        with open(handler.temp_path, 'a') as csv_file:
+            csv_file.write('20100104  10:02:00,1.0,2')  # Killed while writing a row.
+
+        handler = StreamingHistoricalData(self.full_path, batch_size=2)
+        self.assertEqual(2, handler.resume())
+        self.stream(handler, 4)
+        handler.historicalDataEnd(None)
+        with open(self.full_path) as csv_file:
+            lines = csv_file.read().splitlines()
+        self.assertEqual(5, len(lines))
+        self.assertEqual(['00', '01', '02', '03'], [line[13:15] for line in lines[1:]])
+
+        handler = StreamingHistoricalData(self.full_path, batch_size=2)
+        self.assertEqual(4, handler.resume())
+        self.stream(handler, 5)
+        handler.historicalDataEnd(None)
+        with open(self.full_path) as csv_file:
+            self.assertEqual(6, len(csv_file.read().splitlines()))
+
+
+class PacerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.pacer = Pacer(max_requests=60, period=600, burst=6, identical_interval=15,
+                           clock=lambda: self.now)
+
+    def test_burst_then_refill_rate(self):
+        for index in range(6):
+            self.assertTrue(self.pacer.try_acquire(index))
+        self.assertFalse(self.pacer.try_acquire(6))
+        self.assertAlmostEqual(600 / 54, self.pacer.delay(6))
+        self.now += 600 / 54 + 1e-9
+        self.assertTrue(self.pacer.try_acquire(6))
+
+    def test_never_exceeds_limit_in_period(self):
+        issued = []
+        while self.now < 600:
+            if self.pacer.try_acquire(len(issued)):
+                issued.append(self.now)
+            self.now += 0.5
+        self.assertLessEqual(len(issued), 60)
+
+    def test_identical_requests(self):
+        self.assertTrue(self.pacer.try_acquire('HSI'))
+        self.assertEqual(15, self.pacer.delay('HSI'))
+        self.now += 15
+        self.assertTrue(self.pacer.try_acquire('HSI'))
+
+
+if __name__ == '__main__':
+    unittest.main()
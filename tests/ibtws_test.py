@@ -0,0 +1,54 @@
+import unittest
+
+from providers.ibtws import TwsClient, RequestType
+
+
+class NullSocket(object):
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class Handler(object):
+    def __init__(self):
+        self.ticks = []
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        self.ticks.append((field, price))
+
+    def historicalData(self, request, date, open_, high, low, close, volume, bar_count, wap, has_gaps):
+        self.ticks.append((date, close))
+
+
+class MulticastWrapperTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TwsClient(1, socket_factory=NullSocket)
+        self.wrapper = self.client._wrapper
+
+    def test_unknown_request_ids_are_dropped(self):
+        self.wrapper.tickPrice(12345, 4, 21000.0, 0)
+        self.wrapper.tickSize(12345, 5, 1)
+        self.wrapper.historicalData(12345, "finished", -1, -1, -1, -1, -1, -1, -1, 0)
+
+    def test_cancelled_request_receives_no_callbacks(self):
+        handler = Handler()
+        request = self.client.reqMarketData(handler, None, "")
+        self.wrapper.tickPrice(request.request_id, 4, 21000.0, 0)
+        self.assertTrue(request.cancel())
+        self.assertFalse(request.cancel())
+        self.wrapper.tickPrice(request.request_id, 4, 21001.0, 0)
+        self.assertEqual([(4, 21000.0)], handler.ticks)
+        self.assertEqual(RequestType.MarketData, request.request_type)
+
+    def test_finished_request_cannot_be_cancelled(self):
+        request = self.client.reqHistoricalData(Handler(), None, "20100105 00:00:00")
+        self.wrapper.historicalData(request.request_id, "finished", -1, -1, -1, -1, -1, -1, -1, 0)
+        self.assertTrue(request.done.is_set())
+        self.assertFalse(request.cancel("too late"))
+        self.assertIsNone(request.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
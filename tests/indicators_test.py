@@ -0,0 +1,47 @@
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.indicators import Atr, Ema, Sma, Volatility, Vwap
+
+
+class IndicatorsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 8))
+
+    def incremental(self, indicator):
+        return np.array([indicator.update(*bar) for bar in self.bars.tolist()])
+
+    def test_modes_are_identical(self):
+        for make in (lambda: Sma(20), lambda: Sma(5, 'high'), lambda: Ema(20), lambda: Atr(14),
+                     lambda: Volatility(60), lambda: Vwap('bar_count')):
+            batch = make().batch(self.bars)
+            incremental = self.incremental(make())
+            np.testing.assert_array_equal(batch, incremental)
+            self.assertEqual(len(self.bars), len(batch))
+
+    def test_sma(self):
+        closes = self.bars['close']
+        sma = Sma(20).batch(self.bars)
+        self.assertTrue(np.isnan(sma[:19]).all())
+        np.testing.assert_allclose(np.convolve(closes, np.ones(20) / 20, 'valid'), sma[19:])
+
+    def test_vwap_restarts_each_day(self):
+        vwap = Vwap('bar_count').batch(self.bars)
+        typical = (self.bars['high'] + self.bars['low'] + self.bars['close']) / 3
+        first = self.bars['date'] // 86400 != np.roll(self.bars['date'] // 86400, 1)
+        np.testing.assert_array_equal(typical[first], vwap[first])
+        self.assertTrue(np.isnan(Vwap().batch(self.bars)).all())  # Index bars have no volume.
+
+    def test_volatility(self):
+        volatility = Volatility(60).batch(self.bars)
+        returns = np.diff(np.log(self.bars['close'][:61]))
+        self.assertTrue(np.isnan(volatility[:60]).all())
+        self.assertAlmostEqual(np.std(returns, ddof=1), volatility[60])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from core import datatools
+from core.manifest import FetchManifest, FileStatus
+from core.tradingcalendar import HKFE_CALENDAR
+
+DATES = ['2010-01-01', '2010-01-04', '2010-01-05']
+
+
+class FetchManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for date_dir in DATES:
+            shutil.copytree(os.path.join(datatools.MARKET_DATA_DIR, date_dir),
+                            os.path.join(self.root, date_dir))
+        self.manifest = FetchManifest(self.root)
+        self.manifest.scan()
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.root)
+
+    def test_scan_classifies_files(self):
+        self.assertEqual(FileStatus.Holiday, self.manifest.status('HKFE-IND-HSI', date(2010, 1, 1)))
+        entries = self.manifest.entries('HKFE-IND-HSI', date(2010, 1, 1), date(2010, 1, 5))
+        self.assertEqual([FileStatus.Holiday, FileStatus.Complete, FileStatus.Complete],
+                         [entry[1] for entry in entries])
+        self.assertEqual(480, entries[1][2])
+        self.assertEqual(datatools.parse_ib_date('20100104  15:59:30'), entries[1][4])
+
+    def test_half_day_and_incomplete(self):
+        path = os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv')
+        bars = datatools.read_bar_csv(path)
+        datatools.write_bar_csv(path, bars[:300])
+        self.assertEqual(FileStatus.HalfDay,
+                         self.manifest.record_file('HKFE-IND-HSI', date(2010, 1, 4)))
+        datatools.write_bar_csv(path, bars[:400])
+        self.assertEqual(FileStatus.Incomplete,
+                         self.manifest.record_file('HKFE-IND-HSI', date(2010, 1, 4),
+                                                   expected_rows=480))
+
+    def test_calendar_expected_rows(self):
+        path = os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv')
+        datatools.write_bar_csv(path, datatools.read_bar_csv(path)[1:])
+        with FetchManifest(self.root, 'calendar.sqlite', calendar=HKFE_CALENDAR) as manifest:
+            manifest.scan()
+            entries = manifest.entries('HKFE-IND-HSI', date(2010, 1, 1), date(2010, 1, 5))
+            self.assertEqual([FileStatus.Holiday, FileStatus.Incomplete, FileStatus.Complete],
+                             [entry[1] for entry in entries])
+
+    def test_fetched_and_valid_files(self):
+        self.manifest.record_failure('HKFE-IND-HSI', date(2010, 1, 6))
+        fetched = self.manifest.fetched(['HKFE-IND-HSI'], date(2010, 1, 1), date(2010, 1, 6))
+        self.assertEqual({('HKFE-IND-HSI', date(2010, 1, day)) for day in (1, 4, 5)}, fetched)
+        self.assertEqual([os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv'),
+                          os.path.join(self.root, '2010-01-05', 'HKFE-IND-HSI.csv')],
+                         self.manifest.valid_files('HKFE-IND-HSI', date(2010, 1, 1),
+                                                   date(2010, 1, 6)))
+
+    def test_load_bars_from_manifest(self):
+        bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 1), date(2010, 1, 5),
+                                   root_dir=self.root, manifest=self.manifest)
+        self.assertEqual(960, len(bars))
+
+
+if __name__ == '__main__':
+    unittest.main()
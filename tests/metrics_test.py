@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from swigibpy import Contract
+
+from core.metrics import METRICS, MetricsRegistry
+from providers.ibtws import RequestType, TickType
+from providers.registry import RequestRegistry, RequestOutcome
+from providers.replay import BarReplay
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+
+    def test_prometheus_text(self):
+        self.metrics.counter('bars_total', "Bars.", loader='ib').inc(3)
+        latency = self.metrics.histogram('wait_seconds', "Waits.", buckets=(0.1, 1))
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        self.assertEqual('# HELP bars_total Bars.\n'
+                         '# TYPE bars_total counter\n'
+                         'bars_total{loader="ib"} 3\n'
+                         '# HELP wait_seconds Waits.\n'
+                         '# TYPE wait_seconds histogram\n'
+                         'wait_seconds_bucket{le="0.1"} 1\n'
+                         'wait_seconds_bucket{le="1"} 2\n'
+                         'wait_seconds_bucket{le="+Inf"} 3\n'
+                         'wait_seconds_sum 5.55\n'
+                         'wait_seconds_count 3\n', self.metrics.prometheus_text())
+
+        root = tempfile.mkdtemp()
+        try:
+            self.metrics.write_prometheus(os.path.join(root, 'metrics.prom'))
+            with open(os.path.join(root, 'metrics.prom')) as text_file:
+                self.assertEqual(self.metrics.prometheus_text(), text_file.read())
+        finally:
+            shutil.rmtree(root)
+
+    def test_disabled_updates_nothing(self):
+        counter = self.metrics.counter('bars_total', "Bars.")
+        self.metrics.enabled = False
+        counter.inc()
+        self.metrics.histogram('wait_seconds', "Waits.").observe(1)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual({(): 0}, snapshot['bars_total'])
+        self.assertEqual(0, snapshot['wait_seconds'][()]['count'])
+
+    def test_instruments_the_client(self):
+        ticks = METRICS.counter('tws_callbacks_total', "", callback='tickPrice')
+        latencies = METRICS.histogram('tws_handler_seconds', "", callback='tickPrice')
+        finished = METRICS.counter('tws_requests_total', "", type=RequestType.HistoricalData.value,
+                                   outcome=RequestOutcome.Finished.value)
+        ticks_before, finished_before = ticks.value, finished.value
+        sampled_before = latencies.count
+
+        contract = Contract()
+        contract.exchange, contract.secType, contract.symbol = "HKFE", "IND", "HSI"
+        replay = BarReplay(date(2010, 1, 4), date(2010, 1, 4))
+        tws = replay.client(registry=RequestRegistry(timer=False))
+        tws.reqHistoricalData(_Handler(), contract, "20100104 16:00:00")
+        tws.reqMarketData(_Handler(), contract, "")
+        replay.run()
+
+        self.assertEqual(4 * 480, ticks.value - ticks_before)
+        self.assertEqual(4 * 480 // 16, latencies.count - sampled_before)
+        self.assertEqual(1, finished.value - finished_before)
+
+
+class _Handler(object):
+    def historicalData(self, *args):
+        pass
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        assert field == TickType.Last
+
+    def tickSize(self, *args):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
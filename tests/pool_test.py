@@ -0,0 +1,147 @@
+import unittest
+
+from providers.pool import TwsClientPool
+from providers.registry import REGISTRY
+
+
+class FakeSocket(object):
+    """Stands in for EPosixClientSocket, requests are answered by the test."""
+    def __init__(self, wrapper, accept):
+        self.wrapper = wrapper
+        self.accept = accept
+        self.connected = False
+        self.client_id = None
+        self.requested = []
+
+    def eConnect(self, host, port, client_id):
+        self.client_id = client_id
+        self.connected = self.accept
+        return self.accept
+
+    def eDisconnect(self):
+        self.connected = False
+
+    def isConnected(self):
+        return self.connected
+
+    def reqHistoricalData(self, req_id, *args):
+        self.requested.append(req_id)
+
+    def reqMktData(self, req_id, *args):
+        self.requested.append(req_id)
+
+    def cancelHistoricalData(self, req_id):
+        pass
+
+    def bars(self, req_id, count, finish=False):
+        for index in range(count):
+            self.wrapper.historicalData(req_id, "20100104  10:00:%02d" % index, 1.0, 1.0, 1.0,
+                                        1.0, 0, 1, 0.0, 0)
+        if finish:
+            self.wrapper.historicalData(req_id, "finished", -1, -1, -1, -1, -1, -1, -1, 0)
+
+
+class Handler(object):
+    def __init__(self):
+        self.dates = []
+        self.ended = []
+
+    def historicalData(self, request, date, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        self.dates.append(date)
+
+    def historicalDataEnd(self, request):
+        self.ended.append(request.request_id)
+
+
+class TwsClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.sockets = []
+        self.refused = set()
+        self.pool = TwsClientPool([15, 16, 17], socket_factory=self.socket_factory,
+                                  check_interval=3600, clock=lambda: self.now)
+
+    def socket_factory(self, wrapper):
+        self.sockets.append(FakeSocket(wrapper, len(self.sockets) not in self.refused))
+        return self.sockets[-1]
+
+    def socket(self, client_id):
+        return [socket for socket in self.sockets if socket.client_id == client_id][-1]
+
+    def test_distinct_client_ids(self):
+        self.assertRaises(ValueError, TwsClientPool, [15, 15])
+
+    def test_routes_to_least_loaded(self):
+        self.pool.connect()
+        try:
+            requests = [self.pool.reqHistoricalData(Handler(), None, "20100105 00:00:00")
+                        for _ in range(6)]
+            self.assertEqual({15: 2, 16: 2, 17: 2}, self.pool.load())
+            request = requests[0]
+            self.socket(request.client_id).bars(request._request.request_id, 2, finish=True)
+            self.assertTrue(request.done.is_set())
+            self.assertEqual(["20100104  10:00:00", "20100104  10:00:01"], request.handler.dates)
+            self.assertEqual([request.request_id], request.handler.ended)
+            self.assertEqual(1, self.pool.load()[request.client_id])
+            self.assertTrue(requests[1].cancel())
+            self.assertFalse(requests[1].cancel())
+            self.assertEqual(4, sum(self.pool.load().values()))
+        finally:
+            self.pool.close()
+
+    def test_reissues_after_reconnect(self):
+        self.refused = {3}  # The first reconnection attempt fails.
+        self.pool.connect()
+        try:
+            handler = Handler()
+            request = self.pool.reqHistoricalData(handler, None, "20100105 00:00:00")
+            dropped = self.socket(request.client_id)
+            first_id = request._request.request_id
+            dropped.bars(first_id, 2)
+            dropped.connected = False
+
+            self.pool.check()
+            self.assertIsNone(REGISTRY.get(first_id))
+            self.assertNotEqual(dropped.client_id, request.client_id)
+            self.assertEqual([15, 16, 17], sorted(self.pool.client_ids))
+            self.assertEqual(2, len(self.pool.connected_ids()))
+            dropped.bars(first_id, 1)  # Late callbacks of the dropped session are ignored.
+            self.socket(request.client_id).bars(request._request.request_id, 3, finish=True)
+            self.assertEqual(["20100104  10:00:00", "20100104  10:00:01", "20100104  10:00:02"],
+                             handler.dates)
+            self.assertTrue(request.done.is_set())
+            self.assertIsNone(request.error)
+
+            self.now = 0.5
+            self.pool.check()
+            self.assertEqual(2, len(self.pool.connected_ids()))
+            self.now = 1.0
+            self.pool.check()
+            self.assertEqual(3, len(self.pool.connected_ids()))
+        finally:
+            self.pool.close()
+
+    def test_parks_requests_without_session(self):
+        self.pool.connect()
+        try:
+            request = self.pool.reqMarketData(Handler(), None, "")
+            self.refused = set(range(3, 10))
+            for socket in list(self.sockets):
+                socket.connected = False
+            in_flight = len(REGISTRY)
+            self.pool.check()
+            self.assertEqual(in_flight - 1, len(REGISTRY))
+            self.assertEqual([], self.pool.connected_ids())
+            self.assertFalse(request.done.is_set())
+            self.refused = set()
+            self.now = 10.0
+            self.pool.check()
+            self.assertIsNotNone(request.client_id)
+            self.assertIn(request._request.request_id, self.socket(request.client_id).requested)
+        finally:
+            self.pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
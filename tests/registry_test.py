@@ -0,0 +1,86 @@
+import threading
+import unittest
+
+from providers.ibtws import TwsClient, RequestType
+from providers.registry import RequestRegistry, TIMED_OUT
+
+
+class NullSocket(object):
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class Handler(object):
+    def historicalData(self, request, date, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        pass
+
+
+class RequestRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.registry = RequestRegistry(tick=0.1, slots=8, timer=False, clock=lambda: self.now)
+        self.client = TwsClient(1, socket_factory=NullSocket, registry=self.registry)
+
+    def finish(self, request):
+        self.client._wrapper.historicalData(request.request_id, "finished", -1, -1, -1, -1, -1,
+                                            -1, -1, 0)
+
+    def test_ids_are_unique_across_threads(self):
+        ids = []
+
+        def allocate():
+            ids.extend(self.registry.next_id() for _ in range(1000))
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, len(set(ids)))
+
+    def test_expires_pending_requests(self):
+        short = self.client.reqHistoricalData(Handler(), None, "20100105 00:00:00", timeout=0.5)
+        long = self.client.reqHistoricalData(Handler(), None, "20100106 00:00:00", timeout=2.0)
+        finished = self.client.reqHistoricalData(Handler(), None, "20100107 00:00:00", timeout=0.5)
+        self.finish(finished)
+        self.now = 0.45
+        self.registry.advance()
+        self.assertEqual(2, len(self.registry))
+        self.now = 0.55
+        self.registry.advance()
+        self.assertFalse(short.wait(0))
+        self.assertEqual(TIMED_OUT, short.error)
+        self.assertIsNone(finished.error)
+        self.assertEqual(1, len(self.registry))
+        self.now = 1.95
+        self.registry.advance()  # The wheel turned twice, the long request is due next turn.
+        self.assertIsNone(long.error)
+        self.now = 2.05
+        self.registry.advance()
+        self.assertEqual(TIMED_OUT, long.error)
+        self.assertEqual(0, len(self.registry))
+        stats = self.registry.stats(RequestType.HistoricalData)
+        self.assertEqual((0, 1, 0, 2), stats[:4])
+
+    def test_in_flight_and_latency(self):
+        requests = [self.client.reqHistoricalData(Handler(), None, "20100105 00:00:00")
+                    for _ in range(10)]
+        market = self.client.reqMarketData(Handler(), None, "")
+        self.assertEqual(10, self.registry.stats(RequestType.HistoricalData).in_flight)
+        self.assertIsNone(self.registry.stats(RequestType.HistoricalData).p50)
+        for index, request in enumerate(requests):
+            self.now = index + 1.0
+            self.finish(request)
+        market.cancel()
+        stats = self.registry.stats(RequestType.HistoricalData)
+        self.assertEqual((0, 10, 0, 0), stats[:4])
+        self.assertAlmostEqual(5.5, stats.p50)
+        self.assertAlmostEqual(9.91, stats.p99)
+        self.assertEqual((0, 0, 1, 0), self.registry.stats(RequestType.MarketData)[:4])
+
+
+if __name__ == '__main__':
+    unittest.main()
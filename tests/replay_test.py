@@ -0,0 +1,111 @@
+import unittest
+from datetime import date
+
+import numpy as np
+from swigibpy import Contract
+
+from core import datatools
+from providers.ibtws import BarSize
+from providers.registry import RequestRegistry
+from providers.replay import BarReplay
+from providers.tickbars import BarAggregator
+
+DAY = date(2010, 1, 4)
+
+
+def contract(symbol):
+    result = Contract()
+    result.exchange = "HKFE"
+    result.secType = "IND"
+    result.symbol = symbol
+    result.currency = "HKD"
+    return result
+
+
+class Recorder(object):
+    def __init__(self, replay=None):
+        self.replay = replay
+        self.ticks = []
+        self.bars = []
+
+    def historicalData(self, request, date_, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        self.bars.append((date_, open_, high, low, close, volume))
+
+    def tickPrice(self, request, field, price, can_auto_execute):
+        self.ticks.append((self.replay.clock(), request.request_id, field, price))
+
+    def tickSize(self, request, field, size):
+        self.ticks.append((self.replay.clock(), request.request_id, field, size))
+
+
+class BarReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = RequestRegistry(timer=False)
+
+    def test_merges_contracts_in_time_order(self):
+        replay = BarReplay(DAY, DAY)
+        tws = replay.client(registry=self.registry)
+        recorder = Recorder(replay)
+        hsi = tws.reqMarketData(recorder, contract("HSI"), "")
+        hhi = tws.reqMarketData(recorder, contract("HHI.HK"), "")
+        count = replay.run()
+
+        self.assertEqual(2 * 480 * 5, count)
+        self.assertEqual(count, len(recorder.ticks))
+        times = [tick[0] for tick in recorder.ticks]
+        self.assertEqual(sorted(times), times)
+        self.assertEqual({hsi.request_id, hhi.request_id}, {tick[1] for tick in recorder.ticks})
+
+    def test_answers_historical_requests(self):
+        replay = BarReplay(DAY, DAY)
+        tws = replay.client(registry=self.registry)
+        recorder = Recorder()
+        request = tws.reqHistoricalData(recorder, contract("HSI"), "20100104 16:00:00",
+                                        duration="1 D", bar_size=BarSize.Min1)
+
+        self.assertTrue(request.wait(0))
+        self.assertEqual(240, len(recorder.bars))
+        self.assertEqual("20100104  10:00:00", recorder.bars[0][0])
+        self.assertEqual(0, len(self.registry))
+
+    def test_ticks_rebuild_the_bars(self):
+        replay = BarReplay(DAY, DAY)
+        tws = replay.client(registry=self.registry)
+        built = []
+        aggregator = BarAggregator(BarSize.Sec30, lambda *bar: built.append(bar),
+                                   clock=replay.clock)
+        tws.reqMarketData(aggregator, contract("HSI"), "")
+        replay.run()
+        aggregator.flush(force=True)
+
+        source = datatools.load_bars('HKFE', 'IND', 'HSI', DAY, DAY)
+        built = np.array([bar[:6] for bar in built])
+        np.testing.assert_array_equal(source['date'], built[:, 0])
+        for index, name in enumerate(('open', 'high', 'low', 'close', 'volume'), 1):
+            np.testing.assert_array_equal(source[name], built[:, index])
+
+    def test_paces_at_speed(self):
+        now = [0.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        replay = BarReplay(DAY, DAY, speed=100, sleep=sleep, timer=lambda: now[0])
+        tws = replay.client(registry=self.registry)
+        tws.reqMarketData(Recorder(replay), contract("HSI"), "")
+        replay.run()
+
+        first, last = self.first_last(DAY)
+        self.assertAlmostEqual((last - first) / 100, sum(slept))
+
+    @staticmethod
+    def first_last(the_date):
+        dates = datatools.load_bars('HKFE', 'IND', 'HSI', the_date, the_date)['date']
+        return dates[0], dates[-1] + 22.5
+
+
+if __name__ == '__main__':
+    unittest.main()
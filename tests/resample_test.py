@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.barstore import BarStore
+from core.resample import resample, cached_resample, derived_key
+
+DAY = datatools.parse_ib_date('20100104')
+
+
+class ResampleTest(unittest.TestCase):
+    def setUp(self):
+        self.bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 4), date(2010, 1, 8))
+
+    def test_minute_bars(self):
+        minutes = resample(self.bars, "1 min")
+        self.assertEqual(5 * 240, len(minutes))
+        first = self.bars[:2]
+        expected = (DAY + 10 * 3600, first['open'][0], first['high'].max(), first['low'].min(),
+                    first['close'][1], first['bar_count'].sum())
+        fields = ['date', 'open', 'high', 'low', 'close', 'bar_count']
+        self.assertEqual(expected, tuple(minutes[fields][0].tolist()))
+        self.assertFalse(minutes['has_gaps'].any())
+
+    def test_bars_do_not_span_lunch_break(self):
+        hours = resample(self.bars, "1 hour")
+        first_day = hours['date'][hours['date'] < DAY + 86400] - DAY
+        self.assertEqual([10 * 3600, 11 * 3600, 12 * 3600, 14 * 3600 + 1800, 15 * 3600 + 1800],
+                         first_day.tolist())
+        self.assertEqual(self.bars['close'][299], hours['close'][2])
+
+    def test_daily_and_weekly(self):
+        days = resample(self.bars, "1 day")
+        self.assertEqual(5, len(days))
+        self.assertEqual(self.bars['high'][:480].max(), days['high'][0])
+        self.assertEqual(self.bars['close'][-1], resample(days, "1 week")['close'][0])
+
+    def test_missing_bars_are_gaps(self):
+        minutes = resample(np.delete(self.bars, 3), "1 min")
+        self.assertEqual([False, True, False], minutes['has_gaps'][:3].tolist())
+
+    def test_volume_weighted_wap(self):
+        bars = self.bars[:2].copy()
+        bars['volume'] = [1, 3]
+        bars['wap'] = [10.0, 20.0]
+        self.assertEqual(17.5, resample(bars, "1 min")['wap'][0])
+
+    def test_default_follows_trading_hours(self):
+        day = datatools.parse_ib_date('20120305')
+        bars = np.zeros(2, dtype=datatools.BAR_DTYPE)
+        bars['date'] = [day + 9 * 3600 + 1800, day + 10 * 3600 + 1800]
+        self.assertEqual([9 * 3600 + 1800, 10 * 3600 + 1800],
+                         (resample(bars, "1 hour")['date'] % 86400).tolist())
+
+
+class CachedResampleTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = BarStore(self.root)
+        self.store.write('HKFE-IND-HSI', datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 1),
+                                                             date(2010, 2, 28)))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_derived_months_are_cached(self):
+        minutes = cached_resample(self.store, 'HKFE-IND-HSI', "5 mins")
+        target = derived_key('HKFE-IND-HSI', "5 mins")
+        self.assertEqual(['2010-01', '2010-02'], self.store.months(target))
+        modified = self.store.modified('HKFE-IND-HSI@5mins', '2010-01')
+        again = cached_resample(self.store, 'HKFE-IND-HSI', "5 mins")
+        self.assertEqual(modified, self.store.modified('HKFE-IND-HSI@5mins', '2010-01'))
+        self.assertTrue(np.array_equal(minutes['close'], again['close']))
+        self.assertEqual(len(self.store.read('HKFE-IND-HSI')['date']) // 10, len(minutes['date']))
+
+    def test_only_months_of_range(self):
+        days = cached_resample(self.store, 'HKFE-IND-HSI', "1 day",
+                               start=datatools.parse_ib_date('20100201'))
+        self.assertEqual(['2010-02'], self.store.months(derived_key('HKFE-IND-HSI', "1 day")))
+        self.assertEqual(datatools.parse_ib_date('20100201'), days['date'][0])
+        self.assertEqual(['HKFE-IND-HSI'], self.store.keys())
+
+    def test_weekly_from_daily(self):
+        weeks = cached_resample(self.store, 'HKFE-IND-HSI', "1 week")
+        self.assertEqual(datatools.parse_ib_date('20100111'), weeks['date'][1])
+        self.assertEqual(8, len(weeks['date']))
+
+
+if __name__ == '__main__':
+    unittest.main()
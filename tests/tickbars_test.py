@@ -0,0 +1,49 @@
+import unittest
+
+from providers.ibtws import BarSize, TickType
+from providers.tickbars import BarAggregator
+
+START = 1262599200  # 2010-01-04 10:00:00
+
+
+class BarAggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.now = START
+        self.bars = []
+        self.aggregator = BarAggregator(BarSize.Sec30, lambda *bar: self.bars.append(bar),
+                                        clock=lambda: self.now)
+
+    def trade(self, offset, price, size=None):
+        self.now = START + offset
+        self.aggregator.tickPrice(None, TickType.Last, price, 0)
+        if size is not None:
+            self.aggregator.tickSize(None, TickType.LastSize, size)
+
+    def test_folds_trades_into_bars(self):
+        self.trade(0, 100.0, 2)
+        self.trade(10, 103.0, 1)
+        self.trade(20, 99.0, 1)
+        self.trade(29, 101.0)
+        self.trade(30, 102.0, 5)
+        self.assertEqual([(START, 100.0, 103.0, 99.0, 101.0, 4, 4, (200.0 + 103.0 + 99.0) / 4, 0)],
+                         self.bars)
+
+    def test_flush_emits_ended_bar(self):
+        self.trade(5, 100.0)
+        self.aggregator.flush()
+        self.assertEqual([], self.bars)
+        self.now = START + 31
+        self.aggregator.flush()
+        self.assertEqual([(START, 100.0, 100.0, 100.0, 100.0, 0, 1, 0.0, 0)], self.bars)
+        self.aggregator.flush(force=True)
+        self.assertEqual(1, len(self.bars))
+
+    def test_ignores_other_fields(self):
+        self.aggregator.tickPrice(None, TickType.Bid, 99.0, 0)
+        self.aggregator.tickSize(None, TickType.Volume, 1000)
+        self.aggregator.flush(force=True)
+        self.assertEqual([], self.bars)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+from datetime import date
+
+import numpy as np
+
+from core import datatools
+from core.resample import resample, HKFE_SESSIONS
+from core.tradingcalendar import HKFE_CALENDAR, TradingCalendar
+
+
+class TradingCalendarTest(unittest.TestCase):
+    def test_matches_sample(self):
+        directories = sorted(os.listdir(datatools.MARKET_DATA_DIR))
+        holidays = [name for name in directories
+                    if not HKFE_CALENDAR.is_trading_day(date(*map(int, name.split('-'))))]
+        self.assertEqual(['2010-01-01', '2010-02-15', '2010-02-16', '2010-04-02', '2010-04-05',
+                          '2010-04-06', '2010-05-21', '2010-06-16', '2010-07-01'], holidays)
+        days = HKFE_CALENDAR.trading_days(date(2010, 1, 1), date(2010, 9, 9))
+        self.assertEqual(171, len(days))
+        self.assertEqual(171, HKFE_CALENDAR.count_trading_days(date(2010, 9, 9), date(2010, 1, 1)))
+        self.assertEqual(days[::-1], HKFE_CALENDAR.trading_days(date(2010, 9, 9), date(2010, 1, 1)))
+        bars = datatools.load_bars('HKFE', 'IND', 'HSI', date(2010, 1, 1), date(2010, 9, 9))
+        expected = sum(HKFE_CALENDAR.expected_bars(day, "30 secs") for day in days)
+        self.assertEqual(len(bars), expected)
+
+    def test_expected_bars(self):
+        self.assertEqual(480, HKFE_CALENDAR.expected_bars(date(2010, 1, 4), "30 secs"))
+        self.assertEqual(5, HKFE_CALENDAR.expected_bars(date(2010, 1, 4), "1 hour"))
+        self.assertEqual(1, HKFE_CALENDAR.expected_bars(date(2010, 1, 4), "1 day"))
+        self.assertEqual(300, HKFE_CALENDAR.expected_bars(date(2010, 12, 31), "30 secs"))
+        self.assertEqual(0, HKFE_CALENDAR.expected_bars(date(2010, 2, 15), "30 secs"))
+        self.assertEqual(0, HKFE_CALENDAR.expected_bars(date(2010, 1, 9), "30 secs"))
+        calendar = TradingCalendar(holidays=(), half_days=(), start=date(2011, 1, 1),
+                                   end=date(2012, 12, 31))
+        self.assertEqual(600, calendar.expected_bars(date(2011, 3, 7), "30 secs"))
+        self.assertEqual(660, calendar.expected_bars(date(2012, 3, 5), "30 secs"))
+
+    def test_weekdays_after_listed_holidays(self):
+        self.assertTrue(HKFE_CALENDAR.is_listed(date(2010, 12, 31)))
+        self.assertFalse(HKFE_CALENDAR.is_listed(date(2011, 1, 3)))
+        self.assertTrue(HKFE_CALENDAR.is_trading_day(date(2011, 1, 3)))
+        self.assertFalse(HKFE_CALENDAR.is_trading_day(date(2011, 1, 8)))
+        self.assertEqual(600, HKFE_CALENDAR.expected_bars(date(2011, 3, 7), "30 secs"))
+        self.assertEqual(660, HKFE_CALENDAR.expected_bars(date(2026, 3, 2), "30 secs"))
+        self.assertEqual(261, len(HKFE_CALENDAR.trading_days(date(2025, 1, 1), date(2025, 12, 31))))
+        self.assertRaises(ValueError, HKFE_CALENDAR.is_trading_day, date(1999, 1, 4))
+
+    def test_custom_holidays(self):
+        calendar = TradingCalendar(holidays=[date(2011, 2, 3)], half_days=[date(2011, 2, 2)],
+                                   start=date(2011, 1, 1), end=date(2011, 12, 31))
+        self.assertFalse(calendar.is_trading_day(date(2011, 2, 3)))
+        self.assertTrue(calendar.is_half_day(date(2011, 2, 2)))
+        self.assertEqual(((36000, 45000),), calendar.sessions(date(2011, 2, 2)))
+        self.assertTrue(calendar.is_trading_day(date(2011, 2, 4)))
+
+    def test_resample_across_regimes(self):
+        day = datatools.parse_ib_date('20110307')
+        bars = np.zeros(2, dtype=datatools.BAR_DTYPE)
+        bars['date'] = [day - 3 * 86400 + 14 * 3600 + 1800, day + 13 * 3600 + 1800]
+        self.assertEqual([14 * 3600 + 1800, 13 * 3600 + 1800],
+                         (resample(bars, "1 hour", HKFE_CALENDAR)['date'] % 86400).tolist())
+        self.assertEqual([14 * 3600 + 1800, 13 * 3600],
+                         (resample(bars, "1 hour", HKFE_SESSIONS)['date'] % 86400).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from core import datatools
+from core.barstore import BarStore
+from tools.validate_market_data import ingest, print_report, validate_bars, validate_directory
+
+
+class ValidateMarketDataTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ('2010-01-01', '2010-01-04', '2010-01-05'):
+            shutil.copytree(os.path.join(datatools.MARKET_DATA_DIR, name),
+                            os.path.join(self.root, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_sample_is_valid(self):
+        reports = ingest(datatools.MARKET_DATA_DIR, workers=2)
+        self.assertEqual(360, len(reports))
+        self.assertEqual([], [report for report in reports if report.issues])
+        self.assertEqual(sorted(reports, key=lambda report: report[:2]), reports)
+        self.assertEqual(82080, sum(report.day_rows for report in reports
+                                    if report.contract == 'HKFE-IND-HSI'))
+
+    def test_issues(self):
+        bars = datatools.read_bar_csv(os.path.join(self.root, '2010-01-04', 'HKFE-IND-HSI.csv'))
+        bars['high'][5] = bars['low'][5] - 1
+        bars[7] = bars[6]
+        bars['has_gaps'][9] = True
+        self.assertEqual(("1 duplicate bars", "1 bars with inconsistent OHLC", "1 bars with gaps"),
+                         validate_bars(bars))
+        self.assertEqual(("1 bars out of order",), validate_bars(bars[[0, 2, 1]]))
+
+    def test_holidays_and_unreadable_files(self):
+        with open(os.path.join(self.root, '2010-01-05', 'HKFE-IND-HSI.csv'), 'w') as csv_file:
+            csv_file.write("date,open\n20100105  10:00:00,bad\n")
+        reports, _ = validate_directory(os.path.join(self.root, '2010-01-01'))
+        self.assertEqual([(300, 0, ())] * 2, [report[2:] for report in reports])
+        reports = ingest(self.root, workers=1)
+        self.assertTrue(reports[-1].issues[0].startswith("unreadable"))
+        out = io.StringIO()
+        print_report(reports, out)
+        self.assertIn('Contract "HKFE-IND-HSI": 3 files, 480 bars, 1 holidays, 1 invalid files.',
+                      out.getvalue())
+
+    def test_store(self):
+        store_root = os.path.join(self.root, 'store')
+        ingest(self.root, store_root, workers=2)
+        dates = BarStore(store_root).read('HKFE-IND-HSI')['date']
+        self.assertEqual(300 + 2 * 480, len(dates))
+        self.assertTrue(np.all(np.diff(dates) > 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from providers.yahoo import download, download_many, http_transport
+
+BARS = pd.DataFrame({'Open': [10.0, 11.0, 12.0, 13.0], 'Close': [11.0, 12.0, 13.0, 14.0],
+                     'Volume': [100, 200, 300, 400]},
+                    index=pd.DatetimeIndex(['2010-01-04', '2010-01-05', '2010-01-06',
+                                            '2010-01-07'], name='Date'))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves ``BARS`` of every symbol between the ``start`` and ``end`` query dates."""
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.server.requests.append((url.path.strip('/'), query['start'], query['end']))
+        if url.path.startswith('/MISSING'):
+            self.send_error(404)
+            return
+        body = BARS[query['start']:query['end']].to_csv().encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadManyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.transport = http_transport('http://127.0.0.1:%d/%%(symbol)s?start=%%(start)s'
+                                        '&end=%%(end)s' % self.server.server_port)
+        self.cache_dir = tempfile.mkdtemp()
+        self.slept = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_fetches_only_new_days(self):
+        frames = download_many(["0005.HK", "0700.HK"], self.cache_dir, end=date(2010, 1, 5),
+                               transport=self.transport)
+        self.assertEqual([2, 2], [len(frames[symbol]) for symbol in ("0005.HK", "0700.HK")])
+
+        del self.server.requests[:]
+        frames = download_many(["0005.HK", "0700.HK"], self.cache_dir, end=date(2010, 1, 7),
+                               transport=self.transport)
+        self.assertEqual({("0005.HK", "2010-01-06", "2010-01-07"),
+                          ("0700.HK", "2010-01-06", "2010-01-07")}, set(self.server.requests))
+        pd.testing.assert_frame_equal(BARS, frames["0005.HK"], check_freq=False)
+        cached = pd.read_csv(self.cache_dir + "/0700.HK.csv", index_col=0, parse_dates=True)
+        pd.testing.assert_frame_equal(BARS, cached, check_freq=False)
+
+        del self.server.requests[:]
+        download_many(["0005.HK"], self.cache_dir, end=date(2010, 1, 7), transport=self.transport)
+        self.assertEqual([], self.server.requests)
+
+    def test_retries_with_backoff(self):
+        frames = download_many(["MISSING", "0005.HK"], self.cache_dir, end=date(2010, 1, 7),
+                               transport=self.transport, sleep=self.slept.append)
+        self.assertIsNone(frames["MISSING"])
+        self.assertEqual(4, len(frames["0005.HK"]))
+        self.assertEqual([1, 2], self.slept)
+
+    def test_download_returns_none_when_unreachable(self):
+        self.assertIsNone(download("MISSING", 2010, 1, 4, 2010, 1, 7, transport=self.transport,
+                                   sleep=self.slept.append))
+        self.assertEqual(3, len(self.server.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
+from core.barstore import BarStore
+from tools.validate_market_data import ingest
+
+
+def convert(csv_root: str, store_root: str, workers: int = None):
+    """Converts a CSV tree written by ``ib_data_loader`` into a ``BarStore``.
+
+    Date directories are parsed by a pool of ``workers`` processes and each contract is written
+    in one go, so every month chunk is written once. Holiday directories repeat the previous
+    trading day's bars; the store keeps a single copy of each bar.
+    """
+    reports = ingest(csv_root, store_root, workers)
+    counts = {}
+    for report in reports:
+        counts[report.contract] = counts.get(report.contract, 0) + 1
+    for key in sorted(counts):
+        print('Contract "%s": %d files converted.' % (key, counts[key]))
+    return BarStore(store_root)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print('Usage: bar_store_converter.py <csv root> <store root>')
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,202 @@
+"""Finds the missing bars of the CSV tree and fetches only those.
+
+Every file of a trading day is compared with the bar timestamps its sessions should have, see
+``core.tradingcalendar``. Missing bars and bars flagged ``has_gaps`` are grouped into spans of
+consecutive expected bars, each span is one ``reqHistoricalData`` call ending at the end of the
+span and lasting its duration in seconds, and the bars received are merged into the existing
+file.
+
+Usage::
+
+    $ python -m tools.gap_repair ../data-market/hk 2010-01-01 2010-12-31
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+from swigibpy import Contract
+
+import core.datatools
+from core.metrics import METRICS
+from core.manifest import FetchManifest
+from core.tradingcalendar import HKFE_CALENDAR, TradingCalendar
+from providers.ibtws import TwsClient, BarSize
+from providers.pacing import Pacer
+from tools.ib_data_loader import HistoricalData, data_file_path, write_bars, CLIENT_ID, \
+    REQUEST_TIME_OUT, RETRY_COUNT
+
+BAR_SECONDS = 30
+
+_RETRIES = METRICS.counter('loader_retries_total', "Requests issued again after a failure.",
+                           loader='gap_repair')
+
+
+class GapSpan(namedtuple('GapSpan', ['start', 'end'])):
+    """Represents consecutive missing bars, from the epoch seconds ``start`` (inclusive) to
+    ``end`` (exclusive)."""
+    __slots__ = ()
+
+    @property
+    def end_datetime(self) -> str:
+        """The ``end_datetime`` of the request of the span, in the format of TWS."""
+        return core.datatools.format_ib_dates([self.end])[0].replace('  ', ' ')
+
+    @property
+    def duration(self) -> str:
+        """The ``duration`` of the request of the span, in seconds."""
+        return "%d S" % (self.end - self.start)
+
+
+DayRepair = namedtuple('DayRepair', ['contract', 'the_date', 'full_path', 'spans'])
+"""Represents the missing spans of the file of a contract on a trading day."""
+
+
+def expected_dates(the_date: date, calendar: TradingCalendar = HKFE_CALENDAR,
+                   bar_seconds: int = BAR_SECONDS) -> np.ndarray:
+    """Gets the epoch seconds of the bars of a day, empty on non-trading days."""
+    day_start = (the_date.toordinal() - date(1970, 1, 1).toordinal()) * 86400
+    times = [np.arange(start, end, bar_seconds, dtype=np.int64)
+             for start, end in calendar.sessions(the_date)]
+    return day_start + np.concatenate(times) if times else np.empty(0, dtype=np.int64)
+
+
+def find_gaps(bars, expected: np.ndarray, bar_seconds: int = BAR_SECONDS):
+    """Gets the spans of the expected bars that are missing or have gaps.
+
+    Spans are runs of consecutive expected bars, so a run across the lunch break is one span.
+    """
+    dates = np.asarray(bars['date'], dtype=np.int64)
+    complete = dates[~np.asarray(bars['has_gaps'], dtype=bool)]
+    missing = ~np.isin(expected, complete)
+    if not missing.any():
+        return []
+    # Run boundaries of the missing flags.
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], missing, [False])).astype(np.int8)))
+    return [GapSpan(int(expected[first]), int(expected[last - 1]) + bar_seconds)
+            for first, last in zip(edges[::2], edges[1::2])]
+
+
+def merge_bars(existing: np.ndarray, fetched: np.ndarray, the_date: date) -> np.ndarray:
+    """Merges fetched bars into the bars of a day, fetched bars replace bars of the same date."""
+    day_start = (the_date.toordinal() - date(1970, 1, 1).toordinal()) * 86400
+    bars = np.concatenate([existing, fetched.astype(existing.dtype)])
+    bars = bars[(bars['date'] >= day_start) & (bars['date'] < day_start + 86400)]
+    order = np.argsort(bars['date'], kind='mergesort')
+    bars = bars[order]
+    keep = np.ones(len(bars), dtype=bool)
+    keep[:-1] = bars['date'][1:] != bars['date'][:-1]
+    return bars[keep]
+
+
+def plan_repairs(root_dir: str, contracts, start: date, end: date,
+                 calendar: TradingCalendar = HKFE_CALENDAR):
+    """Scans the files of the contracts on the trading days between two dates (inclusive).
+
+    Returns:
+        list: the ``DayRepair`` of the days with missing bars, a missing file is one span.
+    """
+    repairs = []
+    for the_date in calendar.trading_days(start, end):
+        expected = expected_dates(the_date, calendar)
+        for contract in contracts:
+            full_path = data_file_path(root_dir, the_date, contract)
+            if os.path.exists(full_path):
+                bars = core.datatools.read_bar_csv(full_path)
+            else:
+                bars = np.empty(0, dtype=core.datatools.BAR_DTYPE)
+            spans = find_gaps(bars, expected)
+            if spans:
+                repairs.append(DayRepair(contract, the_date, full_path, spans))
+    return repairs
+
+
+def repair(tws: TwsClient, repairs, pacer: Pacer = None, manifest: FetchManifest = None,
+           request_time_out: float = REQUEST_TIME_OUT):
+    """Fetches the missing spans and merges them into their files.
+
+    Returns:
+        list: the ``DayRepair`` that could not be fetched entirely, their files are left as is.
+    """
+    pacer = Pacer() if pacer is None else pacer
+    failed = []
+    for day in repairs:
+        fetched = []
+        for span in day.spans:
+            data = _fetch_span(tws, day.contract, span, pacer, request_time_out)
+            if data is None:
+                break
+            fetched.append(data.bars.bars)
+        if len(fetched) < len(day.spans):
+            print('Unable to repair "%s" as of %s' % (day.contract.symbol, day.the_date))
+            failed.append(day)
+            continue
+
+        if os.path.exists(day.full_path):
+            existing = core.datatools.read_bar_csv(day.full_path)
+        else:
+            existing = np.empty(0, dtype=core.datatools.BAR_DTYPE)
+        write_bars(day.full_path, merge_bars(existing, np.concatenate(fetched), day.the_date))
+        if manifest is not None:
+            key = core.datatools.contract_key(day.contract.exchange, day.contract.secType,
+                                              day.contract.symbol)
+            manifest.record_file(key, day.the_date)
+        print('File "%s" has been repaired, %d spans fetched.' % (day.full_path, len(day.spans)))
+    return failed
+
+
+def _fetch_span(tws, contract, span, pacer, request_time_out):
+    pacing_key = (contract.exchange, contract.secType, contract.symbol, span.end_datetime,
+                  BarSize.Sec30)
+    for attempt in range(RETRY_COUNT):
+        if attempt:
+            _RETRIES.inc()
+        pacer.acquire(pacing_key)
+        data = HistoricalData()
+        request = tws.reqHistoricalData(data, contract, span.end_datetime, duration=span.duration,
+                                        bar_size=BarSize.Sec30, timeout=request_time_out)
+        if request.wait():
+            return data
+    return None
+
+
+def _contract(symbol: str) -> Contract:
+    contract = Contract()
+    contract.exchange = "HKFE"
+    contract.secType = "IND"
+    contract.symbol = symbol
+    contract.currency = "HKD"
+    return contract
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root_dir', help="root of the CSV tree")
+    parser.add_argument('start', help="first date, yyyy-mm-dd")
+    parser.add_argument('end', help="last date, yyyy-mm-dd")
+    parser.add_argument('--symbol', action='append', help="HKFE index, HSI and HHI.HK by default")
+    parser.add_argument('--dry-run', action='store_true', help="only prints the spans to fetch")
+    args = parser.parse_args(argv)
+
+    contracts = [_contract(symbol) for symbol in args.symbol or ("HSI", "HHI.HK")]
+    start, end = [date(*map(int, text.split('-'))) for text in (args.start, args.end)]
+    repairs = plan_repairs(os.path.abspath(args.root_dir), contracts, start, end)
+    for day in repairs:
+        print('%s %s: %s' % (day.the_date, day.contract.symbol,
+                             ", ".join("%s %s" % (span.end_datetime, span.duration)
+                                       for span in day.spans)))
+    if args.dry_run or not repairs:
+        return 0
+    tws = TwsClient(client_id=CLIENT_ID)
+    with tws.connect(), FetchManifest(args.root_dir, calendar=HKFE_CALENDAR) as manifest:
+        return 1 if repair(tws, repairs, manifest=manifest) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
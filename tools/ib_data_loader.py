@@ -2,64 +2,163 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import csv
 import logging
 import time
 from datetime import date, timedelta
 
 import sys
 import os
+import queue
+import threading
+from collections import deque
 from swigibpy import Contract
 
 import core.datatools
+from core.metrics import METRICS
+from core.manifest import FetchManifest, FETCHED
+from core.tradingcalendar import HKFE_CALENDAR
 from providers.ibtws import TwsClient, BarSize
+from providers.pacing import Pacer, PACING_WAITS
 
 CLIENT_ID = 15
 REQUEST_TIME_OUT = 5  # TIme to wait for a response.
-WAIT_BETWEEN_REQUEST = 5  # Time to wait before historical data request.
+WAIT_BETWEEN_REQUEST = 5  # Time to wait before historical data request (store_file only).
 RETRY_WAIT = 2  # * 60  # Time to wait before retry request.
 RETRY_COUNT = 5  # Number to retry.
+BATCH_SIZE = 1000  # Number of bars written at a time by streaming requests.
 DATA_START = date(2010, 1, 1)
 DATA_END = date.today()
+DATA_DIR = "../data-market/hk"
+METRICS_FILE = "metrics.prom"  # Prometheus text file of the metrics, in the data directory.
+
+_RETRIES = METRICS.counter('loader_retries_total', "Requests issued again after a failure.",
+                           loader='ib')
 
 
 class HistoricalData(object):
-    def __init__(self):
-        self.rows = []
-
-'''def historicalData(self,
-                       the_date: date, open_, high, low, close, volume, bar_count, wap, has_gaps):
-        # print("Req[%d] Historical=> %s - Open: %s, High: %s, Low: %s, Close: %s, Volume: %d" %
-        #       (request.request_id, date, open_, high, low, close, volume))
-        row = core.datatools.Expando()
-        row.date = the_date
-        row.open = open_
-        row.high = high
-        row.low = low
-        row.close = close
-        row.volume = volume
-        row.bar_count = bar_count
-        row.wap = wap
-        row.has_gaps = has_gaps
-        self.rows.append(row)
-'''
-
-def store_file(root_dir, tws: TwsClient, the_date: date, contract: Contract):
+    """Collects the bars of a historical data request."""
+    def __init__(self, capacity: int = 512):
+        self.bars = core.datatools.BarBuffer(capacity)
+
+    def historicalData(self, request, the_date, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        self.bars.append(the_date, open_, high, low, close, volume, bar_count, wap, has_gaps)
+
+
+class StreamingHistoricalData(HistoricalData):
+    """Writes the bars of a historical data request to a temporary file in batches as they arrive.
+    The file is renamed to its final path once the request is finished, so a file that exists is
+    always complete."""
+    def __init__(self, full_path: str, batch_size: int = BATCH_SIZE):
+        super().__init__(batch_size)
+        self.full_path = full_path
+        self.temp_path = full_path + '.part'
+        self.batch_size = batch_size
+        self.rows = 0
+        self._file = None
+        self._resumed_until = None  # Date of the last bar kept by resume.
+        # Callbacks are no longer serialised with cancellation, a discarded request ignores them.
+        self._lock = threading.Lock()
+        self._discarded = False
+
+    def historicalData(self, request, the_date, open_, high, low, close, volume, bar_count, wap,
+                       has_gaps):
+        with self._lock:
+            if self._discarded:
+                return
+            self.bars.append(the_date, open_, high, low, close, volume, bar_count, wap, has_gaps)
+            if len(self.bars) >= self.batch_size:
+                self._flush()
+
+    def historicalDataEnd(self, request):
+        with self._lock:
+            if self._discarded:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+            os.replace(self.temp_path, self.full_path)
+
+    def resume(self) -> int:
+        """Continues the file of an earlier run, e.g. of a restarted recorder: its bars, still in
+        the temporary file or already moved into place, are kept and the bars that arrive up to
+        the last of them are ignored. Returns the number of bars kept."""
+        with self._lock:
+            path = self.temp_path if os.path.exists(self.temp_path) else self.full_path
+            if not os.path.exists(path):
+                return 0
+            with open(path, 'rb') as csv_file:
+                content = csv_file.read()
+            # A killed process may have left a part of its last row.
+            with open(self.temp_path, 'wb') as csv_file:
+                csv_file.write(content[:content.rfind(b'\n') + 1])
+            bars = core.datatools.read_bar_csv(self.temp_path)
+            if len(bars) == 0:
+                os.remove(self.temp_path)
+                return 0
+            self.rows = len(bars)
+            self._resumed_until = bars['date'][-1]
+            self._file = open(self.temp_path, 'a', newline='')
+            return self.rows
+
+    def discard(self):
+        """Removes the bars written so far and ignores the bars still to come."""
+        with self._lock:
+            self._discarded = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+            self.bars.clear()
+            self.rows = 0
+
+    def _flush(self):
+        if self._file is None:
+            file_dir = os.path.dirname(self.full_path)
+            if not os.path.isdir(file_dir):
+                os.makedirs(file_dir, exist_ok=True)
+            self._file = open(self.temp_path, 'w', newline='')
+        bars = self.bars.bars
+        if self._resumed_until is not None:
+            bars = bars[bars['date'] > self._resumed_until]
+        core.datatools.write_bar_csv(self._file, bars, header=self.rows == 0)
+        self.rows += len(bars)
+        self.bars.clear()
+
+
+def data_file_path(root_dir, the_date: date, contract: Contract) -> str:
     date_dir = "%s" % the_date
-    file_name = "%s-%s-%s.csv" % (contract.exchange, contract.secType, contract.symbol)
-    full_path = os.path.join(root_dir, date_dir, file_name)
-
-    if os.path.exists(full_path):
-        # The file already exists, check it if its holiday.
-        # holiday_file = os.path.join(root_dir, date_dir, "holiday")
-        # half_day_file = os.path.join(root_dir, date_dir, "half_day")
-        # if not os.path.exists(holiday_file):
-        #     with open(full_path) as csvfile:
-        #         csv_reader = csv.reader(csvfile)
-        #         row = next(csv_reader)  # Skips heading row.
-        #         row = next(csv_reader)  # first data row
-        #         if row is not None:
-        #             data_date = datetime.strptime(row[0], "%Y%m%d "
+    file_name = "%s.csv" % core.datatools.contract_key(contract.exchange, contract.secType,
+                                                       contract.symbol)
+    return os.path.join(root_dir, date_dir, file_name)
+
+
+def write_file(full_path, data: HistoricalData):
+    write_bars(full_path, data.bars.bars)
+
+
+def write_bars(full_path, bars):
+    # Historical data was fetched, creates the date dir if not exists.
+    file_dir = os.path.dirname(full_path)
+    if not os.path.isdir(file_dir):
+        os.makedirs(file_dir, exist_ok=True)
+
+    # Written aside then renamed, a killed process never leaves a truncated file behind.
+    core.datatools.write_bar_csv(full_path + '.part', bars)
+    os.replace(full_path + '.part', full_path)
+
+
+def store_file(root_dir, tws: TwsClient, the_date: date, contract: Contract,
+               manifest: FetchManifest = None):
+    full_path = data_file_path(root_dir, the_date, contract)
+    key = core.datatools.contract_key(contract.exchange, contract.secType, contract.symbol)
+
+    if manifest is not None:
+        # The manifest tells complete, half and holidays apart from incomplete or failed files.
+        if manifest.status(key, the_date) in FETCHED:
+            return
+    elif os.path.exists(full_path):
         return
 
     # Data does not exist, fetch it from IB.
@@ -70,9 +169,9 @@ def store_file(root_dir, tws: TwsClient, the_date: date, contract: Contract):
     request = None
     while retry > 0:
         request = tws.reqHistoricalData(
-            data, contract, end_date.strftime("%Y%m%d 00:00:00"), bar_size=BarSize.Sec30)
-        request.done.wait(timeout=REQUEST_TIME_OUT)
-        if request.error is not None:
+            data, contract, end_date.strftime("%Y%m%d 00:00:00"), bar_size=BarSize.Sec30,
+            timeout=REQUEST_TIME_OUT)
+        if not request.wait():
             print('Error caught from request [%d] wait %d seconds then...' % \
             (request.request_id, RETRY_WAIT))
             time.sleep(RETRY_WAIT)
@@ -82,29 +181,146 @@ def store_file(root_dir, tws: TwsClient, the_date: date, contract: Contract):
             else:
                 print('Retry fetching symbol "%s" again - %d try remaining...' % \
                 (contract.symbol, retry))
+                _RETRIES.inc()
+                data = HistoricalData()
                 continue  # try again
+        break
 
     if request.done.is_set():
-        # Historical data was fetched, creates the date dir if not exists.
-        file_dir = os.path.dirname(full_path)
-        if not os.path.isdir(file_dir):
-            os.mkdir(file_dir)
-
-        with open(full_path, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(
-                csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            csv_writer.writerow(
-                ['date', 'open', 'high', 'low', 'close', 'volume', 'bar_count', 'wap', 'has_gaps'])
-            for row in data.rows:
-                csv_writer.writerow(
-                    [row.date, row.open, row.high, row.low, row.close,
-                     row.volume, row.bar_count, row.wap, row.has_gaps])
+        write_file(full_path, data)
+        if manifest is not None:
+            manifest.record_file(key, the_date)
         print('File "%s" has been written - wait for while...' % full_path)
         time.sleep(WAIT_BETWEEN_REQUEST)
     else:
+        if manifest is not None:
+            manifest.record_failure(key, the_date)
         print('Unable to fetch "%s" as of %s ' % (contract.symbol, the_date))
 
 
+class _BackfillJob(object):
+    """Represents the historical data of a contract on a date to be fetched."""
+    __slots__ = ('the_date', 'contract', 'full_path', 'retry', 'data', 'request')
+
+    def __init__(self, the_date: date, contract: Contract, full_path: str):
+        self.the_date = the_date
+        self.contract = contract
+        self.full_path = full_path
+        self.retry = RETRY_COUNT
+        self.data = None
+        self.request = None
+
+    @property
+    def key(self):
+        return core.datatools.contract_key(self.contract.exchange, self.contract.secType,
+                                           self.contract.symbol)
+
+    @property
+    def end_datetime(self):
+        return (self.the_date + timedelta(days=1)).strftime("%Y%m%d 00:00:00")
+
+    @property
+    def pacing_key(self):
+        return (self.contract.exchange, self.contract.secType, self.contract.symbol,
+                self.end_datetime, BarSize.Sec30)
+
+
+class BackfillScheduler(object):
+    """Fetches the historical data of many contracts and dates with several requests in flight.
+
+    Requests are issued as soon as the pacer allows and fewer than ``max_outstanding`` are
+    pending. Requests cancelled on error or timed out by the request registry of the client are
+    queued again up to ``RETRY_COUNT`` times.
+    When ``streaming`` the bars are written to disk as they arrive instead of once the request is
+    finished. With a ``manifest`` the fetched files are indexed and the files to fetch are planned
+    from it rather than from the file system.
+    """
+    def __init__(self, tws: TwsClient, root_dir: str, max_outstanding: int = 8, pacer: Pacer = None,
+                 request_time_out: float = REQUEST_TIME_OUT, streaming: bool = True,
+                 manifest: FetchManifest = None):
+        self._tws = tws
+        self._streaming = streaming
+        self._manifest = manifest
+        self._root_dir = root_dir
+        self._max_outstanding = max_outstanding
+        self._pacer = Pacer() if pacer is None else pacer
+        self._request_time_out = request_time_out
+        self._completed = queue.Queue()
+        self._outstanding = {}
+        self.written = []
+        self.failed = []
+
+    def run(self, jobs):
+        """Fetches ``(date, contract)`` pairs that have not been fetched yet."""
+        jobs = [_BackfillJob(the_date, contract, data_file_path(self._root_dir, the_date, contract))
+                for the_date, contract in jobs]
+        if self._manifest is not None and jobs:
+            dates = [job.the_date for job in jobs]
+            fetched = self._manifest.fetched({job.key for job in jobs}, min(dates), max(dates))
+            pending = deque(job for job in jobs if (job.key, job.the_date) not in fetched)
+        else:
+            pending = deque(job for job in jobs if not os.path.exists(job.full_path))
+
+        while pending or self._outstanding:
+            wait = self._issue(pending)
+            try:
+                request = self._completed.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                continue
+            self._complete(request, pending)
+        return self.written
+
+    def _issue(self, pending) -> float:
+        """Issues pending jobs and returns the seconds until the next one may be issued."""
+        while pending and len(self._outstanding) < self._max_outstanding:
+            job = pending[0]
+            if not self._pacer.try_acquire(job.pacing_key):
+                delay = self._pacer.delay(job.pacing_key)
+                PACING_WAITS.observe(delay)
+                return delay
+            pending.popleft()
+            job.data = StreamingHistoricalData(job.full_path) if self._streaming else \
+                HistoricalData()
+            job.request = self._tws.reqHistoricalData(
+                job.data, job.contract, job.end_datetime, bar_size=BarSize.Sec30,
+                timeout=self._request_time_out)
+            self._outstanding[job.request.request_id] = job
+            job.request.add_done_callback(self._completed.put)
+        return self._request_time_out
+
+    def _complete(self, request, pending):
+        job = self._outstanding.get(request.request_id)
+        if job is None or job.request is not request:
+            return
+        del self._outstanding[request.request_id]
+        if request.error is None and request.done.is_set():
+            if not self._streaming:
+                write_file(job.full_path, job.data)
+            if self._manifest is not None:
+                self._manifest.record_file(job.key, job.the_date)
+            self.written.append(job.full_path)
+            print('File "%s" has been written.' % job.full_path)
+        else:
+            print('Error caught from request [%d]: %s' % (request.request_id, request.error))
+            self._retry(job, pending)
+
+    def _retry(self, job, pending):
+        if self._streaming:
+            job.data.discard()
+        job.retry -= 1
+        job.request = None
+        if job.retry > 0:
+            print('Retry fetching symbol "%s" as of %s again - %d try remaining...' %
+                  (job.contract.symbol, job.the_date, job.retry))
+            _RETRIES.inc()
+            pending.append(job)
+        else:
+            print('Unable to fetch "%s" as of %s ' % (job.contract.symbol, job.the_date))
+            if self._manifest is not None:
+                self._manifest.record_failure(job.key, job.the_date)
+            self.failed.append(job.full_path)
+
+
 def historical_from_ib(directory: str, data_range):
     directory = os.path.abspath(directory)
     if not os.path.exists(directory):
@@ -127,14 +343,21 @@ def historical_from_ib(directory: str, data_range):
         hhi.symbol = "HHI.HK"
         hhi.currency = "HKD"
 
-        for the_date in data_range:
-            store_file(directory, tws, the_date, hsi)
-            store_file(directory, tws, the_date, hhi)
+        export = METRICS.start_export(os.path.join(directory, METRICS_FILE))
+        try:
+            with FetchManifest(directory, calendar=HKFE_CALENDAR) as manifest:
+                manifest.scan()
+                scheduler = BackfillScheduler(tws, directory, manifest=manifest)
+                scheduler.run((the_date, contract) for the_date in data_range
+                              for contract in (hsi, hhi))
+        finally:
+            export.set()
+            METRICS.write_prometheus(os.path.join(directory, METRICS_FILE))
 
 def data_date_range():
-    return filter(lambda d: d.weekday() not in [5, 6],
-                  core.datatools.date_range(DATA_END, DATA_START))
+    """Gets the HKFE trading days to fetch, latest first."""
+    return HKFE_CALENDAR.trading_days(DATA_END, DATA_START)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
-    historical_from_ib("../data-market/hk", data_date_range())
+    historical_from_ib(DATA_DIR, data_date_range())
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import os
+import threading
+import time
+from datetime import date
+
+from swigibpy import Contract
+
+import core.datatools
+from core.metrics import METRICS
+from core.manifest import FetchManifest
+from core.tradingcalendar import HKFE_CALENDAR
+from providers.ibtws import TwsClient, BarSize
+from providers.tickbars import BarAggregator
+from tools.ib_data_loader import StreamingHistoricalData, DATA_DIR, METRICS_FILE
+
+CLIENT_ID = 16
+FLUSH_INTERVAL = 1  # Seconds between checks for bars completed without a following tick.
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class DayFileSink(object):
+    """Writes live bars of a contract to the daily files of the CSV tree, in the same format as
+    ``tools.ib_data_loader.store_file``. A day's file is moved into place once the day is over,
+    the file of a day recorded by an earlier run is continued."""
+    def __init__(self, root_dir: str, contract: Contract, manifest: FetchManifest = None):
+        self._root_dir = root_dir
+        self._key = core.datatools.contract_key(contract.exchange, contract.secType,
+                                                contract.symbol)
+        self._manifest = manifest
+        self._date = None
+        self._writer = None
+        self._lock = threading.RLock()  # Called from the reader thread and on flush.
+
+    def __call__(self, date_, open_, high, low, close, volume, bar_count, wap, has_gaps):
+        the_date = date.fromordinal(_EPOCH_ORDINAL + int(date_) // 86400)
+        with self._lock:
+            if the_date != self._date:
+                self.close()
+                self._date = the_date
+                self._writer = StreamingHistoricalData(
+                    os.path.join(self._root_dir, str(the_date), self._key + '.csv'), batch_size=1)
+                self._writer.resume()
+            self._writer.historicalData(None, date_, open_, high, low, close, volume, bar_count,
+                                        wap, has_gaps)
+
+    def close(self):
+        """Moves the file of the current day into place."""
+        with self._lock:
+            if self._writer is None:
+                return
+            self._writer.historicalDataEnd(None)
+            if self._manifest is not None:
+                self._manifest.record_file(self._key, self._date)
+            self._writer = None
+
+
+def record_from_ib(directory: str, contracts, bar_size: BarSize = BarSize.Sec30):
+    """Records live bars of the contracts until interrupted."""
+    directory = os.path.abspath(directory)
+    tws = TwsClient(client_id=CLIENT_ID)
+    # Days recorded from a mid-day start hold fewer bars than expected, the backfill completes them.
+    with tws.connect(), FetchManifest(directory, calendar=HKFE_CALENDAR,
+                                      bar_size=bar_size) as manifest:
+        sinks = [DayFileSink(directory, contract, manifest) for contract in contracts]
+        aggregators = [BarAggregator(bar_size, sink) for sink in sinks]
+        requests = [tws.reqMarketData(aggregator, contract, "")
+                    for aggregator, contract in zip(aggregators, contracts)]
+        export = METRICS.start_export(os.path.join(directory, METRICS_FILE))
+        try:
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                for aggregator in aggregators:
+                    aggregator.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for request in requests:
+                request.cancel()
+            for aggregator, sink in zip(aggregators, sinks):
+                aggregator.flush(force=True)
+                sink.close()
+            export.set()
+            METRICS.write_prometheus(os.path.join(directory, METRICS_FILE))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    HSI = Contract()
+    HSI.exchange = "HKFE"
+    HSI.secType = "IND"
+    HSI.symbol = "HSI"
+    HSI.currency = "HKD"
+
+    HHI = Contract()
+    HHI.exchange = "HKFE"
+    HHI.secType = "IND"
+    HHI.symbol = "HHI.HK"
+    HHI.currency = "HKD"
+    record_from_ib(DATA_DIR, [HSI, HHI])
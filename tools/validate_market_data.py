@@ -0,0 +1,147 @@
+"""Validates, and optionally converts, a whole CSV tree written by ``ib_data_loader``.
+
+Date directories are checked in parallel by a process pool, each worker parses the files of a
+directory and returns their report, and the bars when the tree is converted to a ``BarStore``.
+Reports come back in directory order whatever the number of workers, so the output of two runs
+over the same tree is identical.
+
+Usage::
+
+    $ python -m tools.validate_market_data market-data/ib/hk --store /tmp/bars --workers 8
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import core.datatools
+from core.barstore import BarStore
+
+FileReport = namedtuple('FileReport', ['date', 'contract', 'rows', 'day_rows', 'issues'])
+"""Represents the validation of the file of a contract in a date directory.
+
+Attributes:
+    date (str): name of the date directory.
+    contract (str): contract key, e.g. ``HKFE-IND-HSI``.
+    rows (int): number of bars in the file.
+    day_rows (int): number of bars dated on the directory date, 0 for a holiday.
+    issues (tuple): descriptions of the problems found, empty for a valid file.
+"""
+
+
+def validate_bars(bars: np.ndarray) -> tuple:
+    """Checks bars in file order and returns the descriptions of the problems found."""
+    issues = []
+    steps = np.diff(bars['date'])
+    if np.any(steps == 0):
+        issues.append("%d duplicate bars" % np.count_nonzero(steps == 0))
+    if np.any(steps < 0):
+        issues.append("%d bars out of order" % np.count_nonzero(steps < 0))
+    bad_ohlc = (bars['low'] > np.minimum(bars['open'], bars['close'])) | \
+               (bars['high'] < np.maximum(bars['open'], bars['close'])) | (bars['low'] <= 0)
+    if np.any(bad_ohlc):
+        issues.append("%d bars with inconsistent OHLC" % np.count_nonzero(bad_ohlc))
+    if np.any(bars['volume'] < 0) or np.any(bars['bar_count'] < 0):
+        issues.append("negative volume or bar count")
+    if np.any(bars['has_gaps']):
+        issues.append("%d bars with gaps" % np.count_nonzero(bars['has_gaps']))
+    return tuple(issues)
+
+
+def validate_directory(date_dir: str, keep_bars: bool = False):
+    """Validates the files of a date directory.
+
+    Returns:
+        tuple: the list of ``FileReport`` in file name order, and a dict of the bars per contract
+        when ``keep_bars``, otherwise ``None``.
+    """
+    name = os.path.basename(os.path.normpath(date_dir))
+    day_start = core.datatools.parse_ib_date(name.replace('-', ''))
+    reports = []
+    bars_by_key = {} if keep_bars else None
+    for file_name in sorted(os.listdir(date_dir)):
+        if not file_name.endswith('.csv'):
+            continue
+        key = file_name[:-len('.csv')]
+        try:
+            bars = core.datatools.read_bar_csv(os.path.join(date_dir, file_name))
+        except Exception as e:  # A corrupted file is reported, not fatal.
+            reports.append(FileReport(name, key, 0, 0, ("unreadable: %s" % e,)))
+            continue
+        day_rows = int(np.count_nonzero((bars['date'] >= day_start) &
+                                        (bars['date'] < day_start + 86400)))
+        reports.append(FileReport(name, key, len(bars), day_rows, validate_bars(bars)))
+        if keep_bars:
+            bars_by_key[key] = bars
+    return reports, bars_by_key
+
+
+def ingest(csv_root: str, store_root: str = None, workers: int = None):
+    """Validates every date directory of a CSV tree, and converts it into a ``BarStore`` at
+    ``store_root`` if given.
+
+    Args:
+        workers: number of worker processes, the number of CPUs by default.
+
+    Returns:
+        list: the ``FileReport`` of every file, ordered by date and contract.
+    """
+    date_dirs = [os.path.join(csv_root, name) for name in sorted(os.listdir(csv_root))
+                 if os.path.isdir(os.path.join(csv_root, name))]
+    keep_bars = store_root is not None
+    reports = []
+    bars_by_key = defaultdict(list)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Results are yielded in submission order, chunks amortise the inter-process calls.
+        chunksize = max(1, len(date_dirs) // (4 * (workers or os.cpu_count() or 1)))
+        for dir_reports, dir_bars in executor.map(validate_directory, date_dirs,
+                                                  [keep_bars] * len(date_dirs),
+                                                  chunksize=chunksize):
+            reports.extend(dir_reports)
+            for key, bars in (dir_bars or {}).items():
+                bars_by_key[key].append(bars)
+
+    if keep_bars:
+        store = BarStore(store_root)
+        for key in sorted(bars_by_key):
+            store.write(key, np.concatenate(bars_by_key[key]))
+    return reports
+
+
+def print_report(reports, out=sys.stdout):
+    """Prints the invalid files and a summary per contract."""
+    totals = defaultdict(lambda: [0, 0, 0, 0])
+    for report in reports:
+        total = totals[report.contract]
+        total[0] += 1
+        total[1] += report.day_rows
+        total[2] += report.day_rows == 0 and not report.issues
+        total[3] += bool(report.issues)
+        if report.issues:
+            print("%s %s: %s" % (report.date, report.contract, "; ".join(report.issues)), file=out)
+    for contract in sorted(totals):
+        files, rows, holidays, invalid = totals[contract]
+        print('Contract "%s": %d files, %d bars, %d holidays, %d invalid files.'
+              % (contract, files, rows, holidays, invalid), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('csv_root', help="root of the CSV tree")
+    parser.add_argument('--store', help="root of a BarStore to convert the tree into")
+    parser.add_argument('--workers', type=int, help="number of processes, one per CPU by default")
+    args = parser.parse_args(argv)
+    reports = ingest(args.csv_root, args.store, args.workers)
+    print_report(reports)
+    return 1 if any(report.issues for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())